@@ -0,0 +1,80 @@
+"""Batches of list actions sent by the app, e.g. a mass unfollow.
+
+Every action of a batch is applied in one transaction: the edges are removed
+with one statement per action type and batch of ids, and the account row is
+written once at the end.
+"""
+from django.db import transaction
+from django.db.models import Case, When, F, Value, IntegerField
+from django.db.models.functions import Greatest
+from .models import InstagramUser_data, FollowEdge
+from .edges import parse_ig_id, remove_edges, forget_removed_edges, counter_updates, version_updates
+from .cache import invalidate_account
+
+MAX_ACTIONS = 5000
+
+# Action type -> (remove function, list direction, count column to decrease)
+ACTIONS = {
+    'remove_following': (remove_edges, FollowEdge.FOLLOWING, 'instagram_following_count'),
+    'remove_follower': (remove_edges, FollowEdge.FOLLOWER, 'instagram_follower_count'),
+    'dismiss_unfollowed_you': (forget_removed_edges, FollowEdge.FOLLOWER, None),
+    'dismiss_removed_you': (forget_removed_edges, FollowEdge.FOLLOWING, None),
+}
+
+
+def decrease_counts(account, amounts, counters=None):
+    """Subtract from count columns in one UPDATE, never going below zero.
+
+    amounts maps a column to the number to subtract. Empty counts stay empty.
+    The list counter deltas collected by the edge helpers, if given, are
+    written by the same UPDATE.
+    """
+    amounts = {field: amount for field, amount in amounts.items() if amount}
+    updates = {
+        field: Case(
+            When(**{f'{field}__gt': 0}, then=Greatest(F(field) - amount, Value(0))),
+            default=F(field),
+            output_field=IntegerField(),
+        )
+        for field, amount in amounts.items()
+    }
+    updates.update(counter_updates(counters or {}))
+    if updates:
+        InstagramUser_data.objects.filter(pk=account.pk).update(**updates, **version_updates())
+
+
+@transaction.atomic
+def apply_actions(account, actions):
+    """Apply a list of {"type", "id"} actions and return one result per action.
+
+    The status of a result is "done", "not_found" (the user wasn't in the
+    list) or "invalid".
+    """
+    results = []
+    grouped = {}
+    for action in actions:
+        kind = action.get('type') if isinstance(action, dict) else None
+        ig_id = parse_ig_id(action.get('id')) if kind in ACTIONS else None
+        results.append({
+            "type": kind,
+            "id": str(ig_id) if ig_id else None,
+            "status": "invalid" if ig_id is None else "not_found",
+        })
+        if ig_id is not None:
+            grouped.setdefault(kind, []).append((results[-1], ig_id))
+
+    amounts = {}
+    counters = {}
+    for kind, items in grouped.items():
+        remove, direction, count_field = ACTIONS[kind]
+        done = set(remove(account, direction, list(dict.fromkeys(ig_id for _, ig_id in items)), counters))
+        for result, ig_id in items:
+            if ig_id in done:
+                result["status"] = "done"
+        if count_field:
+            amounts[count_field] = len(done)
+
+    if any(result["status"] == "done" for result in results):
+        decrease_counts(account, amounts, counters)
+        invalidate_account(account.pk)
+    return results
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import InstagramUser_data
+from .models import InstagramUser_data, InstagramProfile, FollowEdge, UploadSession, FollowSnapshot
 
 @admin.register(InstagramUser_data)
 class InstagramUserDataAdmin(admin.ModelAdmin):
@@ -15,14 +15,8 @@ class InstagramUserDataAdmin(admin.ModelAdmin):
         ("Authentication Details", {
             'fields': ('user1_id', 'session_id', 'csrftoken', 'x_ig_app_id')
         }),
-        ("Following  Data", {
-            'fields': ('old_following_list', 'new_following_list')
-        }),
-        ("Followers  Data", {
-            'fields': ('old_followers_list' , 'new_followers_list')
-        }),
-        ("Analysis", {
-            'fields': ('who_removed_following', 'who_removed_follower', 'who_i_follow_he_dont_followback', 'who_i_dont_follow_he_followback')
+        ("Follow Data", {
+            'fields': ('followers_snapshot', 'following_snapshot')
         }),
         ("Instagram Profile Details", {
             'fields': ('instagram_follower_count', 'instagram_following_count', 'instagram_total_posts', 'instagram_biography', 'instagram_profile_picture_url')
@@ -48,4 +42,36 @@ class FrontFlagsAdmin(admin.ModelAdmin):
     search_fields = ('user__username',)  # Make the username searchable
     list_filter = ('is_first_time_connected_flag',)  # Filter by the flag value
 
-admin.site.register(FrontFlags, FrontFlagsAdmin)
\ No newline at end of file
+admin.site.register(FrontFlags, FrontFlagsAdmin)
+
+
+
+@admin.register(InstagramProfile)
+class InstagramProfileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'username', 'full_name', 'is_private', 'is_verified', 'updated_at')
+    search_fields = ('=id', 'username', 'full_name')
+
+
+@admin.register(FollowEdge)
+class FollowEdgeAdmin(admin.ModelAdmin):
+    list_display = ('account', 'direction', 'profile', 'ordinal', 'first_seen_snapshot', 'removed_snapshot')
+    list_filter = ('direction',)
+    search_fields = ('account__user__username', 'profile__username')
+    raw_id_fields = ('account', 'profile')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'account', 'direction', 'status', 'created_at', 'committed_at')
+    list_filter = ('direction', 'status')
+    search_fields = ('account__user__username',)
+    raw_id_fields = ('account',)
+
+
+@admin.register(FollowSnapshot)
+class FollowSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('account', 'direction', 'number', 'taken_at', 'size', 'keyframe')
+    list_filter = ('direction', 'keyframe')
+    search_fields = ('account__user__username',)
+    raw_id_fields = ('account',)
+    exclude = ('ids', 'added', 'removed')
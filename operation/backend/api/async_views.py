@@ -0,0 +1,189 @@
+"""Async versions of the hot read endpoints, for the ASGI server.
+
+Under ASGI (backend.asgi, served by uvicorn) a sync view holds one thread
+from the request until its response is rendered. These views only leave
+the event loop for their queries, through the async ORM. The URLs use them
+instead of the views in views.py when ASYNC_VIEWS is on (see api/urls.py).
+They keep the same paths, JWT authentication, JSON bodies and status codes.
+
+The ORM of Django 5.1 still runs each async query on the thread of
+sync_to_async, one at a time per process. So the views keep to one query
+per request where they can. A list page, which reads Redis and the
+profiles table, runs in one sync_to_async call for the same reason.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from authentication.authentication import CachedJWTAuthentication
+from .models import InstagramUser_data
+from .conditional import VERSION_FIELDS, add_version_headers, not_modified
+from .serializers import InstagramUserDataSerializer
+from .views import connection_status, relationship_page, stats_difference
+
+jwt_authentication = CachedJWTAuthentication()
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    """Render data the way a DRF Response of the sync views is rendered."""
+    return HttpResponse(JSONRenderer().render(data), status=status, headers=headers, content_type='application/json')
+
+
+def error_response(exc):
+    """The response DRF's exception handler gives for an APIException."""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+    headers = None
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        headers = {"WWW-Authenticate": jwt_authentication.authenticate_header(None)}
+    return json_response(data, status=exc.status_code, headers=headers)
+
+
+async def authenticate(request):
+    """The user of the request's JWT, as CachedJWTAuthentication.authenticate finds it.
+
+    Only a user missing from the cache of this process costs a thread hop.
+    """
+    header = jwt_authentication.get_header(request)
+    raw_token = jwt_authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        raise NotAuthenticated()
+    validated_token = jwt_authentication.get_validated_token(raw_token)
+    user = jwt_authentication.get_local_user(validated_token)
+    if user is None:
+        user = await sync_to_async(jwt_authentication.get_user)(validated_token)
+    return user
+
+
+def async_api_view(methods):
+    """@api_view with CachedJWTAuthentication and IsAuthenticated, for an async view."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response({"detail": f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+            try:
+                request.user = await authenticate(request)
+                return await view(request, *args, **kwargs)
+            except APIException as e:
+                return error_response(e)
+        return wrapper
+    return decorator
+
+
+def conditional_on_data_version(view):
+    """Async counterpart of conditional.conditional_on_data_version."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        version = await InstagramUser_data.objects.filter(user=request.user).values(*VERSION_FIELDS).order_by('-pk').afirst()
+        if version is None:
+            return await view(request, *args, **kwargs)
+        return not_modified(request, version) or add_version_headers(await view(request, *args, **kwargs), version)
+    return wrapper
+
+
+@async_api_view(['GET'])
+async def check_instagram_status(request):
+    try:
+        instagram_data = await InstagramUser_data.objects.projection('status').filter(user=request.user).afirst()
+
+        return json_response(connection_status(instagram_data))
+
+    except Exception as e:
+        return json_response({"error": "Internal Server Error", "details": str(e)}, status=500)
+
+
+@async_api_view(['GET'])
+@conditional_on_data_version
+async def get_instagram_user_profile(request):
+    try:
+        instagram_user_data = await InstagramUser_data.objects.projection('profile').aget(user=request.user)
+        return json_response({
+            "success": "User data fetched successfully",
+            "user_data": InstagramUserDataSerializer(instagram_user_data).data,
+        })
+
+    except InstagramUser_data.DoesNotExist:
+        return json_response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    except Exception as e:
+        return json_response({"error": "An error occurred", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def get_unfollowed_status(request):
+    try:
+        instagram_user_data = await InstagramUser_data.objects.projection('unfollowed').aget(user=request.user)
+        return json_response({"unfollowed": instagram_user_data.unfollowed})
+
+    except InstagramUser_data.DoesNotExist:
+        return json_response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    except Exception as e:
+        return json_response({"error": "An error occurred", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def check_12_hours_passed(request):
+    try:
+        user_data = await InstagramUser_data.objects.projection('last_fetch').filter(user=request.user).afirst()
+
+        if not user_data:
+            return json_response({"error": "No Instagram data found for this user"}, status=status.HTTP_404_NOT_FOUND)
+
+        return json_response({"has_12_hours_passed": user_data.has_12_hours_passed_since_last_fetch()})
+
+    except Exception as e:
+        return json_response({"error": "An error occurred", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+@conditional_on_data_version
+async def instagram_stats_difference(request):
+    try:
+        stats = await InstagramUser_data.objects.filter(user=request.user).projection_values('stats').order_by('-pk').afirst()
+
+        if not stats:
+            return json_response({'error': 'Instagram data not found for this user.'}, status=404)
+
+        return json_response(stats_difference(stats))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
+
+
+async def async_paginated_profiles(request, list_name, include_total=False):
+    """Async counterpart of views.paginated_profiles."""
+    try:
+        account_id = await InstagramUser_data.objects.values_list('pk', flat=True).aget(user=request.user)
+    except InstagramUser_data.DoesNotExist:
+        return json_response({"error": "Instagram user data not found"}, status=404)
+
+    response = await sync_to_async(relationship_page)(Request(request), account_id, list_name, include_total)
+    return json_response(response.data)
+
+
+@async_api_view(['GET'])
+@conditional_on_data_version
+async def get_followed_but_not_followed_back(request):
+    return await async_paginated_profiles(request, 'who_i_follow_he_dont_followback')
+
+
+@async_api_view(['GET'])
+@conditional_on_data_version
+async def get_dont_follow_back_you(request):
+    return await async_paginated_profiles(request, 'who_i_dont_follow_he_followback')
+
+
+@async_api_view(['GET'])
+@conditional_on_data_version
+async def get_unfollowed_you(request):
+    return await async_paginated_profiles(request, 'who_removed_follower', include_total=True)
+
+
+@async_api_view(['GET'])
+@conditional_on_data_version
+async def get_who_removed_you(request):
+    return await async_paginated_profiles(request, 'who_removed_following', include_total=True)
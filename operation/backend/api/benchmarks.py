@@ -0,0 +1,400 @@
+"""Benchmarks of the api endpoints on synthetic follower lists.
+
+The lists are generated in the shape of the Instagram friendships API (see
+following_5100464648.json at the root of the repo): every user dict carries
+the same keys, with a signed profile picture URL. The ids start at
+SYNTHETIC_ID_BASE, far above real Instagram ids, so the profiles can be
+deleted afterwards without touching real ones.
+
+Each step sends real requests through the URL conf, JWT authentication and
+rendering, and records:
+
+- latency: the median and 95th percentile over its repeats, in ms;
+- the number of queries;
+- the bytes sent and received;
+- the process's peak RSS so far.
+
+The benchmark_api command runs it and can append the results to a JSON
+lines file, so runs can be compared over time.
+
+ServerBenchmark compares the servers instead: it starts the WSGI (gunicorn,
+sync views) and the ASGI (uvicorn, api.async_views) deployments with the
+same number of workers, and measures the requests per second and latency
+percentiles of the hot reads under concurrent load. The benchmark_servers
+command runs it.
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import InstagramUser_data, InstagramProfile, FollowEdge
+from .diff import LARGE_LIST_SIZE, save_fetched_list
+
+SYNTHETIC_ID_BASE = 10 ** 15
+ID_SPREAD = 70 * 10 ** 9  # Instagram pks are below 70 billion
+PAGE_SIZE = 100  # users per page, as Instagram sends them
+CDN = "https://instagram.ftun2-2.fna.fbcdn.net/v/t51.2885-19"
+
+LIST_ENDPOINTS = (
+    'get_followed_but_not_followed_back',
+    'get_dont_follow_back_you',
+    'get_unfollowed_you',
+    'get_who_removed_you',
+)
+
+
+# The server commands, with the value of ASYNC_VIEWS each one runs with
+SERVERS = {
+    'wsgi': (
+        ['gunicorn', 'backend.wsgi:application', '--workers', '{workers}', '--bind', '127.0.0.1:{port}', '--log-level', 'warning'],
+        'false',
+    ),
+    'asgi': (
+        ['uvicorn', 'backend.asgi:application', '--workers', '{workers}', '--port', '{port}', '--no-access-log', '--log-level', 'warning'],
+        'true',
+    ),
+}
+
+# The hot reads, as (step, url name, query string)
+READ_ENDPOINTS = (
+    ('status', 'check_instagram_status', ''),
+    ('profile', 'get_instagram_user_profile', ''),
+    ('stats', 'instagram_stats_difference', ''),
+    ('list_page', 'get_dont_follow_back_you', ''),
+    ('list_cursor', 'get_dont_follow_back_you', '?pagination=cursor'),
+)
+
+
+def synthetic_user(rng, ig_id):
+    """A user dict like the ones of the Instagram followers/following lists."""
+    pk = str(ig_id)
+    username = f"user_{rng.getrandbits(40):x}"
+    return {
+        "pk": pk,
+        "pk_id": pk,
+        "id": pk,
+        "username": username,
+        "full_name": username.replace("_", " ").title() if rng.random() < 0.8 else "",
+        "is_private": rng.random() < 0.35,
+        "fbid_v2": str(17841400000000000 + rng.getrandbits(32)),
+        "third_party_downloads_enabled": rng.randint(0, 2),
+        "strong_id__": pk,
+        "profile_pic_id": f"{rng.getrandbits(62)}_{pk}",
+        "profile_pic_url": (
+            f"{CDN}/{rng.getrandbits(64)}_n.jpg?stp=dst-jpg_s150x150_tt6&_nc_ht=instagram.ftun2-2.fna.fbcdn.net"
+            f"&_nc_cat=1&_nc_ohc={rng.getrandbits(64):x}&edm=ALB854YBAAAA&ccb=7-5"
+            f"&oh=00_{rng.getrandbits(128):x}&oe={rng.getrandbits(32):X}&_nc_sid=ce9561"
+        ),
+        "is_verified": rng.random() < 0.02,
+        "has_anonymous_profile_picture": rng.random() < 0.05,
+        "account_badges": [],
+        "latest_reel_media": rng.choice([0, 1740153258]),
+        "is_favorite": False,
+    }
+
+
+def synthetic_lists(size, seed=0, mutual_share=0.6):
+    """A following list and a followers list of size users each.
+
+    mutual_share of the users are in both lists.
+    """
+    rng = random.Random(seed)
+    mutual = int(size * mutual_share)
+    ids = rng.sample(range(SYNTHETIC_ID_BASE, SYNTHETIC_ID_BASE + ID_SPREAD), 2 * size - mutual)
+    users = {ig_id: synthetic_user(rng, ig_id) for ig_id in ids}
+    following = [users[ig_id] for ig_id in ids[:size]]
+    followers = [users[ig_id] for ig_id in ids[:mutual] + ids[size:]]
+    rng.shuffle(following)
+    rng.shuffle(followers)
+    return following, followers
+
+
+def churned(users, share, seed=1):
+    """The list refetched after share of it was replaced by new users."""
+    rng = random.Random(seed)
+    changed = int(len(users) * share)
+    new_ids = rng.sample(range(SYNTHETIC_ID_BASE + ID_SPREAD, SYNTHETIC_ID_BASE + 2 * ID_SPREAD), changed)
+    return [synthetic_user(rng, ig_id) for ig_id in new_ids] + users[:len(users) - changed]
+
+
+def percentile(ordered, share):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process, or None where it isn't known (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class QueryCounter:
+    """Counts the queries run on a connection (see connection.execute_wrapper).
+
+    Unlike CaptureQueriesContext it keeps no SQL, so it has no limit and no
+    memory cost on long steps.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class EndpointBenchmark:
+    """Runs the benchmark steps for one synthetic account."""
+
+    def __init__(self, size, repeat=20, churn=0.01, seed=0):
+        self.size = size
+        self.repeat = repeat
+        self.churn = churn
+        self.seed = seed
+        self.results = []
+
+    def request(self, method, name, data=None, query=None, **kwargs):
+        url = reverse(name, kwargs=kwargs or None)
+        body = json.dumps(data) if data is not None else ''
+        start = time.perf_counter()
+        if method == 'get':
+            response = self.client.get(url, query or {})
+        else:
+            response = self.client.post(url, body, content_type='application/json')
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name} answered {response.status_code}: {response.content[:200]!r}")
+        return response, elapsed, len(body), len(response.content)
+
+    def measure(self, step, calls, repeat=1):
+        """Time calls (a function making one or more requests) repeat times."""
+        latencies = []
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            for _ in range(repeat):
+                sent = received = 0
+                total = 0
+                for _, elapsed, bytes_in, bytes_out in calls():
+                    total += elapsed
+                    sent += bytes_in
+                    received += bytes_out
+                latencies.append(total)
+        latencies.sort()
+        result = {
+            "size": self.size,
+            "step": step,
+            "repeat": repeat,
+            "median_ms": round(statistics.median(latencies), 2),
+            "p95_ms": round(percentile(latencies, 0.95), 2),
+            "queries": queries.count // repeat,
+            "bytes_in": sent,
+            "bytes_out": received,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        self.results.append(result)
+        return result
+
+    def upload_pages(self, direction, users):
+        """Begin a chunked upload of a list and send its pages, without committing."""
+        response, *sizes = self.request('post', 'begin_list_upload', {"list": direction})
+        upload_id = response.json()["upload_id"]
+        calls = [(response, *sizes)]
+        for number, start in enumerate(range(0, len(users), PAGE_SIZE)):
+            calls.append(self.request(
+                'post', 'append_list_upload_page', {"page": number, "users": users[start:start + PAGE_SIZE]},
+                upload_id=upload_id,
+            ))
+        return upload_id, calls
+
+    def commit(self, upload_id):
+        return self.request('post', 'commit_list_upload', {}, upload_id=upload_id)
+
+    def upload(self, direction, users):
+        upload_id, calls = self.upload_pages(direction, users)
+        return calls + [self.commit(upload_id)]
+
+    def run(self):
+        following, followers = synthetic_lists(self.size, self.seed)
+        user = User.objects.create_user(username=f"benchmark-{self.size}-{time.monotonic_ns()}")
+        InstagramUser_data.objects.create(
+            user=user, user1_id='0', instagram_follower_count=self.size, instagram_following_count=self.size,
+        )
+        token = RefreshToken.for_user(user).access_token
+        self.client = Client(headers={"authorization": f"Bearer {token}"})
+        try:
+            self.run_steps(following, followers)
+        finally:
+            user.delete()
+            InstagramProfile.objects.filter(id__gte=SYNTHETIC_ID_BASE).delete()
+        return self.results
+
+    def run_steps(self, following, followers):
+        self.measure('save_following', lambda: self.upload('following', following))
+        self.measure('save_followers', lambda: self.upload('followers', followers))
+
+        # A refetch: the pages are staged first, the diff runs at commit
+        refetch = churned(followers, self.churn)
+        upload_id, _ = self.upload_pages('followers', refetch)
+        self.measure('diff', lambda: [self.commit(upload_id)])
+
+        if self.size < LARGE_LIST_SIZE:
+            # The same refetch through the one-request endpoint
+            self.measure('save_single_request', lambda: [
+                self.request('post', 'save_fetched_followers', {"followers_list": churned(refetch, self.churn, seed=2)}),
+            ])
+
+        for name in LIST_ENDPOINTS:
+            self.measure(f'{name}_first_page', lambda: [self.request('get', name)], self.repeat)
+            self.measure(f'{name}_cursor', lambda: [self.request('get', name, query={"pagination": "cursor"})], self.repeat)
+        self.measure('get_dont_follow_back_you_last_page', lambda: [
+            self.request('get', 'get_dont_follow_back_you', query={"page": "last"}),
+        ], self.repeat)
+
+        self.measure('stats', lambda: [self.request('get', 'instagram_stats_difference')], self.repeat)
+        self.measure('home', lambda: [self.request('get', 'home')], self.repeat)
+
+        kept = [user["id"] for user in refetch[:200]]
+        self.measure('remove_following_batch', lambda: [
+            self.request('post', 'remove_following', {"ids": [user["id"] for user in following[:100]]}),
+        ])
+        self.measure('remove_follower_single', lambda: [
+            self.request('post', 'remove_follower', {"id": kept[0]}),
+        ])
+        self.measure('apply_actions', lambda: [
+            self.request('post', 'apply_list_actions', {"actions": [
+                {"type": "remove_follower", "id": ig_id} for ig_id in kept[1:101]
+            ]}),
+        ])
+
+
+async def generate_load(url, headers, concurrency, duration):
+    """GET url from concurrency clients, each sending its next request as soon
+    as the previous one is answered, for duration seconds.
+
+    Returns the latencies of the answered requests in ms, and the number of
+    failed ones.
+    """
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=30) as client:
+        async def send():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                if failed:
+                    errors += 1
+                else:
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*(send() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerBenchmark:
+    """Load the hot reads of one synthetic account on each server in turn.
+
+    The servers run as subprocesses on the configured database, so it must
+    be one they can reach (not an in-memory SQLite database).
+    """
+
+    def __init__(self, size=1000, workers=2, concurrency=32, duration=10, warmup=2, servers=tuple(SERVERS), seed=0):
+        self.size = size
+        self.workers = workers
+        self.concurrency = concurrency
+        self.duration = duration
+        self.warmup = warmup
+        self.servers = servers
+        self.seed = seed
+        self.results = []
+
+    def start_server(self, server, port):
+        command, async_views = SERVERS[server]
+        process = subprocess.Popen(
+            [part.format(workers=self.workers, port=port) for part in command],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "ASYNC_VIEWS": async_views},
+        )
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{server} server exited with code {process.returncode}")
+            try:
+                httpx.get(url + reverse('token-verify'), timeout=1)
+                return process, url
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        process.terminate()
+        raise RuntimeError(f"{server} server did not start on port {port}")
+
+    def measure(self, server, base_url, headers):
+        for step, name, query in READ_ENDPOINTS:
+            url = base_url + reverse(name) + query
+            asyncio.run(generate_load(url, headers, self.concurrency, self.warmup))
+            latencies, errors = asyncio.run(generate_load(url, headers, self.concurrency, self.duration))
+            latencies.sort()
+            self.results.append({
+                "server": server,
+                "workers": self.workers,
+                "concurrency": self.concurrency,
+                "size": self.size,
+                "step": step,
+                "requests": len(latencies),
+                "errors": errors,
+                "rps": round(len(latencies) / self.duration, 1),
+                "median_ms": round(statistics.median(latencies), 2) if latencies else None,
+                "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+            })
+
+    def run(self):
+        following, followers = synthetic_lists(self.size, self.seed)
+        user = User.objects.create_user(username=f"server-benchmark-{self.size}-{time.monotonic_ns()}")
+        account = InstagramUser_data.objects.create(
+            user=user, user1_id='0', session_id='session', csrftoken='csrf', x_ig_app_id='app',
+            instagram_username='benchmark', instagram_follower_count=self.size, instagram_following_count=self.size,
+        )
+        try:
+            save_fetched_list(account, FollowEdge.FOLLOWING, following)
+            save_fetched_list(account, FollowEdge.FOLLOWER, followers)
+            headers = {"Authorization": f"Bearer {RefreshToken.for_user(user).access_token}"}
+            for server in self.servers:
+                process, url = self.start_server(server, free_port())
+                try:
+                    self.measure(server, url, headers)
+                finally:
+                    process.terminate()
+                    process.wait()
+        finally:
+            user.delete()
+            InstagramProfile.objects.filter(id__gte=SYNTHETIC_ID_BASE).delete()
+        return self.results
@@ -0,0 +1,160 @@
+"""Redis cache of the relationship lists read by the paginated endpoints.
+
+Each list of an account is cached as a Redis list of profile ids, so a page
+is one LRANGE plus one IN query on the shared profile table; profiles are
+stored once for every account that lists them, in the database only. Keys
+carry a per-account version that is bumped whenever the account's lists
+change; stale versions simply expire. When Redis is unreachable the lists
+are read from the database instead.
+"""
+import logging
+import redis
+from django.conf import settings
+from django.db import transaction
+from .edges import RELATIONSHIP_LISTS, ordered_for_display
+from .models import InstagramProfile
+from .serializers import InstagramProfileSerializer
+
+logger = logging.getLogger(__name__)
+
+FILL_CHUNK_SIZE = 2000
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=int(settings.REDIS_PORT),
+            db=int(settings.REDIS_DB),
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+        )
+    return _client
+
+
+def cache_enabled():
+    return getattr(settings, 'RELATIONSHIP_CACHE_ENABLED', True)
+
+
+def version_key(account_id):
+    return f"ig:{account_id}:version"
+
+
+def list_key(account_id, version, list_name):
+    return f"ig:{account_id}:v{version}:{list_name}:ids"
+
+
+def length_key(account_id, version, list_name):
+    # Redis can't store empty lists, so each list's length is kept next to it
+    return f"ig:{account_id}:v{version}:{list_name}:ids:length"
+
+
+def invalidate_account(account_id):
+    """Drop the cached lists of an account once the current transaction commits."""
+    if not cache_enabled():
+        return
+
+    def bump_version():
+        try:
+            get_redis().incr(version_key(account_id))
+        except redis.RedisError as e:
+            logger.warning("Could not invalidate cached lists of account %s: %s", account_id, e)
+
+    transaction.on_commit(bump_version)
+
+
+def serialize_profiles(edges):
+    return InstagramProfileSerializer([edge.profile for edge in edges], many=True).data
+
+
+def hydrate_profiles(ig_ids):
+    """Serialize the profiles of a page of ids with one IN query, in page order."""
+    profiles = InstagramProfile.objects.in_bulk(ig_ids)
+    return InstagramProfileSerializer([profiles[ig_id] for ig_id in ig_ids if ig_id in profiles], many=True).data
+
+
+class CachedProfileList:
+    """A relationship list of one account that the paginator can count and slice.
+
+    The first read of a list version copies its ids from the database into
+    Redis; every page after that reads its ids from Redis.
+    """
+
+    def __init__(self, account_id, list_name):
+        self.account_id = account_id
+        self.list_name = list_name
+        self.version = None
+        self.length = None
+        self.use_database = not cache_enabled()
+
+    def database_edges(self):
+        return ordered_for_display(RELATIONSHIP_LISTS[self.list_name](self.account_id))
+
+    def database_ids(self):
+        return RELATIONSHIP_LISTS[self.list_name](self.account_id).order_by('-ordinal').values_list('profile_id', flat=True)
+
+    def fill(self, client):
+        """Copy the list from the database into Redis and return its length."""
+        key = list_key(self.account_id, self.version, self.list_name)
+        ttl = settings.RELATIONSHIP_CACHE_TTL
+        length = 0
+
+        # MULTI/EXEC: two first reads of the same version may both fill the
+        # list, and their commands must not interleave
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(key)
+        chunk = []
+        for ig_id in self.database_ids().iterator(chunk_size=FILL_CHUNK_SIZE):
+            chunk.append(ig_id)
+            if len(chunk) == FILL_CHUNK_SIZE:
+                pipe.rpush(key, *chunk)
+                length += len(chunk)
+                chunk = []
+        if chunk:
+            pipe.rpush(key, *chunk)
+            length += len(chunk)
+        pipe.expire(key, ttl)
+        # Expires just before the list, so a length is never read without its list
+        pipe.set(length_key(self.account_id, self.version, self.list_name), length, ex=ttl - 1)
+        pipe.execute()
+        return length
+
+    def count(self):
+        if self.length is not None:
+            return self.length
+
+        if not self.use_database:
+            try:
+                client = get_redis()
+                self.version = int(client.get(version_key(self.account_id)) or 0)
+                length = client.get(length_key(self.account_id, self.version, self.list_name))
+                self.length = int(length) if length is not None else self.fill(client)
+                return self.length
+            except redis.RedisError as e:
+                logger.warning("Relationship cache unavailable, reading from the database: %s", e)
+                self.use_database = True
+
+        self.length = self.database_edges().count()
+        return self.length
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("CachedProfileList only supports slicing.")
+        start, stop = index.start or 0, index.stop
+
+        if not self.use_database:
+            try:
+                key = list_key(self.account_id, self.version, self.list_name)
+                items = get_redis().lrange(key, start, stop - 1 if stop is not None else -1)
+                return hydrate_profiles([int(item) for item in items])
+            except redis.RedisError as e:
+                logger.warning("Relationship cache unavailable, reading from the database: %s", e)
+                self.use_database = True
+
+        return serialize_profiles(self.database_edges()[start:stop])
@@ -0,0 +1,396 @@
+"""Incremental diff of a fetched followers/following list against the stored edges.
+
+The diff is computed in one pass over the fetched Instagram ids using plain
+sets, then written with a few bulk statements: the new edges, the removed
+ones, the mutual flags that flipped on the other list, one narrow UPDATE
+of the account row (with its list counters) and one row of snapshot history.
+
+Large-account mode: apply_follow_diff keeps the stored list in a dict and
+the other list in a set, over 200 bytes per edge. Lists of LARGE_LIST_SIZE
+ids and more go through apply_large_follow_diff instead, which keeps the
+fetched ids in typed arrays (8 bytes per id plus a few bits), reads the
+stored edges and the other list in profile id order, merging them with the
+sorted fetched ids, and writes BATCH_SIZE edges at a time. Its FollowDiff
+holds arrays in ascending id order and leaves the mutual set empty.
+"""
+import heapq
+import logging
+import time
+from array import array
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import InstagramUser_data, FollowEdge
+from .edges import (
+    BATCH_SIZE, SNAPSHOT_FIELDS, OTHER_DIRECTION, REMOVED_COUNTERS, NOT_MUTUAL_COUNTERS,
+    chunks, save_profiles, active_edges, version_updates,
+)
+from .cache import invalidate_account
+from .snapshots import record_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class FollowDiff:
+    """What changed between the stored list and a fresh fetch."""
+
+    def __init__(self):
+        self.added = []            # new or returning ids, in fetch order
+        self.returning = []        # added ids that had been removed before
+        self.removed = []          # active ids missing from the fetch
+        self.mutual = set()        # fetched ids that are also in the other list
+        self.mutual_gained = []    # other-list edges that become mutual
+        self.mutual_lost = []      # other-list edges that stop being mutual
+        self.not_back_count = 0    # fetched ids missing from the other list
+        self.other_not_back_count = 0  # other-list ids missing from the fetch
+
+    def as_dict(self):
+        return {
+            "added": len(self.added),
+            "removed": len(self.removed),
+            "not_back": self.not_back_count,
+            "other_not_back": self.other_not_back_count,
+        }
+
+
+def diff_follow_lists(stored, fetched_ids, other_ids):
+    """Diff a fetched list against the stored one.
+
+    stored maps each known profile id of this list to its removed_snapshot
+    (None while the edge is active), fetched_ids is the fetched list in order
+    and without duplicates, other_ids the active ids of the other list.
+    """
+    diff = FollowDiff()
+    fetched = set()
+
+    for ig_id in fetched_ids:
+        fetched.add(ig_id)
+        in_other = ig_id in other_ids
+        if in_other:
+            diff.mutual.add(ig_id)
+        else:
+            diff.not_back_count += 1
+
+        if ig_id not in stored:
+            diff.added.append(ig_id)
+        elif stored[ig_id] is not None:
+            diff.added.append(ig_id)
+            diff.returning.append(ig_id)
+        else:
+            continue
+        if in_other:
+            diff.mutual_gained.append(ig_id)
+
+    for ig_id, removed_snapshot in stored.items():
+        if removed_snapshot is None and ig_id not in fetched:
+            diff.removed.append(ig_id)
+            if ig_id in other_ids:
+                diff.mutual_lost.append(ig_id)
+
+    diff.other_not_back_count = len(other_ids) - len(diff.mutual)
+    return diff
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+@transaction.atomic
+def apply_follow_diff(account, direction, fetched_ids):
+    """Diff fetched_ids against the stored list of account and persist the result.
+
+    The profiles must already exist (see save_profiles). Returns the diff and
+    how long each step took, in milliseconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    snapshot_field = SNAPSHOT_FIELDS[direction]
+    other_direction = OTHER_DIRECTION[direction]
+
+    # Lock the account row so two uploads of the same list can't interleave
+    snapshot = InstagramUser_data.objects.select_for_update().values_list(snapshot_field, flat=True).get(pk=account.pk) + 1
+    edges = FollowEdge.objects.filter(account=account, direction=direction)
+    stored = dict(edges.values_list('profile_id', 'removed_snapshot'))
+    other_ids = set(active_edges(account, other_direction).values_list('profile_id', flat=True))
+    timings['load_ms'] = _elapsed_ms(start)
+
+    step = time.perf_counter()
+    diff = diff_follow_lists(stored, fetched_ids, other_ids)
+    timings['diff_ms'] = _elapsed_ms(step)
+
+    step = time.perf_counter()
+    for batch in chunks(diff.returning):
+        edges.filter(profile_id__in=batch).delete()
+
+    # Instagram lists are newest first, so the first new user gets the highest ordinal
+    top = edges.aggregate(top=Max('ordinal'))['top'] or 0
+    FollowEdge.objects.bulk_create(
+        [
+            FollowEdge(
+                account=account,
+                profile_id=ig_id,
+                direction=direction,
+                ordinal=top + len(diff.added) - index,
+                first_seen_snapshot=snapshot,
+                mutual=ig_id in diff.mutual,
+            )
+            for index, ig_id in enumerate(diff.added)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    for batch in chunks(diff.removed):
+        edges.filter(profile_id__in=batch).update(removed_snapshot=snapshot, mutual=False)
+
+    other_edges = active_edges(account, other_direction)
+    for batch in chunks(diff.mutual_gained):
+        other_edges.filter(profile_id__in=batch).update(mutual=True)
+    for batch in chunks(diff.mutual_lost):
+        other_edges.filter(profile_id__in=batch).update(mutual=False)
+
+    # The counters are recomputed from the diff, so any drift is corrected here
+    removed_before = sum(1 for removed_snapshot in stored.values() if removed_snapshot is not None)
+    counters = {
+        REMOVED_COUNTERS[direction]: removed_before - len(diff.returning) + len(diff.removed),
+        NOT_MUTUAL_COUNTERS[direction]: diff.not_back_count,
+        NOT_MUTUAL_COUNTERS[other_direction]: diff.other_not_back_count,
+    }
+
+    # One narrow UPDATE of the account row instead of re-saving every column
+    fetched_at = timezone.now()
+    InstagramUser_data.objects.filter(pk=account.pk).update(**{
+        snapshot_field: snapshot,
+        'last_time_fetched': fetched_at,
+        **counters,
+        **version_updates(),
+    })
+    setattr(account, snapshot_field, snapshot)
+    account.last_time_fetched = fetched_at
+    for field, value in counters.items():
+        setattr(account, field, value)
+    record_snapshot(account, direction, snapshot, fetched_ids, diff)
+    invalidate_account(account.pk)
+    timings['write_ms'] = _elapsed_ms(step)
+    timings['total_ms'] = _elapsed_ms(start)
+
+    logger.info(
+        "Diffed %s list of account %s: %s fetched, %s added, %s removed in %s",
+        direction, account.pk, len(fetched_ids), len(diff.added), len(diff.removed), timings,
+    )
+    return diff, timings
+
+
+# Lists of this many ids or more are diffed in large-account mode
+LARGE_LIST_SIZE = 20000
+
+# The fetched ids are sorted this many at a time, then merged
+SORT_RUN = 50000
+
+
+def id_array(ig_ids=()):
+    return array('q', ig_ids)
+
+
+def sorted_first_positions(fetched_ids):
+    """The distinct ids of a list in ascending order, with the position where each first appears."""
+    # Sort the positions of each run by id; the sort is stable, so the
+    # positions of one id stay in order
+    runs = [
+        array('i', sorted(range(start, min(start + SORT_RUN, len(fetched_ids))), key=fetched_ids.__getitem__))
+        for start in range(0, len(fetched_ids), SORT_RUN)
+    ]
+
+    ig_ids, positions = id_array(), array('i')
+    for ig_id, position in heapq.merge(*(((fetched_ids[p], p) for p in run) for run in runs)):
+        # The first occurrence of an id comes first: the pairs sort by position too
+        if not ig_ids or ig_ids[-1] != ig_id:
+            ig_ids.append(ig_id)
+            positions.append(position)
+    return ig_ids, positions
+
+
+def ordered_rows(queryset, *fields):
+    return queryset.order_by('profile_id').values_list('profile_id', *fields).iterator(chunk_size=BATCH_SIZE)
+
+
+class Bitmap:
+    """One bit per position of the fetched list."""
+
+    def __init__(self, size):
+        self.bits = bytearray((size + 7) // 8)
+
+    def set(self, index):
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+    def __getitem__(self, index):
+        return self.bits[index >> 3] >> (index & 7) & 1
+
+
+def merge_follow_lists(account, direction, fetched_ids):
+    """Diff the fetched ids against the stored edges, reading both in id order.
+
+    Returns the diff, with its id lists in ascending order, the distinct
+    fetched ids in ascending order and two bitmaps over the fetched
+    positions: the ids to add and the ids that are also in the other list.
+    """
+    diff = FollowDiff()
+    diff.added, diff.returning, diff.removed = id_array(), id_array(), id_array()
+    diff.mutual_gained, diff.mutual_lost = id_array(), id_array()
+    unique_ids, first_positions = sorted_first_positions(fetched_ids)
+    added = Bitmap(len(fetched_ids))
+    mutual = Bitmap(len(fetched_ids))
+
+    stored = ordered_rows(FollowEdge.objects.filter(account=account, direction=direction), 'removed_snapshot')
+    other = ordered_rows(active_edges(account, OTHER_DIRECTION[direction]))
+    stored_row = next(stored, None)
+    other_row = next(other, None)
+    other_count = mutual_count = 0
+
+    def other_has(ig_id):
+        nonlocal other_row, other_count
+        while other_row is not None and other_row[0] < ig_id:
+            other_row = next(other, None)
+            other_count += 1
+        return other_row is not None and other_row[0] == ig_id
+
+    for ig_id, position in zip(unique_ids, first_positions):
+        # Stored active edges with a smaller id were not fetched
+        while stored_row is not None and stored_row[0] < ig_id:
+            if stored_row[1] is None:
+                diff.removed.append(stored_row[0])
+                if other_has(stored_row[0]):
+                    diff.mutual_lost.append(stored_row[0])
+            stored_row = next(stored, None)
+
+        in_other = other_has(ig_id)
+        if in_other:
+            mutual.set(position)
+            mutual_count += 1
+
+        if stored_row is not None and stored_row[0] == ig_id:
+            is_removed = stored_row[1] is not None
+            stored_row = next(stored, None)
+            if not is_removed:
+                continue
+            diff.returning.append(ig_id)
+        added.set(position)
+        diff.added.append(ig_id)
+        if in_other:
+            diff.mutual_gained.append(ig_id)
+
+    while stored_row is not None:
+        if stored_row[1] is None:
+            diff.removed.append(stored_row[0])
+            if other_has(stored_row[0]):
+                diff.mutual_lost.append(stored_row[0])
+        stored_row = next(stored, None)
+    while other_row is not None:
+        other_row = next(other, None)
+        other_count += 1
+
+    diff.not_back_count = len(unique_ids) - mutual_count
+    diff.other_not_back_count = other_count - mutual_count
+    return diff, unique_ids, added, mutual
+
+
+@transaction.atomic
+def apply_large_follow_diff(account, direction, fetched_ids):
+    """Like apply_follow_diff, for a fetched list given as an array in fetch order.
+
+    Duplicate ids are allowed; the first occurrence counts.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    snapshot_field = SNAPSHOT_FIELDS[direction]
+    other_direction = OTHER_DIRECTION[direction]
+    snapshot = InstagramUser_data.objects.select_for_update().values_list(snapshot_field, flat=True).get(pk=account.pk) + 1
+    edges = FollowEdge.objects.filter(account=account, direction=direction)
+    removed_before = edges.filter(removed_snapshot__isnull=False).count()
+
+    diff, unique_ids, added, mutual = merge_follow_lists(account, direction, fetched_ids)
+    timings['diff_ms'] = _elapsed_ms(start)
+
+    step = time.perf_counter()
+    for batch in chunks(diff.returning):
+        edges.filter(profile_id__in=batch).delete()
+
+    # Walk the fetched list once, adding the new edges in fetch order
+    top = edges.aggregate(top=Max('ordinal'))['top'] or 0
+    ordinal = top + len(diff.added)
+    pending = []
+    for position, ig_id in enumerate(fetched_ids):
+        if not added[position]:
+            continue
+        pending.append(FollowEdge(
+            account=account,
+            profile_id=ig_id,
+            direction=direction,
+            ordinal=ordinal,
+            first_seen_snapshot=snapshot,
+            mutual=bool(mutual[position]),
+        ))
+        ordinal -= 1
+        if len(pending) == BATCH_SIZE:
+            FollowEdge.objects.bulk_create(pending)
+            pending = []
+    FollowEdge.objects.bulk_create(pending)
+
+    for batch in chunks(diff.removed):
+        edges.filter(profile_id__in=batch).update(removed_snapshot=snapshot, mutual=False)
+
+    other_edges = active_edges(account, other_direction)
+    for batch in chunks(diff.mutual_gained):
+        other_edges.filter(profile_id__in=batch).update(mutual=True)
+    for batch in chunks(diff.mutual_lost):
+        other_edges.filter(profile_id__in=batch).update(mutual=False)
+
+    counters = {
+        REMOVED_COUNTERS[direction]: removed_before - len(diff.returning) + len(diff.removed),
+        NOT_MUTUAL_COUNTERS[direction]: diff.not_back_count,
+        NOT_MUTUAL_COUNTERS[other_direction]: diff.other_not_back_count,
+    }
+    fetched_at = timezone.now()
+    InstagramUser_data.objects.filter(pk=account.pk).update(**{
+        snapshot_field: snapshot,
+        'last_time_fetched': fetched_at,
+        **counters,
+        **version_updates(),
+    })
+    setattr(account, snapshot_field, snapshot)
+    account.last_time_fetched = fetched_at
+    for field, value in counters.items():
+        setattr(account, field, value)
+    record_snapshot(account, direction, snapshot, unique_ids, diff, presorted=True)
+    invalidate_account(account.pk)
+    timings['write_ms'] = _elapsed_ms(step)
+    timings['total_ms'] = _elapsed_ms(start)
+
+    logger.info(
+        "Diffed large %s list of account %s: %s fetched, %s added, %s removed in %s",
+        direction, account.pk, len(unique_ids), len(diff.added), len(diff.removed), timings,
+    )
+    return diff, timings
+
+
+def apply_fetched_ids(account, direction, fetched_ids):
+    """Apply a fetched list of ids, in large-account mode if it is long."""
+    if len(fetched_ids) >= LARGE_LIST_SIZE:
+        return apply_large_follow_diff(account, direction, id_array(fetched_ids))
+    return apply_follow_diff(account, direction, list(dict.fromkeys(fetched_ids)))
+
+
+def save_fetched_list(account, direction, users):
+    """Store a fetched followers/following list (user dicts) for an account.
+
+    Returns the diff, the timings and the sizes of the list before and after
+    compaction (see edges.compact_users).
+    """
+    start = time.perf_counter()
+    ig_ids, sizes = save_profiles(users)
+    profiles_ms = _elapsed_ms(start)
+
+    diff, timings = apply_fetched_ids(account, direction, ig_ids)
+    timings['profiles_ms'] = profiles_ms
+    return diff, timings, sizes
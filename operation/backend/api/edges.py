@@ -0,0 +1,261 @@
+"""Read/write helpers for the follower/following edge store (FollowEdge)."""
+import json
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F
+from django.utils import timezone
+from .models import InstagramUser_data, InstagramProfile, FollowEdge
+
+BATCH_SIZE = 1000
+
+SNAPSHOT_FIELDS = {
+    FollowEdge.FOLLOWER: 'followers_snapshot',
+    FollowEdge.FOLLOWING: 'following_snapshot',
+}
+
+OTHER_DIRECTION = {
+    FollowEdge.FOLLOWER: FollowEdge.FOLLOWING,
+    FollowEdge.FOLLOWING: FollowEdge.FOLLOWER,
+}
+
+# Counter columns of the account row, kept in step with the edges
+REMOVED_COUNTERS = {
+    FollowEdge.FOLLOWER: 'unfollowed_you_count',
+    FollowEdge.FOLLOWING: 'removed_following_count',
+}
+NOT_MUTUAL_COUNTERS = {
+    FollowEdge.FOLLOWING: 'dont_follow_back_count',
+    FollowEdge.FOLLOWER: 'you_dont_follow_back_count',
+}
+
+
+def chunks(items, size=BATCH_SIZE):
+    """Split a list of ids into chunks that are safe to use in an IN clause."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_ig_id(value):
+    """Return an Instagram pk as an int, or None if it is not one."""
+    try:
+        ig_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return ig_id if ig_id > 0 else None
+
+
+def user_ig_id(user):
+    """Get the Instagram pk of a user dict sent by the app or the Instagram API."""
+    if not isinstance(user, dict):
+        return None
+    for key in ('id', 'pk', 'pk_id'):
+        ig_id = parse_ig_id(user.get(key))
+        if ig_id:
+            return ig_id
+    return None
+
+
+# Default of every profile field the app can show. INSTAGRAM_PROFILE_FIELDS
+# picks the ones kept from the fetched user dicts; the others stay at their
+# default and every other key Instagram sends is dropped.
+PROFILE_DEFAULTS = {
+    'username': '',
+    'full_name': '',
+    'profile_pic_url': '',
+    'is_private': False,
+    'is_verified': False,
+}
+
+PROFILE_FIELDS = list(settings.INSTAGRAM_PROFILE_FIELDS)
+if set(PROFILE_FIELDS) - set(PROFILE_DEFAULTS):
+    raise ImproperlyConfigured(
+        f"INSTAGRAM_PROFILE_FIELDS may only contain {', '.join(PROFILE_DEFAULTS)}."
+    )
+
+
+def compact_user(ig_id, user):
+    """Keep the whitelisted fields of a user dict, with the types of the profile columns."""
+    compact = {'id': ig_id}
+    for field in PROFILE_FIELDS:
+        value = user.get(field)
+        if isinstance(PROFILE_DEFAULTS[field], bool):
+            compact[field] = bool(value)
+        else:
+            compact[field] = str(value) if value else ''
+    return compact
+
+
+def json_size(value):
+    return len(json.dumps(value, separators=(',', ':'), default=str).encode())
+
+
+def compact_users(users):
+    """Compact a fetched list: one whitelisted dict per Instagram id, in order.
+
+    Returns the compacted dicts by id and the size of the list before and
+    after compaction.
+    """
+    compacted = {}
+    for user in users:
+        ig_id = user_ig_id(user)
+        if ig_id and ig_id not in compacted:
+            compacted[ig_id] = compact_user(ig_id, user)
+
+    sizes = {
+        'users': len(compacted),
+        'bytes_in': json_size(users),
+        'bytes_out': json_size(list(compacted.values())),
+    }
+    return compacted, sizes
+
+
+def save_profiles(users):
+    """Upsert the profiles of a fetched list into the shared profile table.
+
+    Only profiles that are new or whose displayed fields changed are written.
+    Returns the Instagram ids of the list, in order and without duplicates,
+    and the sizes reported by compact_users.
+    """
+    compacted, sizes = compact_users(users)
+    profiles = {ig_id: InstagramProfile(**compact) for ig_id, compact in compacted.items()}
+
+    ig_ids = list(profiles)
+    changed = []
+    for batch in chunks(ig_ids):
+        stored = {
+            row[0]: row[1:]
+            for row in InstagramProfile.objects.filter(id__in=batch).values_list('id', *PROFILE_FIELDS)
+        }
+        for ig_id in batch:
+            profile = profiles[ig_id]
+            if stored.get(ig_id) != tuple(getattr(profile, field) for field in PROFILE_FIELDS):
+                changed.append(profile)
+
+    InstagramProfile.objects.bulk_create(
+        changed,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['id'],
+        update_fields=PROFILE_FIELDS + ['updated_at'],
+    )
+    return ig_ids, sizes
+
+
+def active_edges(account, direction):
+    return FollowEdge.objects.filter(account=account, direction=direction, removed_snapshot__isnull=True)
+
+
+def removed_edges(account, direction):
+    return FollowEdge.objects.filter(account=account, direction=direction, removed_snapshot__isnull=False)
+
+
+def counter_updates(counters):
+    """UPDATE expressions adding deltas to the counter columns of the account row."""
+    return {field: F(field) + delta for field, delta in counters.items() if delta}
+
+
+def version_updates():
+    """UPDATE values marking the data of the account row as changed (see api.conditional)."""
+    return {'data_version': F('data_version') + 1, 'data_modified': timezone.now()}
+
+
+def update_counters(account, counters):
+    updates = counter_updates(counters)
+    if updates:
+        InstagramUser_data.objects.filter(pk=account.pk).update(**updates, **version_updates())
+
+
+def remove_edge(account, direction, ig_id, counters=None):
+    """Delete an active edge, e.g. after the user unfollowed someone from the app.
+
+    The matching edge of the other list, if any, stops being mutual.
+    Returns False when the edge doesn't exist.
+    """
+    return bool(remove_edges(account, direction, [ig_id], counters))
+
+
+def remove_edges(account, direction, ig_ids, counters=None):
+    """Delete many active edges at once, like remove_edge.
+
+    The counters of the account are updated too, or the deltas are added to
+    the counters dict when one is given, for the caller to write.
+    Returns the ids that were in the list.
+    """
+    other_direction = OTHER_DIRECTION[direction]
+    deltas = {}
+    removed = []
+    for batch in chunks(ig_ids):
+        found = dict(active_edges(account, direction).filter(profile_id__in=batch).values_list('profile_id', 'mutual'))
+        if found:
+            active_edges(account, direction).filter(profile_id__in=found).delete()
+            mutual = [ig_id for ig_id, is_mutual in found.items() if is_mutual]
+            unpaired = active_edges(account, other_direction).filter(profile_id__in=mutual, mutual=True).update(mutual=False)
+            add_deltas(deltas, {
+                NOT_MUTUAL_COUNTERS[direction]: len(mutual) - len(found),
+                NOT_MUTUAL_COUNTERS[other_direction]: unpaired,
+            })
+            removed.extend(found)
+    apply_deltas(account, deltas, counters)
+    return removed
+
+
+def forget_removed_edges(account, direction, ig_ids, counters=None):
+    """Drop entries of the unfollowed you / removed you lists.
+
+    The counters are handled like in remove_edges.
+    Returns the ids that were in the list.
+    """
+    forgotten = []
+    for batch in chunks(ig_ids):
+        found = list(removed_edges(account, direction).filter(profile_id__in=batch).values_list('profile_id', flat=True))
+        if found:
+            removed_edges(account, direction).filter(profile_id__in=found).delete()
+            forgotten.extend(found)
+    apply_deltas(account, {REMOVED_COUNTERS[direction]: -len(forgotten)}, counters)
+    return forgotten
+
+
+def add_deltas(counters, deltas):
+    for field, delta in deltas.items():
+        counters[field] = counters.get(field, 0) + delta
+
+
+def apply_deltas(account, deltas, counters):
+    if counters is None:
+        update_counters(account, deltas)
+    else:
+        add_deltas(counters, deltas)
+
+
+def who_i_follow_he_dont_followback(account):
+    """Accounts the user follows that don't follow them back."""
+    return active_edges(account, FollowEdge.FOLLOWING).filter(mutual=False)
+
+
+def who_i_dont_follow_he_followback(account):
+    """Followers the user doesn't follow back."""
+    return active_edges(account, FollowEdge.FOLLOWER).filter(mutual=False)
+
+
+def who_removed_follower(account):
+    """Followers that disappeared from the followers list (they unfollowed you)."""
+    return removed_edges(account, FollowEdge.FOLLOWER)
+
+
+def who_removed_following(account):
+    """Accounts that disappeared from the following list."""
+    return removed_edges(account, FollowEdge.FOLLOWING)
+
+
+def ordered_for_display(edges):
+    """Order a list of edges the way the app shows it and load their profiles."""
+    return edges.select_related('profile').order_by('-ordinal')
+
+
+# The lists served by the paginated endpoints, by name
+RELATIONSHIP_LISTS = {
+    'who_i_follow_he_dont_followback': who_i_follow_he_dont_followback,
+    'who_i_dont_follow_he_followback': who_i_dont_follow_he_followback,
+    'who_removed_follower': who_removed_follower,
+    'who_removed_following': who_removed_following,
+}
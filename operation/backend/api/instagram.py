@@ -0,0 +1,126 @@
+"""HTTP client for the Instagram web API.
+
+One InstagramClient keeps a pool of keep-alive connections that every call
+reuses, whichever account it is made for; the account's cookies travel in
+the headers of each request. HTTP/2 is used when the h2 package is
+installed, so concurrent requests share one connection.
+"""
+import json
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+BASE_URL = "https://www.instagram.com"
+REQUEST_TIMEOUT = 15
+PROFILE_DOC_ID = "9707764636006837"  # PolarisProfilePageContentQuery
+
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+FRIENDSHIP_PATHS = {
+    'follower': 'followers',
+    'following': 'following',
+}
+
+
+class FetchError(Exception):
+    """Raised when Instagram doesn't return what was asked for."""
+
+
+def decode_json(response):
+    """The JSON body of a response; a login page or any other HTML raises FetchError."""
+    try:
+        return response.json()
+    except ValueError as e:
+        raise FetchError(f"{response.request.url.path} answered {response.status_code} without JSON: {e}") from e
+
+
+class InstagramClient:
+    """Pooled async client for the endpoints the backend calls.
+
+    Use it as an async context manager, or call close() when done. Every
+    method takes the InstagramUser_data whose session makes the request,
+    raises httpx.HTTPStatusError on an error status, FetchError on a body
+    that isn't JSON, and returns the decoded JSON body.
+    """
+
+    def __init__(self, http2=None, transport=None, timeout=REQUEST_TIMEOUT):
+        self.http = httpx.AsyncClient(
+            base_url=BASE_URL,
+            http2=HTTP2_AVAILABLE if http2 is None else http2,
+            limits=LIMITS,
+            timeout=timeout,
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.http.aclose()
+
+    def headers(self, account, referer=None):
+        return {
+            "cookie": f"csrftoken={account.csrftoken}; ds_user_id={account.user1_id}; sessionid={account.session_id}",
+            "referer": referer or f"{BASE_URL}/",
+            "x-csrftoken": account.csrftoken,
+            "x-ig-app-id": account.x_ig_app_id,
+        }
+
+    async def get(self, account, path, params=None, referer=None):
+        response = await self.http.get(path, params=params, headers=self.headers(account, referer))
+        response.raise_for_status()
+        return decode_json(response)
+
+    async def friendships(self, account, direction, count, max_id=None):
+        """One page of the followers or following list of the account.
+
+        Returns {"users": [...], "next_max_id": ...}; next_max_id is missing
+        on the last page.
+        """
+        path = FRIENDSHIP_PATHS[direction]
+        params = {'count': count}
+        if max_id:
+            params['max_id'] = max_id
+        return await self.get(
+            account,
+            f"/api/v1/friendships/{account.user1_id}/{path}/",
+            params=params,
+            referer=f"{BASE_URL}/{account.user1_id}/{path}/?next=/",
+        )
+
+    async def user_info(self, account, user_id=None):
+        """Profile of a user ({"user": {...}}), the account itself by default."""
+        user_id = user_id or account.user1_id
+        return await self.get(account, f"/api/v1/users/{user_id}/info/")
+
+    async def graphql_profile(self, account, user_id, doc_id=PROFILE_DOC_ID):
+        """Profile page data of a user from the GraphQL endpoint."""
+        data = {
+            "doc_id": doc_id,
+            "variables": json.dumps({"id": str(user_id), "render_surface": "PROFILE"}),
+            "server_timestamps": "true",
+        }
+        headers = self.headers(account)
+        headers["content-type"] = "application/x-www-form-urlencoded"
+        response = await self.http.post("/graphql/query", data=data, headers=headers)
+        response.raise_for_status()
+        return decode_json(response)
+
+    async def inbox(self, account):
+        """Direct message threads of the account."""
+        return await self.get(account, "/api/v1/direct_v2/inbox/")
+
+    async def topsearch(self, account, query):
+        """Users, hashtags and places matching a search query."""
+        return await self.get(
+            account,
+            "/api/v1/web/search/topsearch/",
+            params={'context': 'blended', 'query': query, 'include_reel': 'false'},
+        )
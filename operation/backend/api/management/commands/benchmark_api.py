@@ -0,0 +1,38 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from api.benchmarks import EndpointBenchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the api endpoints (save, diff, paginated reads, stats, removals) "
+        "on synthetic follower lists, against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 50000, 200000], help="List sizes to run.")
+        parser.add_argument('--repeat', type=int, default=20, help="Requests per read step.")
+        parser.add_argument('--churn', type=float, default=0.01, help="Share of the followers replaced by the refetch.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Append the results to this JSON lines file.")
+
+    def handle(self, *args, **options):
+        # With DEBUG on every statement is kept in connection.queries, which
+        # inflates the memory of the large runs
+        settings.DEBUG = False
+        run_at = timezone.now().isoformat()
+
+        self.stdout.write(f"{'size':<8} {'step':<44} {'median ms':>10} {'p95 ms':>9} {'queries':>8} {'bytes in':>11} {'bytes out':>10} {'RSS MB':>7}")
+        for size in options['sizes']:
+            benchmark = EndpointBenchmark(size, options['repeat'], options['churn'], options['seed'])
+            for result in benchmark.run():
+                self.stdout.write(
+                    f"{result['size']:<8} {result['step']:<44} {result['median_ms']:>10} {result['p95_ms']:>9} "
+                    f"{result['queries']:>8} {result['bytes_in']:>11} {result['bytes_out']:>10} {'-' if result['peak_rss_mb'] is None else result['peak_rss_mb']:>7}"
+                )
+                if options['output']:
+                    with open(options['output'], 'a') as output:
+                        output.write(json.dumps({"run_at": run_at, "database": connection.vendor, **result}) + "\n")
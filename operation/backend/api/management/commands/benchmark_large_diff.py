@@ -0,0 +1,75 @@
+import time
+import tracemalloc
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api import diff as follow_diff
+from api.models import InstagramUser_data, InstagramProfile, FollowEdge
+from api.edges import BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the peak memory and latency of the follow diff on synthetic lists, "
+        "in memory and in large-account mode. Nothing is kept in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=[20000, 100000, 500000], help="List sizes to measure.")
+        parser.add_argument('--churn', type=float, default=0.01, help="Share of the list replaced between two fetches.")
+        parser.add_argument('--in-memory-max', type=int, default=100000, help="Largest size also measured without large-account mode.")
+        parser.add_argument(
+            '--memory', action='store_true',
+            help="Trace the peak memory of each diff. Tracing slows it down, so the seconds are only comparable between runs with the same setting.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("size     mode       fetch   peak MB   seconds")
+        self.trace = options['memory']
+        # With DEBUG on, every statement is kept in connection.queries and
+        # counted as memory used by the diff
+        settings.DEBUG = False
+        for size in options['sizes']:
+            modes = [('large', 1)]
+            if size <= options['in_memory_max']:
+                modes.insert(0, ('in-memory', size + 1))
+            for mode, large_list_size in modes:
+                for fetch, peak, seconds in self.measure(size, options['churn'], large_list_size):
+                    self.stdout.write(f"{size:<8} {mode:<10} {fetch:<7} {peak:>7.1f}   {seconds:>7.2f}")
+
+    def measure(self, size, churn, large_list_size):
+        changed = int(size * churn)
+        first = list(range(1, size + 1))
+        # Newest first: the new ids lead the list and the oldest ones leave it
+        second = list(range(size + changed, size, -1)) + first[:size - changed]
+        # Half of the other list follows back
+        other = list(range(1, size + 1, 2))
+
+        results = []
+        saved_size = follow_diff.LARGE_LIST_SIZE
+        follow_diff.LARGE_LIST_SIZE = large_list_size
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username=f"benchmark-{size}-{time.monotonic_ns()}")
+                account = InstagramUser_data.objects.create(user=user, user1_id='0')
+                InstagramProfile.objects.bulk_create(
+                    (InstagramProfile(id=ig_id) for ig_id in range(1, size + changed + 1)),
+                    batch_size=BATCH_SIZE,
+                    ignore_conflicts=True,
+                )
+                follow_diff.apply_fetched_ids(account, FollowEdge.FOLLOWING, other)
+
+                for fetch, ig_ids in (('first', first), ('churn', second)):
+                    if self.trace:
+                        tracemalloc.start()
+                    start = time.perf_counter()
+                    follow_diff.apply_fetched_ids(account, FollowEdge.FOLLOWER, ig_ids)
+                    seconds = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1] / 1e6 if self.trace else float('nan')
+                    tracemalloc.stop()
+                    results.append((fetch, peak, seconds))
+                transaction.set_rollback(True)
+        finally:
+            follow_diff.LARGE_LIST_SIZE = saved_size
+        return results
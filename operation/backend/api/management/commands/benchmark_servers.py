@@ -0,0 +1,42 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from api.benchmarks import SERVERS, ServerBenchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the requests per second and p99 latency of the hot read endpoints "
+        "under the WSGI server (gunicorn) and the ASGI server (uvicorn, async views), "
+        "with the same number of workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000, help="Size of the synthetic following and followers lists.")
+        parser.add_argument('--workers', type=int, default=2, help="Worker processes of each server.")
+        parser.add_argument('--concurrency', type=int, default=32, help="Concurrent clients.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds of load per endpoint.")
+        parser.add_argument('--warmup', type=float, default=2, help="Seconds of unmeasured load before each endpoint.")
+        parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+        parser.add_argument('--output', help="Append the results to this JSON lines file.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("The servers run in their own processes and can't share an in-memory database.")
+
+        benchmark = ServerBenchmark(
+            options['size'], options['workers'], options['concurrency'], options['duration'],
+            options['warmup'], options['servers'],
+        )
+        run_at = timezone.now().isoformat()
+
+        self.stdout.write(f"{'server':<7} {'step':<12} {'requests':>9} {'errors':>7} {'req/s':>8} {'median ms':>10} {'p99 ms':>9}")
+        for result in benchmark.run():
+            self.stdout.write(
+                f"{result['server']:<7} {result['step']:<12} {result['requests']:>9} {result['errors']:>7} "
+                f"{result['rps']:>8} {result['median_ms']!s:>10} {result['p99_ms']!s:>9}"
+            )
+            if options['output']:
+                with open(options['output'], 'a') as output:
+                    output.write(json.dumps({"run_at": run_at, "database": connection.vendor, **result}) + "\n")
@@ -0,0 +1,37 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from api.models import InstagramUser_data
+from api.services import refresh_accounts
+
+
+class Command(BaseCommand):
+    help = "Fetch the followers and following lists of accounts from Instagram and store them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Usernames of the app users to refresh.")
+        parser.add_argument('--all', action='store_true', help="Refresh every connected account.")
+
+    def handle(self, *args, **options):
+        if not options['usernames'] and not options['all']:
+            raise CommandError("Give usernames or --all.")
+
+        accounts = InstagramUser_data.objects.projection('status').exclude(session_id='')
+        if not options['all']:
+            accounts = accounts.filter(user__username__in=options['usernames'])
+        accounts = list(accounts)
+
+        outcomes = asyncio.run(refresh_accounts(accounts))
+
+        failed = 0
+        for account in accounts:
+            outcome = outcomes[account.pk]
+            if isinstance(outcome, Exception):
+                failed += 1
+                self.stderr.write(f"Account {account.pk}: {outcome}")
+            else:
+                changes = ", ".join(
+                    f"{direction}s {diff.as_dict()} {stats.as_dict()}" for direction, (diff, stats) in outcome.items()
+                )
+                self.stdout.write(f"Account {account.pk}: {changes}")
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {len(accounts) - failed} of {len(accounts)} accounts."))
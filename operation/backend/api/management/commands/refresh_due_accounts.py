@@ -0,0 +1,19 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from api.refresh import run_refresh_worker
+
+
+class Command(BaseCommand):
+    help = "Refresh the follower/following lists of accounts as they come due (every 12 hours)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Refresh the accounts due now and exit, e.g. from cron.")
+
+    def handle(self, *args, **options):
+        try:
+            counts = asyncio.run(run_refresh_worker(once=options['once']))
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed {counts['refreshed']} accounts, {counts['failed']} failed."
+        ))
@@ -0,0 +1,128 @@
+# Generated by Django 5.1.5 on 2025-04-20 11:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_lists_to_edges(apps, schema_editor):
+    """Move the JSON follower/following lists of every account into FollowEdge."""
+    InstagramUser_data = apps.get_model('api', 'InstagramUser_data')
+    InstagramProfile = apps.get_model('api', 'InstagramProfile')
+    FollowEdge = apps.get_model('api', 'FollowEdge')
+
+    def user_ig_id(user):
+        if not isinstance(user, dict):
+            return None
+        for key in ('id', 'pk', 'pk_id'):
+            try:
+                ig_id = int(user.get(key))
+            except (TypeError, ValueError):
+                continue
+            if ig_id > 0:
+                return ig_id
+        return None
+
+    for account in InstagramUser_data.objects.all().iterator():
+        profiles = {}
+        edges = []
+        for direction, current, removed in (
+            ('follower', account.new_followers_list, account.who_removed_follower),
+            ('following', account.new_following_list, account.who_removed_following),
+        ):
+            seen = set()
+            current_ids = []
+            for user in current if isinstance(current, list) else []:
+                ig_id = user_ig_id(user)
+                if ig_id and ig_id not in seen:
+                    seen.add(ig_id)
+                    current_ids.append(ig_id)
+                    profiles.setdefault(ig_id, user)
+            removed_ids = []
+            for user in removed if isinstance(removed, list) else []:
+                ig_id = user_ig_id(user)
+                if ig_id and ig_id not in seen:
+                    seen.add(ig_id)
+                    removed_ids.append(ig_id)
+                    profiles.setdefault(ig_id, user)
+
+            # Keep the stored order: first user gets the highest ordinal
+            total = len(current_ids) + len(removed_ids)
+            for index, ig_id in enumerate(current_ids + removed_ids):
+                edges.append(FollowEdge(
+                    account=account,
+                    profile_id=ig_id,
+                    direction=direction,
+                    ordinal=total - index,
+                    first_seen_snapshot=1,
+                    removed_snapshot=1 if index >= len(current_ids) else None,
+                ))
+
+        InstagramProfile.objects.bulk_create(
+            [
+                InstagramProfile(
+                    id=ig_id,
+                    username=user.get('username') or '',
+                    full_name=user.get('full_name') or '',
+                    profile_pic_url=user.get('profile_pic_url') or '',
+                    is_private=bool(user.get('is_private')),
+                    is_verified=bool(user.get('is_verified')),
+                )
+                for ig_id, user in profiles.items()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        FollowEdge.objects.bulk_create(edges, batch_size=1000)
+
+        account.followers_snapshot = 1
+        account.following_snapshot = 1
+        account.save(update_fields=['followers_snapshot', 'following_snapshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_instagramuser_data_old_instagram_follower_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstagramProfile',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('username', models.CharField(blank=True, max_length=255)),
+                ('full_name', models.CharField(blank=True, max_length=255)),
+                ('profile_pic_url', models.TextField(blank=True)),
+                ('is_private', models.BooleanField(default=False)),
+                ('is_verified', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='followers_snapshot',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='following_snapshot',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='FollowEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(choices=[('follower', 'Follower'), ('following', 'Following')], max_length=9)),
+                ('ordinal', models.PositiveIntegerField(default=0)),
+                ('first_seen_snapshot', models.PositiveIntegerField(default=0)),
+                ('removed_snapshot', models.PositiveIntegerField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follow_edges', to='api.instagramuser_data')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.instagramprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'direction', 'removed_snapshot', 'ordinal'], name='follow_edge_list_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'direction', 'profile'), name='unique_follow_edge')],
+            },
+        ),
+        migrations.RunPython(copy_lists_to_edges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.5 on 2025-04-20 11:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_instagramprofile_followedge'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='new_followers_list',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='new_following_list',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='old_followers_list',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='old_following_list',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='who_i_dont_follow_he_followback',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='who_i_follow_he_dont_followback',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='who_removed_follower',
+        ),
+        migrations.RemoveField(
+            model_name='instagramuser_data',
+            name='who_removed_following',
+        ),
+    ]
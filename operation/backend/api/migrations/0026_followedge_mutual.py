@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2025-04-22 18:40
+
+from django.db import migrations, models
+
+
+def mark_mutual_edges(apps, schema_editor):
+    """Flag the active edges whose profile is in both lists of the account."""
+    FollowEdge = apps.get_model('api', 'FollowEdge')
+    InstagramUser_data = apps.get_model('api', 'InstagramUser_data')
+
+    for account_id in InstagramUser_data.objects.values_list('pk', flat=True).iterator():
+        active = FollowEdge.objects.filter(account_id=account_id, removed_snapshot__isnull=True)
+        followers = active.filter(direction='follower').values('profile_id')
+        following = active.filter(direction='following').values('profile_id')
+        active.filter(direction='following', profile_id__in=followers).update(mutual=True)
+        active.filter(direction='follower', profile_id__in=following).update(mutual=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_remove_instagramuser_data_json_lists'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='followedge',
+            name='mutual',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='followedge',
+            index=models.Index(condition=models.Q(('removed_snapshot__isnull', True)), fields=['account', 'direction', 'mutual', 'ordinal'], name='follow_edge_active_idx'),
+        ),
+        migrations.RunPython(mark_mutual_edges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2025-04-26 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_uploadsession_uploadpage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='cursor',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2025-04-28 09:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_uploadsession_cursor'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='instagramuser_data',
+            name='last_time_fetched',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
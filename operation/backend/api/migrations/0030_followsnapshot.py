@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2025-04-30 14:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_instagramuser_data_last_time_fetched_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direction', models.CharField(choices=[('follower', 'Follower'), ('following', 'Following')], max_length=9)),
+                ('number', models.PositiveIntegerField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('size', models.PositiveIntegerField()),
+                ('keyframe', models.BooleanField(default=False)),
+                ('ids', models.BinaryField(default=bytes)),
+                ('added', models.BinaryField(default=bytes)),
+                ('removed', models.BinaryField(default=bytes)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follow_snapshots', to='api.instagramuser_data')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'direction', 'number'), name='unique_follow_snapshot')],
+            },
+        ),
+    ]
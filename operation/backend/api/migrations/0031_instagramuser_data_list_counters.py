@@ -0,0 +1,60 @@
+# Generated by Django 5.1.5 on 2025-05-02 10:14
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """Count the removed and not-mutual edges of every account once."""
+    InstagramUser_data = apps.get_model('api', 'InstagramUser_data')
+    FollowEdge = apps.get_model('api', 'FollowEdge')
+
+    def count(direction, **filters):
+        edges = (
+            FollowEdge.objects
+            .filter(account=OuterRef('pk'), direction=direction, **filters)
+            .order_by()
+            .values('account')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        return Coalesce(Subquery(edges), 0)
+
+    InstagramUser_data.objects.update(
+        unfollowed_you_count=count('follower', removed_snapshot__isnull=False),
+        removed_following_count=count('following', removed_snapshot__isnull=False),
+        dont_follow_back_count=count('following', removed_snapshot__isnull=True, mutual=False),
+        you_dont_follow_back_count=count('follower', removed_snapshot__isnull=True, mutual=False),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_followsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='dont_follow_back_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='removed_following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='unfollowed_you_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='you_dont_follow_back_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
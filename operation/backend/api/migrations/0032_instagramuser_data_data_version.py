@@ -0,0 +1,24 @@
+# Generated by Django 5.1.5 on 2025-05-05 11:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_instagramuser_data_list_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='data_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='instagramuser_data',
+            name='data_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2025-05-08 09:15
+
+from django.db import migrations, models
+
+
+def mark_fetches(apps, schema_editor):
+    """Sessions with a cursor were opened by the server-side fetcher."""
+    UploadSession = apps.get_model('api', 'UploadSession')
+    UploadSession.objects.filter(cursor__isnull=False).update(source='fetch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_instagramuser_data_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='source',
+            field=models.CharField(choices=[('app', 'App upload'), ('fetch', 'Server-side fetch')], default='app', max_length=5),
+        ),
+        migrations.RunPython(mark_fetches, migrations.RunPython.noop),
+    ]
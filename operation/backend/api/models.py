@@ -5,6 +5,65 @@ from datetime import timedelta
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
+import uuid
+
+# How often an account's lists may be refreshed
+REFRESH_INTERVAL = timedelta(hours=12)
+
+
+class InstagramUserDataQuerySet(models.QuerySet):
+    """Loads only the columns an endpoint reads.
+
+    Most endpoints need one or two scalar fields of the row, so they ask for a
+    projection by name instead of the whole row. A field left out of the
+    projection is still loaded (with one more query) if it is accessed.
+    """
+    PROJECTIONS = {
+        'status': ('user1_id', 'session_id', 'csrftoken', 'x_ig_app_id'),
+        'unfollowed': ('unfollowed',),
+        'counts': (
+            'instagram_follower_count', 'instagram_following_count',
+            'old_instagram_follower_count', 'old_instagram_following_count',
+        ),
+        'last_fetch': ('last_time_fetched',),
+        'stats': (
+            'instagram_follower_count', 'instagram_following_count',
+            'old_instagram_follower_count', 'old_instagram_following_count',
+            'unfollowed_you_count', 'removed_following_count',
+            'dont_follow_back_count', 'you_dont_follow_back_count',
+        ),
+        'profile': (
+            'user', 'instagram_username', 'instagram_full_name',
+            'instagram_follower_count', 'instagram_following_count',
+            'instagram_total_posts', 'instagram_biography', 'instagram_profile_picture_url',
+        ),
+        # Everything the home screen shows (see views.home)
+        'home': (
+            'user', 'user1_id', 'session_id', 'csrftoken', 'x_ig_app_id', 'unfollowed', 'last_time_fetched',
+            'instagram_username', 'instagram_full_name', 'instagram_total_posts',
+            'instagram_biography', 'instagram_profile_picture_url',
+            'instagram_follower_count', 'instagram_following_count',
+            'old_instagram_follower_count', 'old_instagram_following_count',
+            'unfollowed_you_count', 'removed_following_count',
+            'dont_follow_back_count', 'you_dont_follow_back_count',
+        ),
+    }
+
+    # The wide columns: Instagram credentials, biography and picture URL
+    HEAVY_FIELDS = ('session_id', 'csrftoken', 'x_ig_app_id', 'instagram_biography', 'instagram_profile_picture_url')
+
+    def projection(self, name):
+        """Only load the fields of the named projection (and the primary key)."""
+        return self.only(*self.PROJECTIONS[name])
+
+    def projection_values(self, name):
+        """The fields of the named projection as dicts, without building models."""
+        return self.values(*self.PROJECTIONS[name])
+
+    def light(self):
+        """Load every field except the heavy ones."""
+        return self.defer(*self.HEAVY_FIELDS)
+
 
 class InstagramUser_data(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)  
@@ -14,17 +73,17 @@ class InstagramUser_data(models.Model):
     x_ig_app_id = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
 
-    # JSON fields for storing old and new lists
-    old_following_list = models.JSONField(default=list, blank=True)
-    new_following_list = models.JSONField(default=list, blank=True)
-    who_removed_following = models.JSONField(default=list, blank=True)
-    who_removed_follower = models.JSONField(default=list, blank=True)
-    
-    old_followers_list = models.JSONField(default=list, blank=True)
-    new_followers_list = models.JSONField(default=list, blank=True)
+    # Follower/following lists live in FollowEdge; these count the fetches
+    # applied so far and tag the edges each fetch added or removed
+    followers_snapshot = models.PositiveIntegerField(default=0)
+    following_snapshot = models.PositiveIntegerField(default=0)
 
-    who_i_follow_he_dont_followback = models.JSONField(default=list, blank=True)
-    who_i_dont_follow_he_followback = models.JSONField(default=list, blank=True)
+    # Sizes of the removed and not-mutual lists, kept by api.diff and the
+    # removal helpers of api.edges so the stats don't count the edges
+    unfollowed_you_count = models.PositiveIntegerField(default=0)
+    removed_following_count = models.PositiveIntegerField(default=0)
+    dont_follow_back_count = models.PositiveIntegerField(default=0)
+    you_dont_follow_back_count = models.PositiveIntegerField(default=0)
 
     instagram_username = models.CharField(max_length=255, blank=True)
     instagram_full_name = models.CharField(max_length=255, blank=True)
@@ -41,16 +100,22 @@ class InstagramUser_data(models.Model):
     instagram_profile_picture_url = models.URLField(max_length=1000, blank=True)
 
     # New field
-    last_time_fetched = models.DateTimeField(default=now, blank=True)
+    last_time_fetched = models.DateTimeField(default=now, blank=True, db_index=True)
     unfollowed = models.BooleanField(default=False, blank=True)
 
+    # Bumped whenever the lists, profile or stats change; the read endpoints
+    # derive their ETag and Last-Modified from it (see api.conditional)
+    data_version = models.PositiveBigIntegerField(default=0)
+    data_modified = models.DateTimeField(default=now)
+
+    objects = InstagramUserDataQuerySet.as_manager()
 
     def __str__(self):
         return str(self.user.username)
 
     def has_12_hours_passed_since_last_fetch(self):
         """Check if 12 hours have passed since last_time_fetched"""
-        return now() >= self.last_time_fetched + timedelta(hours=12)
+        return now() >= self.last_time_fetched + REFRESH_INTERVAL
 
     def update_last_fetched_time(self):
         """Update last_time_fetched to the current time"""
@@ -59,7 +124,143 @@ class InstagramUser_data(models.Model):
 
 
 
+class InstagramProfile(models.Model):
+    """An Instagram account as it appears in someone's follower/following list.
+
+    Shared by every account that follows or is followed by it, so popular
+    profiles are stored once instead of once per list.
+    """
+    id = models.BigIntegerField(primary_key=True)  # Instagram pk
+    username = models.CharField(max_length=255, blank=True)
+    full_name = models.CharField(max_length=255, blank=True)
+    profile_pic_url = models.TextField(blank=True)
+    is_private = models.BooleanField(default=False)
+    is_verified = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.username or str(self.id)
+
+
+class FollowEdge(models.Model):
+    """One entry of an account's followers or following list.
+
+    An edge is active while removed_snapshot is null. When a fetch no longer
+    contains it, it is kept with removed_snapshot set, which is what the
+    "unfollowed you" / "removed you" lists read.
+    """
+    FOLLOWER = 'follower'
+    FOLLOWING = 'following'
+    DIRECTION_CHOICES = [
+        (FOLLOWER, 'Follower'),
+        (FOLLOWING, 'Following'),
+    ]
+
+    account = models.ForeignKey(InstagramUser_data, on_delete=models.CASCADE, related_name='follow_edges')
+    profile = models.ForeignKey(InstagramProfile, on_delete=models.CASCADE, related_name='+')
+    direction = models.CharField(max_length=9, choices=DIRECTION_CHOICES)
+
+    # Increases with every edge added to the list, newest first in Instagram
+    # order, and never changes afterwards, so lists are sorted by -ordinal
+    ordinal = models.PositiveIntegerField(default=0)
+    first_seen_snapshot = models.PositiveIntegerField(default=0)
+    removed_snapshot = models.PositiveIntegerField(null=True, blank=True)
+    # Whether the profile is also in the account's other list (kept by api.diff)
+    mutual = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'direction', 'profile'], name='unique_follow_edge'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'direction', 'removed_snapshot', 'ordinal'], name='follow_edge_list_idx'),
+            models.Index(
+                fields=['account', 'direction', 'mutual', 'ordinal'],
+                condition=models.Q(removed_snapshot__isnull=True),
+                name='follow_edge_active_idx',
+            ),
+        ]
 
+    def __str__(self):
+        return f"{self.account} {self.direction} {self.profile_id}"
+
+
+class UploadSession(models.Model):
+    """A followers/following list uploaded by the app one page at a time.
+
+    Pages are staged in UploadPage as they arrive and the list is diffed
+    against the stored edges once, when the session is committed. The
+    server-side fetcher uses sessions too, and checkpoints its Instagram
+    cursor after every page so an interrupted fetch can resume.
+    """
+    OPEN = 'open'
+    COMMITTED = 'committed'
+    STATUS_CHOICES = [
+        (OPEN, 'Open'),
+        (COMMITTED, 'Committed'),
+    ]
+
+    APP = 'app'
+    FETCH = 'fetch'
+    SOURCE_CHOICES = [
+        (APP, 'App upload'),
+        (FETCH, 'Server-side fetch'),
+    ]
+
+    id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True)
+    account = models.ForeignKey(InstagramUser_data, on_delete=models.CASCADE, related_name='upload_sessions')
+    direction = models.CharField(max_length=9, choices=FollowEdge.DIRECTION_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=OPEN)
+    # Who stages the pages: a new session only replaces the unfinished ones
+    # of the same source, so the app and the fetcher don't drop each other's
+    source = models.CharField(max_length=5, choices=SOURCE_CHOICES, default=APP)
+    created_at = models.DateTimeField(auto_now_add=True)
+    committed_at = models.DateTimeField(null=True, blank=True)
+    # Server-side fetches only: the next_max_id to resume from, '' once the
+    # last page is staged. Null for uploads from the app.
+    cursor = models.CharField(max_length=255, null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload {self.id} - {self.direction} ({self.status})"
+
+
+class UploadPage(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='pages')
+    number = models.PositiveIntegerField()
+    ig_ids = models.JSONField(default=list)  # Instagram ids of the page, in order
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'number'], name='unique_upload_page'),
+        ]
+
+
+class FollowSnapshot(models.Model):
+    """One fetch of an account's followers or following list, kept as history.
+
+    Every row stores the ids added and removed since the previous snapshot;
+    keyframes also store the whole list, so a snapshot is rebuilt from the
+    keyframe before it and the deltas after it. Id lists are sorted and
+    encoded as varint gaps (see api/snapshots.py).
+    """
+    account = models.ForeignKey(InstagramUser_data, on_delete=models.CASCADE, related_name='follow_snapshots')
+    direction = models.CharField(max_length=9, choices=FollowEdge.DIRECTION_CHOICES)
+    number = models.PositiveIntegerField()  # followers_snapshot/following_snapshot of the fetch
+    taken_at = models.DateTimeField(default=now)
+    size = models.PositiveIntegerField()
+    keyframe = models.BooleanField(default=False)
+    ids = models.BinaryField(default=bytes)
+    added = models.BinaryField(default=bytes)
+    removed = models.BinaryField(default=bytes)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'direction', 'number'], name='unique_follow_snapshot'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} {self.direction} #{self.number}"
 
 
 class FrontFlags(models.Model):
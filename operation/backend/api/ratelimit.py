@@ -0,0 +1,91 @@
+"""Pacing of the requests the server sends to Instagram.
+
+Every request takes a token from the bucket of its Instagram session and one
+from a global bucket, so fetches run at the budget Instagram tolerates
+instead of until it starts failing. A 429 pauses the session for as long as
+Instagram asks. Waiters are served in arrival order, so many accounts can
+share one event loop without one of them starving the others.
+"""
+import asyncio
+import random
+import time
+from django.conf import settings
+
+BACKOFF_MAX = 60
+
+
+class TokenBucket:
+    """rate tokens per second, up to capacity; a request takes one token."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self, now):
+        # Nothing accrues while paused: a pause isn't followed by a burst
+        since = max(self.updated, self.paused_until)
+        if now > since:
+            self.tokens = min(self.capacity, self.tokens + (now - since) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds):
+        """Hand out no token for the given time, and start empty after it."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def take(self):
+        # The lock queues waiters first come, first served
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+
+class RequestScheduler:
+    """Token buckets per Instagram session plus one shared by all of them."""
+
+    def __init__(self, session_rate=None, session_burst=None, global_rate=None, global_burst=None):
+        self.session_rate = session_rate or settings.INSTAGRAM_SESSION_RATE
+        self.session_burst = session_burst or settings.INSTAGRAM_SESSION_BURST
+        self.global_bucket = TokenBucket(
+            global_rate or settings.INSTAGRAM_GLOBAL_RATE,
+            global_burst or settings.INSTAGRAM_GLOBAL_BURST,
+        )
+        self.session_buckets = {}
+
+    def session_bucket(self, session_key):
+        if session_key not in self.session_buckets:
+            self.session_buckets[session_key] = TokenBucket(self.session_rate, self.session_burst)
+        return self.session_buckets[session_key]
+
+    async def wait_turn(self, session_key):
+        """Wait until the session may send its next request."""
+        await self.session_bucket(session_key).take()
+        await self.global_bucket.take()
+
+    def pause(self, session_key, seconds):
+        self.session_bucket(session_key).pause(seconds)
+
+
+def backoff_delay(attempt, base):
+    """Exponential backoff with full jitter for the given retry (1, 2, ...)."""
+    return random.uniform(0, min(BACKOFF_MAX, base * 2 ** (attempt - 1)))
+
+
+def retry_after(response, default):
+    """Seconds to wait after a 429, from its Retry-After header if it has one."""
+    try:
+        return max(float(response.headers.get('Retry-After')), 0)
+    except (TypeError, ValueError):
+        return default
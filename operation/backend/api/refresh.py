@@ -0,0 +1,163 @@
+"""Server-side refresh of the accounts whose lists are due.
+
+The worker scans for accounts fetched more than REFRESH_INTERVAL ago with
+an indexed range on last_time_fetched. Each scan only reads past the last
+account already queued. The accounts are queued by the time they are due
+and refreshed concurrently, sharing one InstagramClient and
+RequestScheduler.
+
+Each account refreshes at its own fixed point of the interval, derived from
+its id. Accounts that all opened the app at the same time are therefore
+spread over the whole interval on the server, instead of all coming due
+together.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+from .models import InstagramUser_data, REFRESH_INTERVAL
+from .instagram import InstagramClient
+from .ratelimit import RequestScheduler
+from .services import ACCOUNT_CONCURRENCY, FetchError, refresh_account
+from .uploads import UploadError
+
+logger = logging.getLogger(__name__)
+
+SCAN_INTERVAL = 60  # seconds between two scans for due accounts
+SCAN_BATCH = 1000
+FAILURE_BACKOFF = timedelta(hours=1)
+
+# Slots are counted from here, so an account's slot is the same every day
+SLOT_EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def refresh_slot(account_id):
+    """The fixed offset inside REFRESH_INTERVAL at which an account refreshes."""
+    interval = int(REFRESH_INTERVAL.total_seconds())
+    # Multiplicative hashing spreads consecutive ids across the interval
+    return timedelta(seconds=account_id * 2654435761 % interval)
+
+
+def refresh_due_at(account):
+    """First time at or after last_time_fetched + REFRESH_INTERVAL that falls on the account's slot."""
+    earliest = account.last_time_fetched + REFRESH_INTERVAL
+    offset = (earliest - SLOT_EPOCH) % REFRESH_INTERVAL
+    wait = (refresh_slot(account.pk) - offset) % REFRESH_INTERVAL
+    return earliest + wait
+
+
+def due_accounts(now, after=None, limit=SCAN_BATCH):
+    """Connected accounts fetched more than REFRESH_INTERVAL ago, oldest first.
+
+    after is the (last_time_fetched, pk) of the last account already seen.
+    """
+    accounts = (
+        InstagramUser_data.objects
+        .only('user1_id', 'session_id', 'csrftoken', 'x_ig_app_id', 'last_time_fetched')
+        .filter(last_time_fetched__lte=now - REFRESH_INTERVAL)
+        .exclude(session_id='')
+    )
+    if after:
+        fetched, pk = after
+        accounts = accounts.filter(Q(last_time_fetched__gt=fetched) | Q(last_time_fetched=fetched, pk__gt=pk))
+    return list(accounts.order_by('last_time_fetched', 'pk')[:limit])
+
+
+def still_due(account, now):
+    """False if the account was refreshed (e.g. from the app) since it was queued."""
+    return InstagramUser_data.objects.filter(pk=account.pk, last_time_fetched__lte=now - REFRESH_INTERVAL).exists()
+
+
+class RefreshQueue:
+    """Accounts waiting for their refresh, soonest due first."""
+
+    def __init__(self):
+        self.heap = []
+        self.position = None  # (last_time_fetched, pk) of the last account queued
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, due_at, account):
+        heapq.heappush(self.heap, (due_at, account.pk, account))
+
+    def scan(self, now):
+        """Queue the due accounts not seen by earlier scans."""
+        while True:
+            accounts = due_accounts(now, self.position)
+            for account in accounts:
+                self.push(refresh_due_at(account), account)
+            if accounts:
+                self.position = (accounts[-1].last_time_fetched, accounts[-1].pk)
+            if len(accounts) < SCAN_BATCH:
+                return
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def next_due(self):
+        return self.heap[0][0] if self.heap else None
+
+
+async def run_refresh_worker(once=False, client=None, scheduler=None):
+    """Refresh due accounts until cancelled, or only the ones due now if once.
+
+    Returns the number of accounts refreshed and failed.
+    """
+    queue = RefreshQueue()
+    scheduler = scheduler or RequestScheduler()
+    slots = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
+    running = set()
+    counts = {"refreshed": 0, "failed": 0}
+
+    def failed(account):
+        counts["failed"] += 1
+        # The scan position has passed the account: only this puts it back
+        if not once:
+            queue.push(timezone.now() + FAILURE_BACKOFF, account)
+
+    async def refresh(client, account):
+        async with slots:
+            try:
+                # A refresh made since the scan moved its last_time_fetched past
+                # the scan position, so a later scan picks the account up again
+                if not await sync_to_async(still_due)(account, timezone.now()):
+                    return
+                await refresh_account(client, account, scheduler)
+                counts["refreshed"] += 1
+            except (FetchError, UploadError) as e:
+                logger.error("Scheduled refresh of account %s failed: %s", account.pk, e)
+                failed(account)
+            except Exception:
+                # A database error or a bug must not drop the account from scheduling
+                logger.exception("Scheduled refresh of account %s failed", account.pk)
+                failed(account)
+
+    async def work(client):
+        while True:
+            now = timezone.now()
+            await sync_to_async(queue.scan)(now)
+
+            for account in queue.pop_due(now):
+                task = asyncio.create_task(refresh(client, account))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if once:
+                await asyncio.gather(*running)
+                return counts
+
+            next_due = queue.next_due()
+            wait = SCAN_INTERVAL if next_due is None else (next_due - timezone.now()).total_seconds()
+            await asyncio.sleep(min(max(wait, 1), SCAN_INTERVAL))
+
+    if client:
+        return await work(client)
+    async with InstagramClient() as client:
+        return await work(client)
@@ -1,6 +1,6 @@
 # serializers.py
 from rest_framework import serializers
-from .models import InstagramUser_data
+from .models import InstagramUser_data, InstagramProfile
 
 class InstagramUserDataSerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,3 +10,12 @@ class InstagramUserDataSerializer(serializers.ModelSerializer):
             'instagram_follower_count', 'instagram_following_count',
             'instagram_total_posts', 'instagram_biography', 'instagram_profile_picture_url'
         ]
+
+
+class InstagramProfileSerializer(serializers.ModelSerializer):
+    # Sent as a string, like the lists the app uploads
+    id = serializers.CharField()
+
+    class Meta:
+        model = InstagramProfile
+        fields = ['id', 'username', 'full_name', 'profile_pic_url', 'is_private', 'is_verified']
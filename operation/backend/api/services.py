@@ -1,103 +1,227 @@
+"""Server-side fetch of the followers/following lists of an account.
+
+Both lists are pulled concurrently over one pooled InstagramClient. Every page is
+staged in an upload session as soon as it arrives (see uploads.py), together
+with the cursor of the next page, and each list is diffed once its last page
+is in. A refresh doesn't depend on the app staying open, never holds a whole
+list in memory and, when it fails, resumes where it stopped.
+"""
+import asyncio
+import logging
 import httpx
-from .models import InstagramUser_data
-from django.db import transaction
-
-def get_instagram_following(user_id, session_id, csrftoken, x_ig_app_id):
-    headers = {
-        "cookie": f"csrftoken={csrftoken}; ds_user_id={user_id}; sessionid={session_id}",
-        "referer": f"https://www.instagram.com/{user_id}/following/?next=/",
-        "x-csrftoken": csrftoken,
-        "x-ig-app-id": x_ig_app_id,
-    }
-
-    following = []
-    next_max_id = None
-    max_retries = 3
-    retry_delay = 5
-    count = 12
-
-    with httpx.Client() as client:
-        while True:
-            url = f"https://www.instagram.com/api/v1/friendships/{user_id}/following/?count={count}"
-            if next_max_id:
-                url += f"&max_id={next_max_id}"
-
-            retries = 0
-            while retries < max_retries:
-                try:
-                    print(f"Fetching URL: {url}, Retry: {retries}, Count: {count}")
-                    response = client.get(url, headers=headers, timeout=15)
-                    response.raise_for_status()
-                    data = response.json()
-
-                    if 'users' not in data:
-                        print(f"Error: 'users' key not found in the response: {data}")
-                        return None
-
-                    users_data = data.get('users', [])
-                    following.extend(users_data)
-
-                    # Update next_max_id for pagination
-                    next_max_id = data.get('next_max_id')
-
-                    if not next_max_id and count == 12:
-                        print("No more results with count 12, switching to count 1.")
-                        count = 1
-                        break
-
-                    if not next_max_id:
-                        break
-                    break
-                except httpx.RequestError as e:
-                    print(f"Request failed: {e}")
-                    retries += 1
-                    if retries < max_retries:
-                        print(f"Retrying in {retry_delay} seconds...")
-                        import time
-                        time.sleep(retry_delay)
-                    else:
-                        print(f"Max retries exceeded. Aborting.")
-                        return None
-
-            if not next_max_id and count == 1:
-                break
-
-    return following
-
-@transaction.atomic
-def _update_instagram_user_data(user, following_data):
+from datetime import timedelta
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from .models import InstagramUser_data, FollowEdge, UploadSession
+from .uploads import UploadError, begin_upload, stage_page, commit_upload, resumable_fetch, forget_checkpoint, iter_staged_ids
+from .edges import user_ig_id
+from .instagram import FetchError, InstagramClient
+from .ratelimit import RequestScheduler, backoff_delay, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Page sizes to ask for, largest first; a fetch steps down only when a size is
+# rejected (400) or pages come back shorter than asked
+PAGE_SIZES = (100, 50, 25, 12)
+MAX_RETRIES = 5
+BACKOFF_BASE = 2
+ACCOUNT_CONCURRENCY = 10
+RESUME_WINDOW = timedelta(hours=12)
+
+DIRECTIONS = [FollowEdge.FOLLOWER, FollowEdge.FOLLOWING]
+
+
+class FetchStats:
+    """Counters of one full fetch of a list, reported with its result."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.pages = 0
+        self.users = 0
+        self.duplicates = 0
+        self.resumed_pages = 0
+        self.page_size = PAGE_SIZES[0]
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "pages": self.pages,
+            "users": self.users,
+            "duplicates": self.duplicates,
+            "resumed_pages": self.resumed_pages,
+            "page_size": self.page_size,
+        }
+
+
+def is_retryable(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        # 400 is what Instagram answers to a page size it doesn't accept
+        return error.response.status_code in (400, 429) or error.response.status_code >= 500
+    return isinstance(error, httpx.RequestError)
+
+
+def smaller_page_size(page_size, at_most=None):
+    """The next page size down, or the largest one not above at_most."""
+    smaller = [size for size in PAGE_SIZES if size < page_size and (at_most is None or size <= at_most)]
+    if at_most is not None and not smaller:
+        return PAGE_SIZES[-1]
+    return smaller[0] if smaller else page_size
+
+
+async def iter_list_pages(client, account, direction, stats, scheduler, max_id=None, seen=None):
+    """Yield the users of a followers/following list page by page, newest first.
+
+    Each page comes with the cursor of the next one ('' after the last page).
+    The cursor only moves forward, so a list is walked once; users already
+    seen in an earlier page are dropped. Requests are paced by scheduler.
+    """
+    name = f"{direction} list of account {account.pk}"
+    seen = set() if seen is None else seen
+    failures = 0
+
+    while True:
+        await scheduler.wait_turn(account.session_id)
+        stats.requests += 1
+        try:
+            data = await client.friendships(account, direction, stats.page_size, max_id)
+        except httpx.HTTPError as e:
+            failures += 1
+            if not is_retryable(e) or failures == MAX_RETRIES:
+                raise FetchError(f"Fetching the {name} failed: {e}") from e
+            stats.retries += 1
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 400:
+                # The page size was rejected; anything else only backs off
+                stats.page_size = smaller_page_size(stats.page_size)
+            delay = backoff_delay(failures, BACKOFF_BASE)
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                # Rate limited: the whole session waits, not just this list
+                delay = retry_after(e.response, delay)
+                scheduler.pause(account.session_id, delay)
+            logger.warning("Fetching the %s failed (%s), retry %s with count=%s in %.1fs", name, e, failures, stats.page_size, delay)
+            await asyncio.sleep(delay)
+            continue
+
+        if 'users' not in data:
+            raise FetchError(f"'users' key not found in a page of the {name}")
+        failures = 0
+
+        users = []
+        for user in data['users']:
+            ig_id = user_ig_id(user)
+            if ig_id is None:
+                continue
+            if ig_id in seen:
+                stats.duplicates += 1
+                continue
+            seen.add(ig_id)
+            users.append(user)
+        stats.pages += 1
+        stats.users += len(users)
+        max_id = data.get('next_max_id')
+        yield users, max_id or ''
+
+        if not max_id:
+            return
+        if len(data['users']) < stats.page_size:
+            # The endpoint caps the page size: ask for what it actually returns
+            stats.page_size = smaller_page_size(stats.page_size, at_most=len(data['users']))
+
+
+def load_checkpoint(session):
+    """Number of pages and ids already staged by an interrupted fetch."""
+    return session.pages.count(), set(iter_staged_ids(session))
+
+
+async def fetch_list(client, account, direction, scheduler):
+    """Fetch one list of an account and store it.
+
+    A fetch of the same list that failed within RESUME_WINDOW is resumed from
+    its last checkpoint instead of starting over, once: if the resumed fetch
+    fails too (a stale cursor, say), the next one starts over.
+
+    Returns the FollowDiff and the FetchStats of the fetch.
+    """
+    stats = FetchStats()
+    session = await sync_to_async(resumable_fetch)(account, direction, timezone.now() - RESUME_WINDOW)
+    resumed = session is not None
+    if resumed:
+        pages, seen = await sync_to_async(load_checkpoint)(session)
+        stats.resumed_pages = pages
+        logger.info("Resuming %s list of account %s after %s pages", direction, account.pk, pages)
+    else:
+        session = await sync_to_async(begin_upload)(account, direction, UploadSession.FETCH)
+        pages, seen = 0, set()
+
     try:
-        user_instances = InstagramUser_data.objects.filter(user=user)
-
-        if user_instances.exists():
-            for user_instance in user_instances:
-                user_instance.old_list = user_instance.new_list
-                user_instance.new_list = following_data
-                user_instance.save()
-                print(f"Data updated for user {user.username}")
-        else:
-            print(f"Instagram data not found for user {user.username}.")
-    except Exception as e:
-        print(f"Error saving data: {e}")
+        # Checkpoint the cursor with every page, so a failed fetch resumes here
+        if session.cursor != '':
+            async for users, next_max_id in iter_list_pages(
+                client, account, direction, stats, scheduler, session.cursor or None, seen,
+            ):
+                await sync_to_async(stage_page)(session, pages, users, cursor=next_max_id)
+                pages += 1
+
+        diff, timings = await sync_to_async(commit_upload)(session, expected_pages=pages)
+    except Exception:
+        if resumed:
+            await sync_to_async(forget_checkpoint)(session)
         raise
-
-
-def fetch_and_save_following(user):
-    instagram_data = InstagramUser_data.objects.filter(user=user).first()
-
-    if not instagram_data:
-        print(f"No Instagram data found for user {user.username}.")
-        return
-
-    user_id = instagram_data.user1_id
-    session_id = instagram_data.session_id
-    csrftoken = instagram_data.csrftoken
-    x_ig_app_id = instagram_data.x_ig_app_id
-
-    following_data = get_instagram_following(user_id, session_id, csrftoken, x_ig_app_id)
-
-    if following_data is not None:
-        try:
-            _update_instagram_user_data(user, following_data)
-        except Exception as e:
-            print(f"Error saving data: {e}")
+    logger.info("Fetched %s list of account %s: %s, %s", direction, account.pk, stats.as_dict(), diff.as_dict())
+    return diff, stats
+
+
+async def refresh_account(client, account, scheduler=None):
+    """Fetch the followers and following lists of an account concurrently.
+
+    A list that fails doesn't stop the other one from being saved; the first
+    error is raised once both are done. Returns the diff and fetch stats
+    of each list.
+    """
+    scheduler = scheduler or RequestScheduler()
+    results = await asyncio.gather(
+        *(fetch_list(client, account, direction, scheduler) for direction in DIRECTIONS),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return dict(zip(DIRECTIONS, results))
+
+
+async def refresh_accounts(accounts):
+    """Refresh many accounts concurrently over a shared client and scheduler.
+
+    Returns the result of refresh_account (or the error) of each account,
+    by account id.
+    """
+    scheduler = RequestScheduler()
+    slots = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
+    outcomes = {}
+
+    async def refresh(client, account):
+        async with slots:
+            try:
+                outcomes[account.pk] = await refresh_account(client, account, scheduler)
+            except (FetchError, UploadError) as e:
+                logger.error("Refresh of account %s failed: %s", account.pk, e)
+                outcomes[account.pk] = e
+            except Exception as e:
+                # Anything else (a database error, a bug) fails this account only
+                logger.exception("Refresh of account %s failed", account.pk)
+                outcomes[account.pk] = e
+
+    async with InstagramClient() as client:
+        await asyncio.gather(*(refresh(client, account) for account in accounts))
+    return outcomes
+
+
+def fetch_and_save_lists(user):
+    """Fetch and store both lists of a user from synchronous code (e.g. a worker)."""
+    account = InstagramUser_data.objects.projection('status').filter(user=user).first()
+    if not account:
+        logger.warning("No Instagram data found for user %s.", user.username)
+        return None
+
+    return asyncio.run(refresh_accounts([account]))[account.pk]
@@ -1,13 +1,53 @@
-from django.test import TestCase
+import functools
+from django.test import TestCase, override_settings
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+import redis
+import json
+import time
+import asyncio
+import httpx
+from asgiref.sync import async_to_sync
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIRequestFactory, force_authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
-from .models import InstagramUser_data, FrontFlags
-from .views import remove_following  # Import your view function!
+from .models import InstagramUser_data, FrontFlags, FollowEdge, UploadSession, FollowSnapshot, InstagramProfile
+from .diff import diff_follow_lists, save_fetched_list
+from .edges import compact_users, save_profiles
+from .edges import who_i_follow_he_dont_followback, who_i_dont_follow_he_followback, who_removed_follower
+from .edges import who_removed_following, remove_edges, forget_removed_edges
+from .views import remove_following, save_fetched_followers  # Import your view function!
+from .views import begin_list_upload, append_list_upload_page, commit_list_upload
+from .views import get_unfollowed_you, get_dont_follow_back_you, remove_follower, remove_unfollowed_you, apply_list_actions
+from .views import get_followed_but_not_followed_back, get_who_removed_you, get_first_time_flag, home
+from .views import save_instagram_user_profile
+from payment.models import UserCredit
+from payment.views import get_user_credit
+from subscription.views import get_active_subscription
+from .views import (
+    check_instagram_status, get_unfollowed_status, check_12_hours_passed,
+    check_instagram_counts, get_instagram_user_profile, instagram_stats_difference,
+)
+from . import cache, services, async_views
+from .actions import apply_actions
+from .ratelimit import RequestScheduler, TokenBucket
+from .instagram import InstagramClient
+from . import refresh, snapshots, uploads
+from .benchmarks import EndpointBenchmark, synthetic_lists
+from .diff import FollowDiff
+from . import diff as diff_module
+import random
+from datetime import timedelta
+from django.utils import timezone
 
 
+# Tokens are authenticated for real: the users are cached in the process only
+@override_settings(AUTH_USER_CACHE_TTL=0)
 class RemoveFollowingViewTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username="testuser", password="testpassword")
@@ -22,16 +62,12 @@ class RemoveFollowingViewTest(TestCase):
             session_id="session123",
             csrftoken="csrf123",
             x_ig_app_id="app123",
-            new_following_list=[
-                {"pk": "1", "username": "user1"},
-                {"pk": "2", "username": "user2"},
-            ],
-            old_following_list=[
-                {"pk": "1", "username": "user1"},
-                {"pk": "2", "username": "user2"},
-            ],
             instagram_following_count=2,
         )
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWING, [
+            {"id": "1", "username": "user1"},
+            {"id": "2", "username": "user2"},
+        ])
 
     def _get_authenticated_request(self, data=None):
         # Helper function to create an authenticated request
@@ -43,32 +79,31 @@ class RemoveFollowingViewTest(TestCase):
     def test_remove_following_success(self):
         """Test successful removal."""
         self._create_user_data()
-        data = {"pk": "1"}
+        data = {"id": "1"}
         request = self._get_authenticated_request(data)
         response = remove_following(request)  # Call the view function directly!
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, {"message": "User removed from following list successfully"})
+        self.assertEqual(response.data, {"message": "User removed from following list and 'who_i_follow_he_dont_followback' updated successfully"})
 
         self.user_data.refresh_from_db()
-        self.assertEqual(len(self.user_data.new_following_list), 1)
-        self.assertEqual(self.user_data.new_following_list[0]["pk"], "2")
-        self.assertEqual(self.user_data.old_following_list[0]["pk"], "2") # Corrected assertion
+        following = FollowEdge.objects.filter(account=self.user_data, direction=FollowEdge.FOLLOWING)
+        self.assertEqual(list(following.values_list("profile_id", flat=True)), [2])
         self.assertEqual(self.user_data.instagram_following_count, 1)
-        self.assertEqual(self.user_data.who_i_follow_he_dont_followback, ["2"])
+        self.assertEqual(list(who_i_follow_he_dont_followback(self.user_data).values_list("profile_id", flat=True)), [2])
 
-    def test_remove_following_missing_pk(self):
-        """Test missing 'pk'."""
+    def test_remove_following_missing_id(self):
+        """Test missing 'id'."""
         self._create_user_data()
-        data = {}  # Missing pk
+        data = {}  # Missing id
         request = self._get_authenticated_request(data)
         response = remove_following(request) # Call view directly
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(response.data, {"error": "Missing 'pk' in request body"})
+        self.assertEqual(response.data, {"error": "Missing 'id' in request body"})
 
     def test_remove_following_user_not_found(self):
-        """Test 'pk' not in following list."""
+        """Test 'id' not in following list."""
         self._create_user_data()
-        data = {"pk": "3"}  # Invalid pk
+        data = {"id": "3"}  # Invalid id
         request = self._get_authenticated_request(data)
         response = remove_following(request) # Call view directly
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -77,16 +112,16 @@ class RemoveFollowingViewTest(TestCase):
     def test_remove_following_no_instagram_data(self):
         """Test no Instagram data."""
         # Don't create user_data
-        data = {"pk": "1"}
+        data = {"id": "1"}
         request = self._get_authenticated_request(data)
         response = remove_following(request) # Call view directly
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(response.data, {"error": "No Instagram data found for this user"})
+        self.assertEqual(response.data, {"error": "Instagram user data not found"})
 
     def test_remove_following_no_authentication(self):
         """Test unauthenticated request."""
         # Don't authenticate the request
-        request = self.factory.post(self.url, {"pk":"1"}, format='json')
+        request = self.factory.post(self.url, {"id":"1"}, format='json')
         response = remove_following(request)
         # Expect 401 Unauthorized (or possibly 403 Forbidden)
         self.assertTrue(
@@ -98,7 +133,7 @@ class RemoveFollowingViewTest(TestCase):
         self._create_user_data()
         self.user_data.instagram_following_count = 0
         self.user_data.save()
-        data = {"pk": "1"}
+        data = {"id": "1"}
         request = self._get_authenticated_request(data)
         response = remove_following(request)  # Call the view function directly!
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -109,9 +144,1293 @@ class RemoveFollowingViewTest(TestCase):
         self._create_user_data()
         self.user_data.instagram_following_count = None
         self.user_data.save()
-        data = {"pk": "1"}
+        data = {"id": "1"}
         request = self._get_authenticated_request(data)
         response = remove_following(request)  # Call the view function directly!
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.user_data.refresh_from_db()
-        self.assertIsNone(self.user_data.instagram_following_count)
\ No newline at end of file
+        self.assertIsNone(self.user_data.instagram_following_count)
+
+
+class SaveFetchedFollowersViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        self.url = reverse("save_fetched_followers")
+        self.user_data = InstagramUser_data.objects.create(
+            user=self.user,
+            user1_id="123",
+            session_id="session123",
+            csrftoken="csrf123",
+            x_ig_app_id="app123",
+        )
+
+    def _post_followers(self, followers_list):
+        request = self.factory.post(self.url, {"followers_list": followers_list}, format='json')
+        force_authenticate(request, user=self.user)
+        return save_fetched_followers(request)
+
+    def test_only_changes_are_written(self):
+        self._post_followers([{"id": "1", "username": "user1"}, {"id": "2", "username": "user2"}])
+        first_edge = FollowEdge.objects.get(account=self.user_data, profile_id=1)
+
+        response = self._post_followers([{"id": "3", "username": "user3"}, {"id": "1", "username": "user1"}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.user_data.refresh_from_db()
+        self.assertEqual(self.user_data.followers_snapshot, 2)
+        # The follower that stayed keeps its row untouched
+        self.assertEqual(FollowEdge.objects.get(account=self.user_data, profile_id=1).pk, first_edge.pk)
+        self.assertEqual(list(who_removed_follower(self.user_data).values_list("profile_id", flat=True)), [2])
+
+    def test_follower_coming_back_leaves_removed_list(self):
+        self._post_followers([{"id": "1"}, {"id": "2"}])
+        self._post_followers([{"id": "1"}])
+        self._post_followers([{"id": "2"}, {"id": "1"}])
+
+        self.assertFalse(who_removed_follower(self.user_data).exists())
+        # Newest first, like the list Instagram returns
+        ordered = FollowEdge.objects.filter(account=self.user_data).order_by("-ordinal")
+        self.assertEqual(list(ordered.values_list("profile_id", flat=True)), [2, 1])
+
+    def test_invalid_payload(self):
+        response = self._post_followers("not a list")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FollowDiffTest(TestCase):
+    def test_single_pass_diff(self):
+        # 1 and 2 are followed, 3 was removed earlier, 4 is only in the other list
+        stored = {1: None, 2: None, 3: 1}
+        diff = diff_follow_lists(stored, [3, 5, 1], other_ids={1, 4, 5})
+
+        self.assertEqual(diff.added, [3, 5])
+        self.assertEqual(diff.returning, [3])
+        self.assertEqual(diff.removed, [2])
+        self.assertEqual(diff.mutual, {1, 5})
+        self.assertEqual(diff.mutual_gained, [5])
+        self.assertEqual(diff.mutual_lost, [])
+        self.assertEqual(diff.not_back_count, 1)
+        self.assertEqual(diff.other_not_back_count, 1)
+
+    def test_mutual_flags_follow_both_lists(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        account = InstagramUser_data.objects.create(user=user, user1_id="123")
+
+        save_fetched_list(account, FollowEdge.FOLLOWING, [{"id": "1"}, {"id": "2"}])
+        save_fetched_list(account, FollowEdge.FOLLOWER, [{"id": "2"}, {"id": "3"}])
+        self.assertEqual(list(who_i_follow_he_dont_followback(account).values_list("profile_id", flat=True)), [1])
+        self.assertEqual(list(who_i_dont_follow_he_followback(account).values_list("profile_id", flat=True)), [3])
+
+        # 2 stops following back
+        diff, timings, sizes = save_fetched_list(account, FollowEdge.FOLLOWER, [{"id": "3"}])
+        self.assertEqual(diff.mutual_lost, [2])
+        self.assertEqual(set(who_i_follow_he_dont_followback(account).values_list("profile_id", flat=True)), {1, 2})
+        self.assertIn("total_ms", timings)
+
+    def test_one_narrow_account_update(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        account = InstagramUser_data.objects.create(user=user, user1_id="123")
+
+        with CaptureQueriesContext(connection) as queries:
+            save_fetched_list(account, FollowEdge.FOLLOWER, [{"id": "1"}])
+        account_updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "api_instagramuser_data"')]
+        self.assertEqual(len(account_updates), 1)
+        self.assertNotIn("session_id", account_updates[0])
+
+
+class ChunkedUploadViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        self.user_data = InstagramUser_data.objects.create(user=self.user, user1_id="123")
+
+    def _post(self, view, url_name, data, **kwargs):
+        request = self.factory.post(reverse(url_name, kwargs=kwargs), data, format='json')
+        force_authenticate(request, user=self.user)
+        return view(request, **kwargs)
+
+    def _begin(self):
+        response = self._post(begin_list_upload, "begin_list_upload", {"list": "followers"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["upload_id"]
+
+    def test_pages_are_diffed_once_at_commit(self):
+        upload_id = self._begin()
+        self._post(append_list_upload_page, "append_list_upload_page", {"page": 1, "users": [{"id": "3"}]}, upload_id=upload_id)
+        self._post(append_list_upload_page, "append_list_upload_page", {"page": 0, "users": [{"id": "1"}, {"id": "2"}]}, upload_id=upload_id)
+        # Nothing reaches the followers list before the commit
+        self.assertFalse(FollowEdge.objects.exists())
+
+        response = self._post(commit_list_upload, "commit_list_upload", {"pages": 2}, upload_id=upload_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["diff"]["added"], 3)
+
+        ordered = FollowEdge.objects.filter(account=self.user_data, direction=FollowEdge.FOLLOWER).order_by("-ordinal")
+        self.assertEqual(list(ordered.values_list("profile_id", flat=True)), [1, 2, 3])
+
+    def test_resent_page_replaces_previous_one(self):
+        upload_id = self._begin()
+        self._post(append_list_upload_page, "append_list_upload_page", {"page": 0, "users": [{"id": "1"}]}, upload_id=upload_id)
+        self._post(append_list_upload_page, "append_list_upload_page", {"page": 0, "users": [{"id": "2"}]}, upload_id=upload_id)
+        self._post(commit_list_upload, "commit_list_upload", {}, upload_id=upload_id)
+
+        self.assertEqual(list(FollowEdge.objects.values_list("profile_id", flat=True)), [2])
+
+    def test_commit_rejects_missing_pages_and_second_commit(self):
+        upload_id = self._begin()
+        self._post(append_list_upload_page, "append_list_upload_page", {"page": 1, "users": [{"id": "1"}]}, upload_id=upload_id)
+
+        response = self._post(commit_list_upload, "commit_list_upload", {"pages": 2}, upload_id=upload_id)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self._post(commit_list_upload, "commit_list_upload", {}, upload_id=upload_id)
+        response = self._post(append_list_upload_page, "append_list_upload_page", {"page": 2, "users": []}, upload_id=upload_id)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_app_uploads_and_server_fetches_keep_their_sessions(self):
+        upload_id = self._begin()
+        self._post(append_list_upload_page, "append_list_upload_page", {"page": 0, "users": [{"id": "1"}]}, upload_id=upload_id)
+
+        fetch = uploads.begin_upload(self.user_data, FollowEdge.FOLLOWER, UploadSession.FETCH)
+        uploads.stage_page(fetch, 0, [{"id": "2"}], cursor="next")
+        # The app starting over drops its own unfinished upload only
+        upload_id = self._begin()
+        uploads.stage_page(fetch, 1, [{"id": "3"}], cursor="")
+        self.assertEqual(UploadSession.objects.filter(status=UploadSession.OPEN).count(), 2)
+
+        response = self._post(append_list_upload_page, "append_list_upload_page", {"page": 0, "users": [{"id": "4"}]}, upload_id=upload_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        uploads.commit_upload(fetch, expected_pages=2)
+        response = self._post(commit_list_upload, "commit_list_upload", {"pages": 1}, upload_id=upload_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Committed last, the app's list is the current one
+        self.assertEqual(list(FollowEdge.objects.filter(removed_snapshot__isnull=True).values_list("profile_id", flat=True)), [4])
+
+    def test_commit_refuses_while_the_list_is_being_committed(self):
+        upload_id = self._begin()
+        select_for_update = QuerySet.select_for_update
+
+        def locked_elsewhere(queryset, nowait=False, **kwargs):
+            if nowait:
+                raise OperationalError("could not obtain lock on row in relation \"api_uploadsession\"")
+            return select_for_update(queryset, nowait=nowait, **kwargs)
+
+        with mock.patch.object(QuerySet, "select_for_update", locked_elsewhere):
+            response = self._post(commit_list_upload, "commit_list_upload", {}, upload_id=upload_id)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(UploadSession.objects.get(pk=upload_id).status, UploadSession.OPEN)
+
+    def test_page_reports_sizes_before_and_after_compaction(self):
+        upload_id = self._begin()
+        users = [{
+            "pk": str(i), "pk_id": str(i), "username": f"user{i}", "full_name": f"User {i}", "is_private": False,
+            "profile_pic_url": f"https://pic/{i}", "fbid_v2": f"1784140000000000{i}", "latest_reel_media": 0,
+            "has_anonymous_profile_picture": False, "account_badges": [], "third_party_downloads_enabled": 0,
+        } for i in range(1, 4)]
+        response = self._post(append_list_upload_page, "append_list_upload_page", {"page": 0, "users": users}, upload_id=upload_id)
+        self.assertEqual(response.data["users"], 3)
+        self.assertLess(response.data["ingestion"]["bytes_out"], response.data["ingestion"]["bytes_in"])
+
+
+class FakeRedis:
+    """The few Redis commands api.cache uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value = self.data.get(key)
+        return str(value).encode() if value is not None else None
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(str(value).encode() for value in values)
+
+    def expire(self, key, ttl):
+        pass
+
+    def lrange(self, key, start, stop):
+        items = self.data.get(key, [])
+        return items[start:stop + 1 if stop != -1 else None]
+
+    def pipeline(self, transaction=True):
+        self.transactional = transaction
+        return self
+
+    def execute(self):
+        pass
+
+
+class RelationshipCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        self.user_data = InstagramUser_data.objects.create(user=self.user, user1_id="123")
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, [{"id": str(i), "username": f"user{i}"} for i in range(1, 21)])
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, [{"id": "1", "username": "user1"}])
+
+    def _get_page(self, page=1):
+        request = self.factory.get(reverse("get_unfollowed_you"), {"page": page})
+        force_authenticate(request, user=self.user)
+        return get_unfollowed_you(request)
+
+    def test_pages_are_served_from_redis_after_first_read(self):
+        fake = FakeRedis()
+        with mock.patch.object(cache, "get_redis", return_value=fake):
+            first = self._get_page(1)
+            with CaptureQueriesContext(connection) as queries:
+                second = self._get_page(2)
+
+        self.assertTrue(fake.transactional)
+        self.assertEqual(first.data["total_count"], 19)
+        self.assertEqual(len(first.data["results"]), 15)
+        self.assertEqual([user["id"] for user in second.data["results"]], ["17", "18", "19", "20"])
+        # The data version, the account id lookup and one IN query for the
+        # profiles of the page
+        self.assertEqual(len(queries), 3)
+        self.assertIn('"api_instagramprofile"."id" IN', queries[2]["sql"])
+        self.assertNotIn("JOIN", queries[2]["sql"])
+
+    def test_invalidation_switches_to_a_new_version(self):
+        fake = FakeRedis()
+        with mock.patch.object(cache, "get_redis", return_value=fake):
+            self._get_page(1)
+            with self.captureOnCommitCallbacks(execute=True):
+                save_fetched_list(self.user_data, FollowEdge.FOLLOWER, [])
+            response = self._get_page(1)
+
+        self.assertEqual(response.data["total_count"], 20)
+
+    def test_falls_back_to_database_when_redis_is_down(self):
+        broken = mock.Mock()
+        broken.get.side_effect = redis.ConnectionError("down")
+        with mock.patch.object(cache, "get_redis", return_value=broken):
+            response = self._get_page(1)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_count"], 19)
+        self.assertEqual(response.data["results"][0]["id"], "2")
+
+
+def account_row_bytes(queries):
+    """Re-run the captured reads of InstagramUser_data and count the bytes they return."""
+    total = 0
+    with connection.cursor() as cursor:
+        for query in queries:
+            sql = query["sql"]
+            if sql.startswith("SELECT") and 'FROM "api_instagramuser_data"' in sql:
+                cursor.execute(sql)
+                for row in cursor.fetchall():
+                    total += sum(len(str(value).encode()) for value in row if value is not None)
+    return total
+
+
+class AccountProjectionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        InstagramUser_data.objects.create(
+            user=self.user,
+            user1_id="123",
+            session_id="s" * 255,
+            csrftoken="c" * 255,
+            x_ig_app_id="a" * 255,
+            instagram_biography="b" * 20000,
+            instagram_profile_picture_url="https://example.com/" + "p" * 900,
+            instagram_follower_count=10,
+            instagram_following_count=20,
+        )
+
+    def _bytes_read(self, view, url_name):
+        request = self.factory.get(reverse(url_name))
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return account_row_bytes(queries)
+
+    def test_scalar_endpoints_read_a_few_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(InstagramUser_data.objects.filter(user=self.user))
+        full_row = account_row_bytes(queries)
+        self.assertGreater(full_row, 21000)
+
+        unfollowed_bytes = self._bytes_read(get_unfollowed_status, "get_unfollowed_status")
+        self.assertTrue(0 < unfollowed_bytes < 50)
+        self.assertLess(self._bytes_read(check_12_hours_passed, "check_12_hours_passed"), 50)
+        self.assertLess(self._bytes_read(check_instagram_counts, "check_instagram_counts"), 50)
+        # The status check needs the credentials, never the biography
+        self.assertLess(self._bytes_read(check_instagram_status, "check_instagram_status"), 1000)
+
+    def test_profile_endpoint_reads_only_serialized_columns(self):
+        bytes_read = self._bytes_read(get_instagram_user_profile, "get_instagram_user_profile")
+        # The biography is part of the profile, the credentials are not
+        self.assertGreater(bytes_read, 20000)
+        self.assertLess(bytes_read, 22000)
+
+    def test_deferred_fields_load_on_access(self):
+        account = InstagramUser_data.objects.projection("unfollowed").get(user=self.user)
+        self.assertEqual(account.get_deferred_fields() & {"instagram_biography", "session_id"}, {"instagram_biography", "session_id"})
+        self.assertEqual(len(account.instagram_biography), 20000)
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        self.user_data = InstagramUser_data.objects.create(user=self.user, user1_id="123", instagram_follower_count=40)
+        # Instagram sends newest first, so the list reads 1, 2, ..., 40
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, [{"id": str(i), "username": f"user{i}"} for i in range(1, 41)])
+
+    def _get(self, params):
+        request = self.factory.get(reverse("get_dont_follow_back_you"), params)
+        force_authenticate(request, user=self.user)
+        return get_dont_follow_back_you(request)
+
+    def _next_params(self, response):
+        return {key: values[0] for key, values in parse_qs(urlparse(response.data["next"]).query).items()}
+
+    def _ids(self, response):
+        return [user["id"] for user in response.data["results"]]
+
+    def test_pages_stay_stable_when_users_are_removed(self):
+        first = self._get({"pagination": "cursor"})
+        self.assertEqual(self._ids(first), [str(i) for i in range(1, 16)])
+
+        # Remove users of the page already shown before asking for the next one
+        for ig_id in ("3", "7", "15"):
+            request = self.factory.post(reverse("remove_follower"), {"id": ig_id}, format="json")
+            force_authenticate(request, user=self.user)
+            self.assertEqual(remove_follower(request).status_code, status.HTTP_200_OK)
+
+        second = self._get(self._next_params(first))
+        self.assertEqual(self._ids(second), [str(i) for i in range(16, 31)])
+
+        third = self._get(self._next_params(second))
+        self.assertEqual(self._ids(third), [str(i) for i in range(31, 41)])
+        self.assertIsNone(third.data["next"])
+
+    def test_deep_pages_cost_the_same_queries(self):
+        first = self._get({"pagination": "cursor"})
+        second = self._get(self._next_params(first))
+        with CaptureQueriesContext(connection) as first_queries:
+            self._get({"pagination": "cursor"})
+        with CaptureQueriesContext(connection) as deep_queries:
+            self._get(self._next_params(second))
+
+        self.assertEqual(len(first_queries), len(deep_queries))
+        self.assertIn('"ordinal" <', deep_queries[-1]["sql"])
+
+    def test_page_numbers_still_work(self):
+        response = self._get({"page": 3})
+        self.assertEqual(self._ids(response), [str(i) for i in range(31, 41)])
+
+
+class BatchRemovalTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        self.user_data = InstagramUser_data.objects.create(user=self.user, user1_id="123", instagram_following_count=3)
+        users = [{"id": str(i), "username": f"user{i}"} for i in range(1, 6)]
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWING, users)
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, users[:2])
+
+    def _post(self, view, url_name, data):
+        request = self.factory.post(reverse(url_name), data, format="json")
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def test_remove_many_following_in_one_call(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post(remove_following, "remove_following", {"ids": ["1", "3", "4", "9", "3"]})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"removed": ["1", "3", "4"], "not_found": ["9"]})
+        following = FollowEdge.objects.filter(account=self.user_data, direction=FollowEdge.FOLLOWING)
+        self.assertEqual(sorted(following.values_list("profile_id", flat=True)), [2, 5])
+        # Follower 1 is no longer followed back
+        self.assertEqual(list(who_i_dont_follow_he_followback(self.user_data).values_list("profile_id", flat=True)), [1])
+
+        self.user_data.refresh_from_db()
+        self.assertEqual(self.user_data.instagram_following_count, 0)
+        account_writes = [q for q in queries if q["sql"].startswith('UPDATE "api_instagramuser_data"')]
+        self.assertEqual(len(account_writes), 1)
+
+    def test_failed_count_update_keeps_the_edges(self):
+        following = FollowEdge.objects.filter(account=self.user_data, direction=FollowEdge.FOLLOWING)
+        with mock.patch("api.views.decrease_counts", side_effect=DatabaseError("gone")):
+            with self.assertRaises(DatabaseError):
+                self._post(remove_following, "remove_following", {"ids": ["1", "3"]})
+            with self.assertRaises(DatabaseError):
+                self._post(remove_following, "remove_following", {"id": "4"})
+        self.assertEqual(following.count(), 5)
+
+    def test_invalid_ids(self):
+        response = self._post(remove_following, "remove_following", {"ids": "1,2"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_single_removal_accepts_user_id(self):
+        response = self._post(remove_follower, "remove_follower", {"user_id": "2"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(FollowEdge.objects.filter(direction=FollowEdge.FOLLOWER, profile_id=2).exists())
+
+    def test_clear_unfollowed_you_list(self):
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, [])
+        response = self._post(remove_unfollowed_you, "remove_unfollowed_you", {"ids": ["1", "2", "3"]})
+
+        self.assertEqual(response.data, {"removed": ["1", "2"], "not_found": ["3"]})
+        self.assertFalse(who_removed_follower(self.user_data).exists())
+
+
+class ApplyActionsViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.factory = APIRequestFactory()
+        self.user_data = InstagramUser_data.objects.create(
+            user=self.user, user1_id="123", instagram_following_count=4, instagram_follower_count=None,
+        )
+        users = [{"id": str(i), "username": f"user{i}"} for i in range(1, 5)]
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWING, users)
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, users[:3])
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, users[:2])  # user 3 unfollowed you
+
+    def _post(self, data):
+        request = self.factory.post(reverse("apply_list_actions"), data, format="json")
+        force_authenticate(request, user=self.user)
+        return apply_list_actions(request)
+
+    def test_mixed_actions_in_one_transaction(self):
+        actions = [
+            {"type": "remove_following", "id": "4"},
+            {"type": "remove_following", "id": "1"},
+            {"type": "remove_follower", "id": "2"},
+            {"type": "dismiss_unfollowed_you", "id": "3"},
+            {"type": "dismiss_removed_you", "id": "1"},
+            {"type": "remove_following", "id": "99"},
+            {"type": "block", "id": "1"},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post({"actions": actions})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["done", "done", "done", "done", "not_found", "not_found", "invalid"],
+        )
+        following = FollowEdge.objects.filter(account=self.user_data, direction=FollowEdge.FOLLOWING)
+        self.assertEqual(sorted(following.values_list("profile_id", flat=True)), [2, 3])
+        self.assertFalse(who_removed_follower(self.user_data).exists())
+
+        self.user_data.refresh_from_db()
+        self.assertEqual(self.user_data.instagram_following_count, 2)
+        self.assertIsNone(self.user_data.instagram_follower_count)
+        account_writes = [q for q in queries if q["sql"].startswith('UPDATE "api_instagramuser_data"')]
+        self.assertEqual(len(account_writes), 1)
+
+    def test_rejects_bad_payload(self):
+        self.assertEqual(self._post({"actions": []}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._post({"actions": {"type": "remove_follower"}}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def instagram_list_handler(lists, fail_first=(), max_count=None, overlap=0):
+    """Serve fake Instagram followers/following pages from lists = {path: [ids]}.
+
+    max_count caps the page size like Instagram does; overlap repeats the last
+    users of a page at the start of the next one.
+    """
+    failures = set(fail_first)
+
+    def handler(request):
+        path = request.url.path.rstrip("/").rsplit("/", 1)[1]
+        if path in failures:
+            failures.discard(path)
+            return httpx.Response(500)
+        if lists[path] is None:
+            return httpx.Response(401, json={"message": "login_required"})
+
+        start = int(request.url.params.get("max_id", 0))
+        count = int(request.url.params["count"])
+        if max_count:
+            count = min(count, max_count)
+        ids = lists[path][max(start - overlap, 0):start + count]
+        data = {"users": [{"id": str(ig_id), "username": f"user{ig_id}"} for ig_id in ids]}
+        if start + count < len(lists[path]):
+            data["next_max_id"] = str(start + count)
+        return httpx.Response(200, json=data)
+
+    return handler
+
+
+class FetchPipelineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.account = InstagramUser_data.objects.create(
+            user=self.user, user1_id="123", session_id="session", csrftoken="csrf", x_ig_app_id="app",
+        )
+
+    def _refresh(self, handler, scheduler=None):
+        # Generous budgets, so only the tests about pacing wait
+        scheduler = scheduler or RequestScheduler(session_rate=1000, session_burst=1000, global_rate=1000, global_burst=1000)
+
+        async def refresh():
+            async with InstagramClient(transport=httpx.MockTransport(handler)) as client:
+                return await services.refresh_account(client, self.account, scheduler)
+
+        with mock.patch.object(services, "BACKOFF_BASE", 0):
+            return async_to_sync(refresh)()
+
+    def test_fetches_both_lists_page_by_page(self):
+        handler = instagram_list_handler(
+            {"followers": list(range(1, 31)), "following": list(range(20, 41))},
+            fail_first=["following"],
+        )
+        results = self._refresh(handler)
+
+        self.assertEqual(len(results[FollowEdge.FOLLOWER][0].added), 30)
+        self.assertEqual(len(results[FollowEdge.FOLLOWING][0].added), 21)
+        self.assertEqual(who_i_dont_follow_he_followback(self.account).count(), 19)
+        self.assertEqual(who_i_follow_he_dont_followback(self.account).count(), 10)
+        self.assertFalse(UploadSession.objects.filter(status=UploadSession.OPEN).exists())
+
+    def test_failed_list_does_not_block_the_other(self):
+        handler = instagram_list_handler({"followers": list(range(1, 6)), "following": None})
+        with self.assertRaises(services.FetchError):
+            self._refresh(handler)
+
+        self.assertEqual(FollowEdge.objects.filter(account=self.account, direction=FollowEdge.FOLLOWER).count(), 5)
+        self.assertFalse(FollowEdge.objects.filter(account=self.account, direction=FollowEdge.FOLLOWING).exists())
+
+    def test_page_size_adapts_without_rewalking(self):
+        # 500 users, pages capped at 40, each page repeating 5 users of the previous one
+        handler = instagram_list_handler(
+            {"followers": list(range(1, 501)), "following": list(range(1, 3))},
+            fail_first=["followers"], max_count=40, overlap=5,
+        )
+        results = self._refresh(handler)
+
+        diff, stats = results[FollowEdge.FOLLOWER]
+        self.assertEqual(len(diff.added), 500)
+        self.assertEqual(stats.users, 500)
+        self.assertGreater(stats.duplicates, 0)
+        # A 500 only backs off; capped at 40 -> 25: one retry, then 25-user pages
+        self.assertEqual(stats.retries, 1)
+        self.assertEqual(stats.page_size, 25)
+        self.assertEqual(stats.requests, 2 + (500 - 40) // 25 + 1)
+
+        _, following_stats = results[FollowEdge.FOLLOWING]
+        self.assertEqual(following_stats.as_dict()["requests"], 1)
+
+    def test_only_a_rejected_page_size_steps_down(self):
+        serve = instagram_list_handler({"followers": list(range(1, 301)), "following": list(range(1, 3))}, fail_first=["following"])
+
+        def reject_100(request):
+            if request.url.params["count"] == "100" and "followers" in request.url.path:
+                return httpx.Response(400)
+            return serve(request)
+
+        results = self._refresh(reject_100)
+        self.assertEqual(results[FollowEdge.FOLLOWER][1].page_size, 50)
+        self.assertEqual(results[FollowEdge.FOLLOWER][1].requests, 1 + 6)
+        self.assertEqual(results[FollowEdge.FOLLOWING][1].retries, 1)
+        self.assertEqual(results[FollowEdge.FOLLOWING][1].page_size, 100)
+
+    def test_rate_limited_session_waits_for_retry_after(self):
+        answered_429 = []
+
+        def handler(request):
+            if not answered_429:
+                answered_429.append(request)
+                return httpx.Response(429, headers={"Retry-After": "0.3"})
+            return httpx.Response(200, json={"users": [{"id": "1", "username": "user1"}]})
+
+        start = time.monotonic()
+        results = self._refresh(handler)
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        retries = [stats.retries for _, stats in results.values()]
+        self.assertEqual(sorted(retries), [0, 1])
+
+
+    def test_interrupted_fetch_resumes_from_checkpoint(self):
+        lists = {"followers": list(range(1, 301)), "following": list(range(1, 3))}
+        serve = instagram_list_handler(lists)
+        requested = []
+
+        def failing_after_200(request):
+            requested.append(request.url.params.get("max_id"))
+            if int(request.url.params.get("max_id", 0)) >= 200:
+                return httpx.Response(403)
+            return serve(request)
+
+        with self.assertRaises(services.FetchError):
+            self._refresh(failing_after_200)
+        session = UploadSession.objects.get(direction=FollowEdge.FOLLOWER, status=UploadSession.OPEN)
+        self.assertEqual(session.cursor, "200")
+        self.assertFalse(FollowEdge.objects.filter(account=self.account, direction=FollowEdge.FOLLOWER).exists())
+
+        requested.clear()
+        results = self._refresh(lambda request: requested.append(request.url.params.get("max_id")) or serve(request))
+
+        diff, stats = results[FollowEdge.FOLLOWER]
+        self.assertEqual(len(diff.added), 300)
+        self.assertEqual(stats.resumed_pages, 2)
+        self.assertEqual(stats.requests, 1)
+        # Only the last followers page was requested again
+        self.assertIn("200", requested)
+        self.assertNotIn("100", requested)
+
+    def test_failed_resume_starts_over_next_time(self):
+        lists = {"followers": list(range(1, 301)), "following": list(range(1, 3))}
+        serve = instagram_list_handler(lists)
+        requested = []
+
+        def stale_cursor(request):
+            requested.append(request.url.params.get("max_id"))
+            if int(request.url.params.get("max_id", 0)) >= 200:
+                return httpx.Response(400)
+            return serve(request)
+
+        with self.assertRaises(services.FetchError):
+            self._refresh(stale_cursor)
+        with self.assertRaises(services.FetchError):
+            self._refresh(stale_cursor)
+        self.assertIsNone(UploadSession.objects.get(direction=FollowEdge.FOLLOWER, status=UploadSession.OPEN).cursor)
+
+        requested.clear()
+        results = self._refresh(lambda request: requested.append(request.url.params.get("max_id")) or serve(request))
+        diff, stats = results[FollowEdge.FOLLOWER]
+        self.assertEqual(len(diff.added), 300)
+        self.assertEqual(stats.resumed_pages, 0)
+        self.assertIn(None, requested)
+
+    def _refresh_accounts(self, accounts, handler):
+        client = functools.partial(InstagramClient, transport=httpx.MockTransport(handler))
+        with mock.patch.object(services, "InstagramClient", client):
+            return async_to_sync(services.refresh_accounts)(accounts)
+
+    def test_a_non_json_answer_fails_only_its_account(self):
+        other = InstagramUser_data.objects.create(
+            user=User.objects.create_user(username="other"), user1_id="456", session_id="other", csrftoken="csrf", x_ig_app_id="app",
+        )
+        serve = instagram_list_handler({"followers": [1, 2], "following": [3]})
+
+        def login_page_for_123(request):
+            if "/123/" in request.url.path:
+                return httpx.Response(200, text="<html>Login</html>")
+            return serve(request)
+
+        outcomes = self._refresh_accounts([self.account, other], login_page_for_123)
+
+        self.assertIsInstance(outcomes[self.account.pk], services.FetchError)
+        self.assertEqual(len(outcomes[other.pk][FollowEdge.FOLLOWER][0].added), 2)
+
+    def test_unexpected_errors_are_outcomes(self):
+        with mock.patch.object(services, "refresh_account", side_effect=RuntimeError("database gone")), self.assertLogs("api.services", "ERROR"):
+            outcomes = self._refresh_accounts([self.account], instagram_list_handler({}))
+        self.assertIsInstance(outcomes[self.account.pk], RuntimeError)
+
+class InstagramClientTest(TestCase):
+    def test_endpoints_share_one_client(self):
+        account = InstagramUser_data(user1_id="123", session_id="session", csrftoken="csrf", x_ig_app_id="app")
+        seen = []
+
+        def handler(request):
+            seen.append((request.method, request.url.path, dict(request.url.params), request.headers["x-ig-app-id"]))
+            return httpx.Response(200, json={"status": "ok"})
+
+        async def call_all():
+            async with InstagramClient(transport=httpx.MockTransport(handler)) as client:
+                await client.friendships(account, FollowEdge.FOLLOWER, 50, max_id="abc")
+                await client.user_info(account)
+                await client.graphql_profile(account, "456")
+                await client.inbox(account)
+                await client.topsearch(account, "cats")
+
+        async_to_sync(call_all)()
+
+        self.assertEqual([(method, path) for method, path, _, _ in seen], [
+            ("GET", "/api/v1/friendships/123/followers/"),
+            ("GET", "/api/v1/users/123/info/"),
+            ("POST", "/graphql/query"),
+            ("GET", "/api/v1/direct_v2/inbox/"),
+            ("GET", "/api/v1/web/search/topsearch/"),
+        ])
+        self.assertEqual(seen[0][2], {"count": "50", "max_id": "abc"})
+        self.assertEqual(seen[4][2]["query"], "cats")
+        self.assertTrue(all(app_id == "app" for _, _, _, app_id in seen))
+
+class RefreshWorkerTest(TestCase):
+    def _account(self, username, hours_ago):
+        user = User.objects.create_user(username=username, password="testpassword")
+        account = InstagramUser_data.objects.create(
+            user=user, user1_id=username, session_id="session-" + username, csrftoken="csrf", x_ig_app_id="app",
+        )
+        InstagramUser_data.objects.filter(pk=account.pk).update(last_time_fetched=timezone.now() - timedelta(hours=hours_ago))
+        account.refresh_from_db()
+        return account
+
+    def test_slots_spread_accounts_over_the_interval(self):
+        fetched = timezone.now()
+        hours = set()
+        for pk in range(1, 241):
+            due_at = refresh.refresh_due_at(InstagramUser_data(pk=pk, last_time_fetched=fetched))
+            self.assertTrue(fetched + refresh.REFRESH_INTERVAL <= due_at < fetched + 2 * refresh.REFRESH_INTERVAL)
+            hours.add(int((due_at - fetched - refresh.REFRESH_INTERVAL).total_seconds() // 3600))
+        # Accounts fetched at the same moment come due across all 12 hours
+        self.assertEqual(hours, set(range(12)))
+
+    def test_scan_queues_only_new_due_accounts(self):
+        old = self._account("old", 30)
+        due = self._account("due", 13)
+        self._account("fresh", 1)
+
+        queue = refresh.RefreshQueue()
+        with CaptureQueriesContext(connection) as queries:
+            queue.scan(timezone.now())
+        self.assertEqual(sorted(account.pk for _, _, account in queue.heap), [old.pk, due.pk])
+        self.assertIn('"last_time_fetched" <=', queries[0]["sql"])
+
+        queue.scan(timezone.now())
+        self.assertEqual(len(queue), 2)
+
+    def test_once_refreshes_accounts_whose_slot_has_come(self):
+        accounts = [self._account(f"user{i}", 36) for i in range(3)]
+        self._account("fresh", 1)
+        handler = instagram_list_handler({"followers": [1, 2], "following": [2, 3]})
+
+        async def run():
+            async with InstagramClient(transport=httpx.MockTransport(handler)) as client:
+                return await refresh.run_refresh_worker(once=True, client=client, scheduler=RequestScheduler(
+                    session_rate=1000, session_burst=1000, global_rate=1000, global_burst=1000,
+                ))
+
+        counts = async_to_sync(run)()
+
+        # 36 hours ago puts every slot in the past
+        self.assertEqual(counts, {"refreshed": 3, "failed": 0})
+        for account in accounts:
+            account.refresh_from_db()
+            self.assertFalse(account.has_12_hours_passed_since_last_fetch())
+
+    def test_any_failure_requeues_the_account(self):
+        account = self._account("broken", 36)
+        pushed = []
+        push = refresh.RefreshQueue.push
+
+        def record_push(queue, due_at, account):
+            pushed.append((due_at, account.pk))
+            push(queue, due_at, account)
+
+        async def run_briefly():
+            worker = asyncio.create_task(refresh.run_refresh_worker(client=object(), scheduler=RequestScheduler()))
+            await asyncio.sleep(0.3)
+            worker.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await worker
+
+        with mock.patch.object(refresh, "refresh_account", side_effect=ValueError("Expecting value")), \
+                mock.patch.object(refresh.RefreshQueue, "push", record_push), \
+                self.assertLogs("api.refresh", "ERROR"):
+            async_to_sync(run_briefly)()
+
+        # Queued by the scan, then again an hour on after the failure
+        self.assertEqual([pk for _, pk in pushed], [account.pk, account.pk])
+        self.assertGreater(pushed[1][0], timezone.now() + refresh.FAILURE_BACKOFF - timedelta(minutes=1))
+
+class FollowSnapshotTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.account = InstagramUser_data.objects.create(user=self.user, user1_id="123")
+
+    def _fetch(self, ids):
+        save_fetched_list(self.account, FollowEdge.FOLLOWER, [{"id": str(ig_id)} for ig_id in ids])
+
+    def test_varint_gaps_round_trip(self):
+        ids = [1, 127, 128, 300, 2 ** 40, 2 ** 62]
+        self.assertEqual(snapshots.decode_ids(snapshots.encode_ids(ids)), ids)
+
+    def test_any_two_snapshots_can_be_rebuilt_and_diffed(self):
+        fetches = [[1, 2, 3], [2, 3, 4], [3, 4, 5, 6], [1, 6]]
+        with mock.patch.object(snapshots, "KEYFRAME_INTERVAL", 2):
+            for ids in fetches:
+                self._fetch(ids)
+
+        history = snapshots.snapshots(self.account, FollowEdge.FOLLOWER)
+        self.assertEqual(list(history.filter(keyframe=True).values_list("number", flat=True)), [1, 3])
+        for number, ids in enumerate(fetches, start=1):
+            self.assertEqual(snapshots.load_snapshot(self.account, FollowEdge.FOLLOWER, number), set(ids))
+        self.assertEqual(snapshots.diff_snapshots(self.account, FollowEdge.FOLLOWER, 1, 4), ([6], [2, 3]))
+        self.assertEqual(snapshots.diff_snapshots(self.account, FollowEdge.FOLLOWER, 2, 3), ([5, 6], [2]))
+        self.assertIsNone(snapshots.diff_snapshots(self.account, FollowEdge.FOLLOWER, 1, 9))
+
+    def test_removals_from_the_app_reach_the_history(self):
+        self._fetch([1, 2, 3])
+        remove_edges(self.account, FollowEdge.FOLLOWER, [2])
+        self._fetch([1, 3])
+        remove_edges(self.account, FollowEdge.FOLLOWER, [3])
+        self._fetch([1, 3, 4])  # 3 comes back
+
+        self.assertEqual(snapshots.load_snapshot(self.account, FollowEdge.FOLLOWER, 2), {1, 3})
+        self.assertEqual(snapshots.load_snapshot(self.account, FollowEdge.FOLLOWER, 3), {1, 3, 4})
+        self.assertEqual(snapshots.diff_snapshots(self.account, FollowEdge.FOLLOWER, 1, 2), ([], [2]))
+        self.assertEqual(snapshots.diff_snapshots(self.account, FollowEdge.FOLLOWER, 2, 3), ([4], []))
+
+    def test_pruning_keeps_history_rebuildable(self):
+        for ids in ([1, 2], [2, 3], [3, 4]):
+            self._fetch(ids)
+        history = snapshots.snapshots(self.account, FollowEdge.FOLLOWER)
+        history.filter(number__lte=2).update(taken_at=timezone.now() - timedelta(days=100))
+
+        snapshots.prune_snapshots(self.account, FollowEdge.FOLLOWER, timezone.now() - snapshots.SNAPSHOT_RETENTION)
+
+        self.assertEqual(list(history.values_list("number", "keyframe")), [(3, True)])
+        self.assertEqual(snapshots.load_snapshot(self.account, FollowEdge.FOLLOWER, 3), {3, 4})
+
+    def test_ninety_days_of_history_costs_kilobytes(self):
+        rng = random.Random(7)
+        followers = set(rng.sample(range(1, 60_000_000_000), 2000))
+        # Two fetches a day for 90 days, a few followers coming and going each time
+        for number in range(1, 181):
+            diff = FollowDiff()
+            if number > 1:
+                diff.removed = rng.sample(sorted(followers), 5)
+                diff.added = [rng.randrange(1, 60_000_000_000) for _ in range(5)]
+                followers.difference_update(diff.removed)
+                followers.update(diff.added)
+            snapshots.record_snapshot(self.account, FollowEdge.FOLLOWER, number, list(followers), diff)
+
+        rows = FollowSnapshot.objects.filter(account=self.account)
+        stored = sum(len(row.ids) + len(row.added) + len(row.removed) for row in rows)
+        self.assertLess(stored, 32 * 1024)
+        self.assertEqual(snapshots.load_snapshot(self.account, FollowEdge.FOLLOWER, 180), followers)
+
+class SharedProfileTest(TestCase):
+    def test_profiles_are_stored_once_and_refreshed_in_place(self):
+        users = [User.objects.create_user(username=f"app{i}", password="testpassword") for i in range(2)]
+        accounts = [InstagramUser_data.objects.create(user=user, user1_id=str(i)) for i, user in enumerate(users)]
+        celebrity = {"id": "42", "username": "celebrity", "full_name": "Celebrity", "profile_pic_url": "https://pic/1"}
+
+        save_fetched_list(accounts[0], FollowEdge.FOLLOWING, [celebrity])
+        renamed = dict(celebrity, username="celebrity.official", profile_pic_url="https://pic/2")
+        save_fetched_list(accounts[1], FollowEdge.FOLLOWING, [renamed, {"id": "7", "username": "friend"}])
+
+        self.assertEqual(InstagramProfile.objects.count(), 2)
+        profile = InstagramProfile.objects.get(id=42)
+        self.assertEqual((profile.username, profile.profile_pic_url), ("celebrity.official", "https://pic/2"))
+
+    def test_unchanged_profiles_are_not_rewritten(self):
+        user = User.objects.create_user(username="app", password="testpassword")
+        account = InstagramUser_data.objects.create(user=user, user1_id="1")
+        users = [{"id": str(i), "username": f"user{i}"} for i in range(1, 51)]
+        save_fetched_list(account, FollowEdge.FOLLOWER, users)
+
+        with CaptureQueriesContext(connection) as queries:
+            save_profiles(users)
+        self.assertFalse([q for q in queries if q["sql"].startswith('INSERT INTO "api_instagramprofile"')])
+
+    def test_fetched_users_are_compacted(self):
+        user = User.objects.create_user(username="app", password="testpassword")
+        account = InstagramUser_data.objects.create(user=user, user1_id="1")
+        users = [
+            {"pk": 7, "pk_id": "7", "username": "friend", "full_name": None, "is_private": 1,
+             "profile_pic_url": "https://pic/7?oh=signature", "fbid_v2": "17841400000000007",
+             "has_anonymous_profile_picture": False, "latest_reel_media": 0, "account_badges": []},
+            {"pk": "7", "username": "duplicate"},
+            {"username": "no id"},
+        ]
+
+        compacted, sizes = compact_users(users)
+        self.assertEqual(compacted, {7: {
+            "id": 7, "username": "friend", "full_name": "", "profile_pic_url": "https://pic/7?oh=signature",
+            "is_private": True, "is_verified": False,
+        }})
+        self.assertEqual(sizes["users"], 1)
+        self.assertLess(sizes["bytes_out"], sizes["bytes_in"])
+
+        diff, timings, sizes = save_fetched_list(account, FollowEdge.FOLLOWER, users)
+        self.assertEqual(diff.added, [7])
+        self.assertTrue(InstagramProfile.objects.get(id=7).is_private)
+
+
+class ListCountersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.user_data = InstagramUser_data.objects.create(
+            user=self.user, user1_id="123", instagram_follower_count=12, old_instagram_follower_count=10,
+        )
+        users = [{"id": str(i), "username": f"user{i}"} for i in range(1, 7)]
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWING, users[:4])
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, users[2:])
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWING, users[1:4])  # 1 removed from following
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, users[3:])  # 3 unfollowed you
+
+    def assertCountersMatchEdges(self):
+        account = InstagramUser_data.objects.get(pk=self.user_data.pk)
+        self.assertEqual(account.unfollowed_you_count, who_removed_follower(account).count())
+        self.assertEqual(account.removed_following_count, who_removed_following(account).count())
+        self.assertEqual(account.dont_follow_back_count, who_i_follow_he_dont_followback(account).count())
+        self.assertEqual(account.you_dont_follow_back_count, who_i_dont_follow_he_followback(account).count())
+        return account
+
+    def test_diff_keeps_counters(self):
+        account = self.assertCountersMatchEdges()
+        self.assertEqual(
+            (account.unfollowed_you_count, account.removed_following_count,
+             account.dont_follow_back_count, account.you_dont_follow_back_count),
+            (1, 1, 2, 2),
+        )
+
+        # 3 follows you again
+        save_fetched_list(self.user_data, FollowEdge.FOLLOWER, [{"id": "3"}, {"id": "4"}, {"id": "5"}])
+        self.assertCountersMatchEdges()
+
+    def test_removals_keep_counters(self):
+        remove_edges(self.user_data, FollowEdge.FOLLOWING, [2, 4])  # one not mutual, one mutual
+        self.assertCountersMatchEdges()
+        forget_removed_edges(self.user_data, FollowEdge.FOLLOWER, [3])
+        self.assertCountersMatchEdges()
+
+        apply_actions(self.user_data, [
+            {"type": "remove_follower", "id": "5"},
+            {"type": "dismiss_removed_you", "id": "1"},
+        ])
+        self.assertCountersMatchEdges()
+
+    def test_stats_are_one_query(self):
+        request = APIRequestFactory().get(reverse("instagram_stats_difference"))
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = instagram_stats_difference(request)
+        # One query for the stats, after the data version lookup
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(response.data, {
+            "follower_difference": 2,
+            "following_difference": None,
+            "unfollowed_you_count": 1,
+            "removed_following_count": 1,
+            "dont_follow_back_count": 2,
+            "you_dont_follow_back_count": 2,
+        })
+
+    def test_stats_come_from_the_newest_row(self):
+        InstagramUser_data.objects.create(user=self.user, user1_id="456", instagram_follower_count=7, old_instagram_follower_count=4)
+        request = APIRequestFactory().get(reverse("instagram_stats_difference"))
+        force_authenticate(request, user=self.user)
+        response = instagram_stats_difference(request)
+        self.assertEqual(response.data["follower_difference"], 3)
+        self.assertTrue(response["ETag"].startswith(f'"{InstagramUser_data.objects.latest("pk").pk}-'))
+
+
+class LargeAccountModeTest(TestCase):
+    FETCHES = [
+        (FollowEdge.FOLLOWING, list(range(1, 40))),
+        (FollowEdge.FOLLOWER, list(range(20, 60)) + [25, 30]),  # duplicates keep their first position
+        (FollowEdge.FOLLOWING, list(range(5, 45))),
+        (FollowEdge.FOLLOWER, [70] + list(range(1, 10)) + list(range(30, 55))),
+        (FollowEdge.FOLLOWING, list(range(1, 3)) + list(range(40, 50))),  # 1 and 2 come back
+    ]
+
+    def _apply_fetches(self, username, large_list_size):
+        user = User.objects.create_user(username=username, password="testpassword")
+        account = InstagramUser_data.objects.create(user=user, user1_id="1")
+        diffs = []
+        with mock.patch.object(diff_module, "LARGE_LIST_SIZE", large_list_size):
+            for direction, ig_ids in self.FETCHES:
+                diff, timings, sizes = save_fetched_list(account, direction, [{"id": str(i)} for i in ig_ids])
+                diffs.append((sorted(diff.added), sorted(diff.returning), sorted(diff.removed), sorted(diff.mutual_lost),
+                              sorted(diff.mutual_gained), diff.not_back_count, diff.other_not_back_count))
+        edges = FollowEdge.objects.filter(account=account).order_by("direction", "profile_id").values_list(
+            "direction", "profile_id", "ordinal", "first_seen_snapshot", "removed_snapshot", "mutual",
+        )
+        account = InstagramUser_data.objects.projection_values("stats").get(pk=account.pk)
+        history = [snapshots.load_snapshot(account_id, direction, number) for account_id, direction, number in
+                   FollowSnapshot.objects.filter(account__user=user).values_list("account", "direction", "number")]
+        return diffs, list(edges), account, history
+
+    def test_large_mode_matches_the_in_memory_diff(self):
+        self.assertEqual(self._apply_fetches("small", 10 ** 9), self._apply_fetches("large", 1))
+
+    def test_counts_check_has_no_ceiling(self):
+        user = User.objects.create_user(username="big", password="testpassword")
+        InstagramUser_data.objects.create(user=user, user1_id="1", instagram_follower_count=400000, instagram_following_count=7500)
+        request = APIRequestFactory().get(reverse("check_instagram_counts"))
+        force_authenticate(request, user=user)
+        response = check_instagram_counts(request)
+        self.assertEqual(response.data, {"status": True, "large_account": True})
+
+
+@override_settings(AUTH_USER_CACHE_TTL=0)
+class BenchmarkHarnessTest(TestCase):
+    def test_synthetic_lists_overlap(self):
+        following, followers = synthetic_lists(100, mutual_share=0.6)
+        following_ids = {user["id"] for user in following}
+        self.assertEqual(len(following_ids), 100)
+        self.assertEqual(len(following_ids & {user["id"] for user in followers}), 60)
+        self.assertIn("oh=", following[0]["profile_pic_url"])
+
+    def test_every_step_runs_on_a_small_list(self):
+        with mock.patch.object(cache, "get_redis", return_value=FakeRedis()):
+            results = EndpointBenchmark(30, repeat=2).run()
+        steps = {result["step"] for result in results}
+        self.assertTrue({"save_following", "diff", "save_single_request", "stats", "apply_actions"} <= steps)
+        # The user of the token is cached after the first request; the data
+        # version is read first, then the stats
+        self.assertEqual(next(r for r in results if r["step"] == "stats")["queries"], 2)
+        self.assertFalse(User.objects.filter(username__startswith="benchmark-").exists())
+
+
+@override_settings(AUTH_USER_CACHE_TTL=0)
+class AsyncReadViewsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="asyncuser", password="testpassword")
+        self.account = InstagramUser_data.objects.create(
+            user=self.user, user1_id="123", session_id="s", csrftoken="c", x_ig_app_id="a",
+            instagram_username="me", instagram_follower_count=3, old_instagram_follower_count=2,
+        )
+        save_fetched_list(self.account, FollowEdge.FOLLOWING, [{"id": "1", "username": "one"}, {"id": "2", "username": "two"}])
+        save_fetched_list(self.account, FollowEdge.FOLLOWER, [{"id": "2"}, {"id": "3"}, {"id": "4"}])
+        save_fetched_list(self.account, FollowEdge.FOLLOWER, [{"id": "2"}, {"id": "3"}])
+        self.factory = APIRequestFactory()
+        self.authorization = f"Bearer {RefreshToken.for_user(self.user).access_token}"
+
+    def get_both(self, sync_view, async_view, query=None):
+        request = self.factory.get("/api/read/", query or {}, HTTP_AUTHORIZATION=self.authorization)
+        expected = sync_view(request)
+        expected.render()
+        request = self.factory.get("/api/read/", query or {}, HTTP_AUTHORIZATION=self.authorization)
+        response = async_to_sync(async_view)(request)
+        return expected, response
+
+    def test_async_views_answer_like_the_sync_views(self):
+        pairs = [
+            (check_instagram_status, async_views.check_instagram_status, None),
+            (get_instagram_user_profile, async_views.get_instagram_user_profile, None),
+            (get_unfollowed_status, async_views.get_unfollowed_status, None),
+            (check_12_hours_passed, async_views.check_12_hours_passed, None),
+            (instagram_stats_difference, async_views.instagram_stats_difference, None),
+            (get_followed_but_not_followed_back, async_views.get_followed_but_not_followed_back, {"pagination": "cursor"}),
+            (get_dont_follow_back_you, async_views.get_dont_follow_back_you, {"pagination": "cursor"}),
+            (get_unfollowed_you, async_views.get_unfollowed_you, {"pagination": "cursor"}),
+            (get_who_removed_you, async_views.get_who_removed_you, {"pagination": "cursor"}),
+        ]
+        with self.settings(RELATIONSHIP_CACHE_ENABLED=False):
+            pairs.append((get_dont_follow_back_you, async_views.get_dont_follow_back_you, {"page_size": 1}))
+            for sync_view, async_view, query in pairs:
+                expected, response = self.get_both(sync_view, async_view, query)
+                self.assertEqual(response.status_code, expected.status_code, async_view.__name__)
+                self.assertEqual(response.content, expected.content, async_view.__name__)
+
+    def test_list_reads_from_the_redis_cache(self):
+        with mock.patch.object(cache, "get_redis", return_value=FakeRedis()):
+            expected, response = self.get_both(get_unfollowed_you, async_views.get_unfollowed_you)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(json.loads(response.content)["results"][0]["id"], "4")
+
+    def test_errors_match_the_sync_views(self):
+        # An invalid page is a 404 from the paginator
+        with self.settings(RELATIONSHIP_CACHE_ENABLED=False):
+            expected, response = self.get_both(get_dont_follow_back_you, async_views.get_dont_follow_back_you, {"page": 9})
+        self.assertEqual((response.status_code, response.content), (404, expected.content))
+
+        self.account.delete()
+        expected, response = self.get_both(get_who_removed_you, async_views.get_who_removed_you)
+        self.assertEqual((response.status_code, response.content), (404, expected.content))
+
+    def test_requires_a_valid_token(self):
+        response = async_to_sync(async_views.instagram_stats_difference)(self.factory.get("/api/read/"))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], 'Bearer realm="api"')
+
+        request = self.factory.get("/api/read/", HTTP_AUTHORIZATION="Bearer nope")
+        response = async_to_sync(async_views.instagram_stats_difference)(request)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)["code"], "token_not_valid")
+
+        request = self.factory.post("/api/read/", HTTP_AUTHORIZATION=self.authorization)
+        self.assertEqual(async_to_sync(async_views.instagram_stats_difference)(request).status_code, 405)
+
+
+class HomeViewTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="homeuser", password="testpassword")
+        self.account = InstagramUser_data.objects.create(
+            user=self.user, user1_id="123", session_id="s", csrftoken="c", x_ig_app_id="a",
+            instagram_username="me", instagram_follower_count=3, old_instagram_follower_count=2,
+            instagram_following_count=2,
+        )
+        save_fetched_list(self.account, FollowEdge.FOLLOWING, [{"id": "1"}, {"id": "2"}])
+        save_fetched_list(self.account, FollowEdge.FOLLOWER, [{"id": "2"}, {"id": "3"}])
+        UserCredit.objects.create(user=self.user, balance=12.5)
+        self.factory = APIRequestFactory()
+
+    def get(self, view, **headers):
+        request = self.factory.get("/api/home/", **headers)
+        force_authenticate(request, user=self.user)
+        response = view(request)
+        if response.status_code != 304:
+            response.render()
+        return response
+
+    def test_sections_match_the_single_endpoints(self):
+        body = json.loads(self.get(home).content)
+        single = {
+            "instagram_status": check_instagram_status,
+            "unfollowed_status": get_unfollowed_status,
+            "first_time_flag": get_first_time_flag,
+            "has_12_hours_passed": check_12_hours_passed,
+            "instagram_counts": check_instagram_counts,
+            "profile": get_instagram_user_profile,
+            "subscription": get_active_subscription,
+            "credit": get_user_credit,
+            "stats": instagram_stats_difference,
+        }
+        self.assertEqual(set(body), set(single))
+        for key, view in single.items():
+            self.assertEqual(body[key], json.loads(self.get(view).content), key)
+        self.assertEqual(body["subscription"]["plan"], "trial")
+        self.assertEqual(body["stats"]["dont_follow_back_count"], 1)
+
+    def test_at_most_three_queries(self):
+        with self.assertNumQueries(3):
+            self.get(home)
+
+    def test_unchanged_state_is_not_modified(self):
+        etag = self.get(home)["ETag"]
+        response = self.get(home, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        UserCredit.objects.filter(user=self.user).update(balance=20)
+        response = self.get(home, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_user_without_instagram_account(self):
+        self.account.delete()
+        UserCredit.objects.all().delete()
+        body = json.loads(self.get(home).content)
+        self.assertEqual(body["instagram_status"]["connected"], False)
+        self.assertEqual(body["profile"], {"error": "Instagram user data not found"})
+        self.assertEqual(body["credit"]["credit_balance"], "0.00")
+        self.assertEqual(body["first_time_flag"], {"is_first_time_connected_flag": True})
+
+
+@override_settings(AUTH_USER_CACHE_TTL=0)
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="etaguser", password="testpassword")
+        self.account = InstagramUser_data.objects.create(user=self.user, user1_id="123", instagram_follower_count=2)
+        save_fetched_list(self.account, FollowEdge.FOLLOWING, [{"id": "1"}, {"id": "2"}])
+        save_fetched_list(self.account, FollowEdge.FOLLOWER, [{"id": "2"}, {"id": "3"}])
+        self.factory = APIRequestFactory()
+
+    def get(self, view, query=None, **headers):
+        request = self.factory.get("/api/read/", query or {}, **headers)
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def test_unchanged_data_costs_one_query(self):
+        for view in (get_instagram_user_profile, instagram_stats_difference, get_dont_follow_back_you, get_who_removed_you):
+            response = self.get(view)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Cache-Control"], "private, no-cache")
+            with self.assertNumQueries(1):
+                response = self.get(view, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304, view.__name__)
+
+        last_modified = self.get(instagram_stats_difference)["Last-Modified"]
+        self.assertEqual(self.get(instagram_stats_difference, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_saves_and_removals_change_the_version(self):
+        etag = self.get(get_dont_follow_back_you)["ETag"]
+
+        request = self.factory.post("/api/remove-follower/", {"id": "3"}, format="json")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(remove_follower(request).status_code, 200)
+        response = self.get(get_dont_follow_back_you, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 0)
+        etag = response["ETag"]
+
+        save_fetched_list(self.account, FollowEdge.FOLLOWER, [{"id": "2"}, {"id": "4"}])
+        self.assertEqual(self.get(get_dont_follow_back_you, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.get(get_instagram_user_profile)["ETag"]
+        request = self.factory.post("/api/save-user-instagram-profile/", {"user_data": {"username": "me", "follower_count": 5}}, format="json")
+        force_authenticate(request, user=self.user)
+        save_instagram_user_profile(request)
+        self.assertEqual(self.get(get_instagram_user_profile, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etags_differ_between_accounts(self):
+        other = User.objects.create_user(username="other")
+        InstagramUser_data.objects.create(user=other, user1_id="9")
+        InstagramUser_data.objects.filter(pk=self.account.pk).update(data_version=0)
+        etag = self.get(instagram_stats_difference)["ETag"]
+        request = self.factory.get("/api/read/", HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=other)
+        self.assertEqual(instagram_stats_difference(request).status_code, 200)
+
+    def test_async_views_answer_conditional_gets(self):
+        token = RefreshToken.for_user(self.user).access_token
+        etag = self.get(get_unfollowed_you)["ETag"]
+        request = self.factory.get("/api/read/", HTTP_AUTHORIZATION=f"Bearer {token}", HTTP_IF_NONE_MATCH=etag)
+        response = async_to_sync(async_views.get_unfollowed_you)(request)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+
+class RequestSchedulerTest(TestCase):
+    def test_bucket_paces_requests_after_the_burst(self):
+        async def take(bucket, times):
+            for _ in range(times):
+                await bucket.take()
+
+        start = time.monotonic()
+        async_to_sync(take)(TokenBucket(rate=50, capacity=2), 7)
+        # 2 from the burst, then 5 at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_bucket_starts_empty_after_a_pause(self):
+        taken = []
+
+        async def take_after_pause(bucket):
+            bucket.pause(0.1)
+            for _ in range(5):
+                await bucket.take()
+                taken.append(time.monotonic())
+
+        start = time.monotonic()
+        async_to_sync(take_after_pause)(TokenBucket(rate=20, capacity=5))
+        # No burst of the tokens of the paused time: one token every 50ms
+        self.assertGreaterEqual(taken[0] - start, 0.14)
+        for before, after in zip(taken, taken[1:]):
+            self.assertGreaterEqual(after - before, 0.04)
+
+    def test_sessions_share_the_global_budget_fairly(self):
+        order = []
+
+        async def fetch(scheduler, session_key):
+            for _ in range(5):
+                await scheduler.wait_turn(session_key)
+                order.append(session_key)
+
+        async def run():
+            scheduler = RequestScheduler(session_rate=1000, session_burst=10, global_rate=200, global_burst=1)
+            await asyncio.gather(fetch(scheduler, "a"), fetch(scheduler, "b"))
+
+        async_to_sync(run)()
+        runs = "".join(order)
+        self.assertEqual(sorted(runs), list("aaaaabbbbb"))
+        self.assertNotIn("aaa", runs)
+        self.assertNotIn("bbb", runs)
@@ -0,0 +1,115 @@
+"""Chunked upload of followers/following lists.
+
+The app opens a session, sends every page it gets from Instagram as soon as
+it arrives and commits once the last page is sent. Profiles are saved while
+the pages come in and only their ids are staged, so the request bodies and
+the memory used per request stay proportional to one page. The diff against
+the stored list runs once, at commit.
+"""
+from django.db import DatabaseError, transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import UploadSession, UploadPage, FollowEdge
+from .diff import apply_fetched_ids, id_array
+from .edges import save_profiles
+
+DIRECTIONS = {
+    'followers': FollowEdge.FOLLOWER,
+    'follower': FollowEdge.FOLLOWER,
+    'following': FollowEdge.FOLLOWING,
+}
+
+
+class UploadError(Exception):
+    """Raised when a session can't accept a page or be committed."""
+
+
+def begin_upload(account, direction, source=UploadSession.APP):
+    """Open a new upload session, dropping the unfinished ones of the same list and source."""
+    UploadSession.objects.filter(account=account, direction=direction, source=source, status=UploadSession.OPEN).delete()
+    return UploadSession.objects.create(account=account, direction=direction, source=source)
+
+
+@transaction.atomic
+def stage_page(session, number, users, cursor=None):
+    """Save the profiles of one page and stage its ids.
+
+    Sending the same page number again replaces it, so a client can retry a
+    page whose response it never got. A server-side fetch passes the cursor
+    of the next page, saved with the page as a checkpoint.
+
+    Returns the sizes of the page before and after compaction.
+    """
+    if session.status != UploadSession.OPEN:
+        raise UploadError("Upload session is already committed.")
+
+    ig_ids, sizes = save_profiles(users)
+    UploadPage.objects.update_or_create(session=session, number=number, defaults={'ig_ids': ig_ids})
+    if cursor is not None:
+        session.cursor = cursor
+        session.save(update_fields=['cursor'])
+    return sizes
+
+
+def resumable_fetch(account, direction, since):
+    """The checkpointed, uncommitted server-side fetch of a list started after since, if any."""
+    return (
+        UploadSession.objects
+        .filter(account=account, direction=direction, source=UploadSession.FETCH, status=UploadSession.OPEN,
+                cursor__isnull=False, created_at__gte=since)
+        .order_by('-created_at')
+        .first()
+    )
+
+
+def forget_checkpoint(session):
+    """Make a server-side fetch unresumable: the next fetch of the list starts over."""
+    UploadSession.objects.filter(pk=session.pk).update(cursor=None)
+
+
+def received_pages(session):
+    return list(session.pages.order_by('number').values_list('number', flat=True))
+
+
+def iter_staged_ids(session):
+    """Yield the staged ids of a session page by page, in page order."""
+    pages = session.pages.order_by('number').values_list('ig_ids', flat=True)
+    for ig_ids in pages.iterator(chunk_size=50):
+        yield from ig_ids
+
+
+@transaction.atomic
+def commit_upload(session, expected_pages=None):
+    """Diff the staged list against the stored one and close the session.
+
+    Raises UploadError if another session of the list is being committed.
+    """
+    try:
+        # Every unfinished session of the list is locked, so two commits of
+        # one list never diff it at the same time
+        list(
+            UploadSession.objects.select_for_update(nowait=True)
+            .filter(account_id=session.account_id, direction=session.direction, status=UploadSession.OPEN)
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+    except DatabaseError as e:
+        raise UploadError("Another upload of this list is being committed.") from e
+    session = UploadSession.objects.select_for_update().get(pk=session.pk)
+    if session.status != UploadSession.OPEN:
+        raise UploadError("Upload session is already committed.")
+
+    if expected_pages is not None:
+        count = session.pages.aggregate(count=Count('id'))['count']
+        if count != expected_pages or session.pages.filter(number__gte=expected_pages).exists():
+            raise UploadError(f"Expected pages 0 to {expected_pages - 1}, received {received_pages(session)}.")
+
+    # Only ids are held in memory here, 8 bytes each, never the user dicts
+    fetched_ids = id_array(iter_staged_ids(session))
+    diff, timings = apply_fetched_ids(session.account, session.direction, fetched_ids)
+
+    session.pages.all().delete()
+    session.status = UploadSession.COMMITTED
+    session.committed_at = timezone.now()
+    session.save(update_fields=['status', 'committed_at'])
+    return diff, timings
@@ -1,13 +1,28 @@
+from django.conf import settings
 from django.urls import path
 from .views import receive_instagram_data, check_instagram_status, get_encrypted_instagram_data , save_fetched_followers , save_fetched_following , get_followed_but_not_followed_back , get_dont_follow_back_you , verify_token , save_instagram_user_profile , get_instagram_user_profile
 from .views import get_unfollowed_status , check_instagram_counts , get_first_time_flag , update_first_time_flag , check_12_hours_passed , change_unfollow_status , remove_following , update_last_time_fetched , remove_follower , get_who_removed_you , get_unfollowed_you
-from .views import remove_unfollowed_you , remove_removed_you , instagram_stats_difference
+from .views import remove_unfollowed_you , remove_removed_you , instagram_stats_difference , home
+from .views import begin_list_upload , get_list_upload , append_list_upload_page , commit_list_upload , apply_list_actions
+
+if settings.ASYNC_VIEWS:
+    # Under the ASGI server the hot reads are served by their async versions
+    from .async_views import (
+        check_instagram_status, get_instagram_user_profile, get_unfollowed_status, check_12_hours_passed,
+        instagram_stats_difference, get_followed_but_not_followed_back, get_dont_follow_back_you,
+        get_unfollowed_you, get_who_removed_you,
+    )
+
 urlpatterns = [
     path('data/', receive_instagram_data, name='receive_instagram_data'),
     path('check_instagram_status/', check_instagram_status, name='check_instagram_status'),
     path('instagram-data/', get_encrypted_instagram_data, name='get_encrypted_instagram_data'),
     path('save-fetched-followers/', save_fetched_followers, name='save_fetched_followers'),
     path('save-fetched-following/', save_fetched_following, name='save_fetched_following'),
+    path('upload/begin/', begin_list_upload, name='begin_list_upload'),
+    path('upload/<uuid:upload_id>/', get_list_upload, name='get_list_upload'),
+    path('upload/<uuid:upload_id>/page/', append_list_upload_page, name='append_list_upload_page'),
+    path('upload/<uuid:upload_id>/commit/', commit_list_upload, name='commit_list_upload'),
     path('get-followed-but-not-followed-back/', get_followed_but_not_followed_back , name ="get_followed_but_not_followed_back" ),
     path('get-dont-follow-back-you/', get_dont_follow_back_you , name ="get_dont_follow_back_you" ),
     path('token/verify/', verify_token, name='token-verify'),
@@ -21,10 +36,12 @@ urlpatterns = [
     path('check-12-hours-passed/' , check_12_hours_passed , name='check_12_hours_passed'),
     path('remove-following/' , remove_following , name='remove_following'),
     path('remove-follower/' , remove_follower , name='remove_follower'),
+    path('apply-actions/' , apply_list_actions , name='apply_list_actions'),
     path('update-last-time-fetched/' , update_last_time_fetched , name='update_last_time_fetched'),
     path('get-unfollowed-you/' , get_unfollowed_you , name='get_unfollowed_you'),
     path('get-who-removed-you/' , get_who_removed_you , name='get_who_removed_you'),
     path('remove-unfollowed-you/' , remove_unfollowed_you , name='remove_unfollowed_you'),
     path('remove-removed-you/' , remove_removed_you , name='remove_removed_you'),
     path('instagram-stats-difference/' , instagram_stats_difference , name='instagram_stats_difference'),
+    path('home/' , home , name='home'),
 ]
@@ -1,16 +1,31 @@
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from authentication.authentication import CachedJWTAuthentication
 from django.contrib.auth.models import User
-from .models import InstagramUser_data, FrontFlags
+from .models import InstagramUser_data, InstagramUserDataQuerySet, FrontFlags, FollowEdge, UploadSession
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from decimal import Decimal
+import hashlib
 import json
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from .serializers import InstagramUserDataSerializer
+from .cache import CachedProfileList, invalidate_account, serialize_profiles
+from .conditional import conditional_on_data_version
+from .diff import LARGE_LIST_SIZE, save_fetched_list
+from .actions import MAX_ACTIONS, apply_actions, decrease_counts
+from .uploads import DIRECTIONS, UploadError, begin_upload, stage_page, commit_upload, received_pages
+from payment.models import UserCredit
+from subscription.models import Subscription
+from .edges import RELATIONSHIP_LISTS, parse_ig_id, remove_edge, remove_edges, forget_removed_edges, ordered_for_display
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def verify_token(request):
     return Response({"message": "Token is valid"}, status=200)
@@ -19,7 +34,7 @@ def verify_token(request):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])  # Use JWT for authentication
+@authentication_classes([CachedJWTAuthentication])  # Use JWT for authentication
 @permission_classes([IsAuthenticated])  # Ensure the user is authenticated
 def receive_instagram_data(request):
     try:
@@ -71,8 +86,18 @@ def receive_instagram_data(request):
 
 
 
+def connection_status(instagram_data):
+    """The body of check_instagram_status for the account (None if there is none)."""
+    if not instagram_data:
+        return {"connected": False, "message": "Instagram account is not connected."}
+    # Every Instagram credential must be filled
+    if all([instagram_data.user1_id, instagram_data.session_id, instagram_data.csrftoken, instagram_data.x_ig_app_id]):
+        return {"connected": True, "message": "Instagram account is connected."}
+    return {"connected": False, "message": "Instagram account is connected but missing some required data."}
+
+
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def check_instagram_status(request):
     try:
@@ -80,19 +105,9 @@ def check_instagram_status(request):
         user = request.user
         
         # Check if Instagram data exists for the authenticated user
-        instagram_data = InstagramUser_data.objects.filter(user=user).first()
-
-        if instagram_data:
-            # Check if the required fields are present and not empty
-            if all([instagram_data.user1_id, instagram_data.session_id, instagram_data.csrftoken, instagram_data.x_ig_app_id]):
-                # If all fields are filled, return a success response
-                return Response({"connected": True, "message": "Instagram account is connected."}, status=200)
-            else:
-                # If one of the fields is empty, return false with a message
-                return Response({"connected": False, "message": "Instagram account is connected but missing some required data."}, status=200)
-        else:
-            # Return a response indicating Instagram is not connected
-            return Response({"connected": False, "message": "Instagram account is not connected."}, status=200)
+        instagram_data = InstagramUser_data.objects.projection('status').filter(user=user).first()
+
+        return Response(connection_status(instagram_data), status=200)
     
     except Exception as e:
         # If there's an error, return a 500 internal server error response
@@ -105,13 +120,13 @@ from .crypto_utils import encrypt_data
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_encrypted_instagram_data(request):
     """Sends encrypted Instagram session data to the frontend."""
     try:
         user = request.user
-        instagram_data = InstagramUser_data.objects.filter(user=user).first()
+        instagram_data = InstagramUser_data.objects.projection('status').filter(user=user).first()
 
         if not instagram_data:
             return Response({"error": "Instagram data not found for this user."}, status=status.HTTP_404_NOT_FOUND)
@@ -133,67 +148,8 @@ def get_encrypted_instagram_data(request):
     
 
 
-def update_follow_relationships(instagram_data):
-    """Update mutual follow relationships with full user info."""
-    
-    # Convert followers and following lists to sets of user dictionaries
-    following_dict = {user["id"]: user for user in instagram_data.new_following_list}
-    followers_dict = {user["id"]: user for user in instagram_data.new_followers_list}
-
-    # Find who the user follows but they don't follow back (store full user info)
-    instagram_data.who_i_follow_he_dont_followback = [
-        following_dict[id] for id in following_dict.keys() if id not in followers_dict
-    ]
-
-    # Find who follows the user but the user doesn't follow back (store full user info)
-    instagram_data.who_i_dont_follow_he_followback = [
-        followers_dict[id] for id in followers_dict.keys() if id not in following_dict
-    ]
-
-    instagram_data.save()
-
-
-
-def update_removed_follow(instagram_data, old_list, new_list, field_name):
-    """Update the list of removed followers or following with full user info."""
-    
-    if not isinstance(old_list, list):
-        old_list = []
-    if not isinstance(new_list, list):
-        new_list = []
-
-    # Ensure old_list and new_list contain dictionaries
-    old_dict = {user["id"]: user for user in old_list if isinstance(user, dict) and "id" in user}
-    new_dict = {user["id"]: user for user in new_list if isinstance(user, dict) and "id" in user}
-
-    # Find removed users (store full user info)
-    removed_users = [old_dict[id] for id in old_dict.keys() if id not in new_dict]
-
-    # Retrieve the existing removed list from the model
-    existing_removed = getattr(instagram_data, field_name, [])
-
-    # Ensure existing_removed is a list of dictionaries
-    if not isinstance(existing_removed, list):
-        existing_removed = []
-
-    existing_removed_dict = {user["id"]: user for user in existing_removed if isinstance(user, dict) and "id" in user}
-
-    # Merge existing and new removed users while ensuring uniqueness
-    updated_removed_dict = {**existing_removed_dict, **{user["id"]: user for user in removed_users}}
-
-    # Assign the updated list back to the correct field
-    setattr(instagram_data, field_name, list(updated_removed_dict.values()))
-
-    instagram_data.save()
-
-
-
-
-
-
-
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def save_fetched_followers(request):
     """Receives the following list from Flutter and updates the database."""
@@ -205,21 +161,19 @@ def save_fetched_followers(request):
             
             return Response({"error": "Invalid data format. Expecting a list."}, status=status.HTTP_400_BAD_REQUEST)
 
-        instagram_data = InstagramUser_data.objects.filter(user=user).first()
+        instagram_data = InstagramUser_data.objects.light().filter(user=user).first()
         
         if not instagram_data:
             return Response({"error": "Instagram data not found for this user."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Backup the old following list before updating
-        instagram_data.old_followers_list = instagram_data.new_followers_list
-        instagram_data.new_followers_list = followers_list  # Saving the complete list
-
-        instagram_data.update_last_fetched_time()
-        # Directly save the following list as JSON in the database
-        instagram_data.save()
-        update_follow_relationships(instagram_data)
-        update_removed_follow(instagram_data, instagram_data.old_followers_list, instagram_data.new_followers_list, "who_removed_follower")
-        return Response({"message": "Followers list updated successfully."}, status=status.HTTP_200_OK)
+        # Only the followers that were added or removed since the last fetch are written
+        diff, timings, sizes = save_fetched_list(instagram_data, FollowEdge.FOLLOWER, followers_list)
+        return Response({
+            "message": "Followers list updated successfully.",
+            "diff": diff.as_dict(),
+            "timings": timings,
+            "ingestion": sizes,
+        }, status=status.HTTP_200_OK)
 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -227,7 +181,7 @@ def save_fetched_followers(request):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def save_fetched_following(request):
     """Receives the following list from Flutter and updates the database."""
@@ -239,24 +193,20 @@ def save_fetched_following(request):
             
             return Response({"error": "Invalid data format. Expecting a list."}, status=status.HTTP_400_BAD_REQUEST)
 
-        instagram_data = InstagramUser_data.objects.filter(user=user).first()
+        instagram_data = InstagramUser_data.objects.light().filter(user=user).first()
         
         if not instagram_data:
             return Response({"error": "Instagram data not found for this user."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Backup the old following list before updating
-        instagram_data.old_following_list = instagram_data.new_following_list
-        instagram_data.new_following_list = following_list  # Saving the complete list
-
-        instagram_data.update_last_fetched_time()
-        # Directly save the following list as JSON in the database
-        instagram_data.save()
-
-        # Optionally, update follow relationships if needed
-        update_follow_relationships(instagram_data)
-        update_removed_follow(instagram_data, instagram_data.old_following_list, instagram_data.new_following_list, "who_removed_following")
+        # Only the accounts that were added or removed since the last fetch are written
+        diff, timings, sizes = save_fetched_list(instagram_data, FollowEdge.FOLLOWING, following_list)
 
-        return Response({"message": "Following list updated successfully."}, status=status.HTTP_200_OK)
+        return Response({
+            "message": "Following list updated successfully.",
+            "diff": diff.as_dict(),
+            "timings": timings,
+            "ingestion": sizes,
+        }, status=status.HTTP_200_OK)
 
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -266,10 +216,98 @@ def save_fetched_following(request):
 
 
 
+# Chunked upload: begin a session, send the pages as they arrive, then commit
 
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def begin_list_upload(request):
+    """Opens an upload session for the followers or following list."""
+    direction = DIRECTIONS.get(request.data.get("list"))
+    if not direction:
+        return Response({"error": "'list' must be 'followers' or 'following'."}, status=status.HTTP_400_BAD_REQUEST)
+
+    instagram_data = InstagramUser_data.objects.light().filter(user=request.user).first()
+    if not instagram_data:
+        return Response({"error": "Instagram data not found for this user."}, status=status.HTTP_404_NOT_FOUND)
 
+    session = begin_upload(instagram_data, direction)
+    return Response({"upload_id": str(session.id), "list": request.data.get("list")}, status=status.HTTP_201_CREATED)
 
-from rest_framework.pagination import PageNumberPagination
+
+def get_upload_session(request, upload_id):
+    return UploadSession.objects.select_related('account').filter(pk=upload_id, account__user=request.user).first()
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_list_upload(request, upload_id):
+    """Returns the pages received so far, so an interrupted upload can resume."""
+    session = get_upload_session(request, upload_id)
+    if not session:
+        return Response({"error": "Upload session not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        "upload_id": str(session.id),
+        "status": session.status,
+        "received_pages": received_pages(session),
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def append_list_upload_page(request, upload_id):
+    """Stages one page (the 'users' of one Instagram response) of an upload."""
+    page = request.data.get("page")  # page numbers start at 0
+    users = request.data.get("users")
+
+    if not isinstance(page, int) or page < 0 or not isinstance(users, list):
+        return Response({"error": "Invalid data format. Expecting 'page' and a 'users' list."}, status=status.HTTP_400_BAD_REQUEST)
+
+    session = get_upload_session(request, upload_id)
+    if not session:
+        return Response({"error": "Upload session not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        sizes = stage_page(session, page, users)
+    except UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+    return Response({"page": page, "users": sizes['users'], "ingestion": sizes}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def commit_list_upload(request, upload_id):
+    """Replaces the stored list with the uploaded pages."""
+    session = get_upload_session(request, upload_id)
+    if not session:
+        return Response({"error": "Upload session not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    expected_pages = request.data.get("pages")
+    if expected_pages is not None and not isinstance(expected_pages, int):
+        return Response({"error": "'pages' must be the number of pages sent."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        diff, timings = commit_upload(session, expected_pages)
+    except UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+    return Response({
+        "message": "List updated successfully.",
+        "diff": diff.as_dict(),
+        "timings": timings,
+    }, status=status.HTTP_200_OK)
+
+
+
+
+
+
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 
 #traja3 alli eni nfollowi fehom w houma le
@@ -279,25 +317,77 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 50  # Maximum number of users per request
 
+
+class RelationshipCursorPagination(CursorPagination):
+    """Opaque cursor over a relationship list, keyed on the edge ordinal.
+
+    Each page is one indexed range query however deep it is, and removing
+    users between two calls doesn't shift the next page.
+    """
+    ordering = '-ordinal'
+    page_size = 15
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+def wants_cursor(request):
+    return 'cursor' in request.query_params or request.query_params.get('pagination') == 'cursor'
+
+
+def paginated_profiles(request, list_name, include_total=False):
+    """Return one page of a relationship list of the user.
+
+    Page numbers are served from the Redis cache; with ?pagination=cursor
+    (or a cursor from a previous page) the page is read by cursor instead.
+    """
+    account_id = InstagramUser_data.objects.values_list('pk', flat=True).get(user=request.user)
+    return relationship_page(request, account_id, list_name, include_total)
+
+
+def relationship_page(request, account_id, list_name, include_total=False):
+    """The paginated response of paginated_profiles, once the account is known."""
+    profiles = CachedProfileList(account_id, list_name)
+
+    if wants_cursor(request):
+        paginator = RelationshipCursorPagination()
+        edges = ordered_for_display(RELATIONSHIP_LISTS[list_name](account_id))
+        page = paginator.paginate_queryset(edges, request)
+        response = paginator.get_paginated_response(serialize_profiles(page))
+        if include_total:
+            response.data['total_count'] = profiles.count()
+        return response
+
+    paginator = CustomPagination()
+    page = paginator.paginate_queryset(profiles, request)
+
+    response = paginator.get_paginated_response(page)
+    if include_total:
+        response.data['total_count'] = paginator.page.paginator.count
+    return response
+
+def requested_ig_ids(ids):
+    """Parse the "ids" of a batch removal, or return None if it isn't a list."""
+    if not isinstance(ids, list):
+        return None
+    return list(dict.fromkeys(ig_id for ig_id in map(parse_ig_id, ids) if ig_id))
+
+
+def batch_removal_result(ig_ids, removed):
+    removed = set(removed)
+    return {
+        "removed": [str(ig_id) for ig_id in ig_ids if ig_id in removed],
+        "not_found": [str(ig_id) for ig_id in ig_ids if ig_id not in removed],
+    }
+
+
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@conditional_on_data_version
 def get_followed_but_not_followed_back(request):
     try:
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
-
-        # Directly retrieve the full user data from who_i_follow_he_dont_followback
-        unfollowed_back_users = instagram_user_data.who_i_follow_he_dont_followback
-
-        # Ensure it is a list of dictionaries
-        if not isinstance(unfollowed_back_users, list):
-            unfollowed_back_users = []
-
         # Paginate the results
-        paginator = CustomPagination()
-        paginated_data = paginator.paginate_queryset(unfollowed_back_users, request)
-
-        return paginator.get_paginated_response(paginated_data)
+        return paginated_profiles(request, 'who_i_follow_he_dont_followback')
 
     except InstagramUser_data.DoesNotExist:
         return Response({"error": "Instagram user data not found"}, status=404)
@@ -306,37 +396,41 @@ def get_followed_but_not_followed_back(request):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def remove_following(request):
     try:
         # Fetch InstagramUser_data for the authenticated user
-        user_data = InstagramUser_data.objects.get(user=request.user)
+        user_data = InstagramUser_data.objects.only('pk').get(user=request.user)
+
+        # Mass unfollow: many ids under "ids", removed in one call
+        if 'ids' in request.data:
+            ig_ids = requested_ig_ids(request.data.get('ids'))
+            if ig_ids is None:
+                return Response({"error": "'ids' must be a list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+            counters = {}
+            # The edges and the counts change together, or not at all
+            with transaction.atomic():
+                removed = remove_edges(user_data, FollowEdge.FOLLOWING, ig_ids, counters)
+                decrease_counts(user_data, {'instagram_following_count': len(removed)}, counters)
+            if removed:
+                invalidate_account(user_data.pk)
+            return Response(batch_removal_result(ig_ids, removed), status=status.HTTP_200_OK)
 
         # Extract id from request body
-        id = request.data.get("id")
+        id = request.data.get("id") or request.data.get("user_id")
         if not id:
             return Response({"error": "Missing 'id' in request body"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Ensure id is in the following list and get the user data from following list
-        user_in_following = next((user for user in user_data.new_following_list if user["id"] == id), None)
-        if not user_in_following:
-            return Response({"error": "User not found in following list"}, status=status.HTTP_400_BAD_REQUEST)
+        # Remove the user from the following list (who_i_follow_he_dont_followback follows from it)
+        counters = {}
+        with transaction.atomic():
+            if not remove_edge(user_data, FollowEdge.FOLLOWING, parse_ig_id(id), counters):
+                return Response({"error": "User not found in following list"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Remove the user from the new following list
-        user_data.new_following_list = [f for f in user_data.new_following_list if f["id"] != id]
-
-        # Decrease the count if it's greater than zero
-        if user_data.instagram_following_count > 0:
-            user_data.instagram_following_count -= 1
-
-        # Remove the user from who_i_follow_he_dont_followback list (no extra logic)
-        user_data.who_i_follow_he_dont_followback = [
-            user for user in user_data.who_i_follow_he_dont_followback if user["id"] != id
-        ]
-
-        # Save changes
-        user_data.save()
+            # Decrease the count if it's greater than zero
+            decrease_counts(user_data, {'instagram_following_count': 1}, counters)
+        invalidate_account(user_data.pk)
 
         return Response({"message": "User removed from following list and 'who_i_follow_he_dont_followback' updated successfully"}, status=status.HTTP_200_OK)
     
@@ -353,60 +447,54 @@ def remove_following(request):
 #traja3 el yfollow fiya weni le
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@conditional_on_data_version
 def get_dont_follow_back_you(request):
     try:
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
-
-        # Directly retrieve the full user data from who_i_dont_follow_he_followback
-        dont_follow_back_users = instagram_user_data.who_i_dont_follow_he_followback
-
-        # Ensure it is a list of dictionaries
-        if not isinstance(dont_follow_back_users, list):
-            dont_follow_back_users = []
-
         # Set up pagination
-        paginator = CustomPagination()
-        paginated_data = paginator.paginate_queryset(dont_follow_back_users, request)
-
-        return paginator.get_paginated_response(paginated_data)
+        return paginated_profiles(request, 'who_i_dont_follow_he_followback')
 
     except InstagramUser_data.DoesNotExist:
         return Response({"error": "Instagram user data not found"}, status=404)
 
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def remove_follower(request):
     try:
         # Fetch InstagramUser_data for the authenticated user
-        user_data = InstagramUser_data.objects.get(user=request.user)
+        user_data = InstagramUser_data.objects.only('pk').get(user=request.user)
+
+        # Mass removal: many ids under "ids", removed in one call
+        if 'ids' in request.data:
+            ig_ids = requested_ig_ids(request.data.get('ids'))
+            if ig_ids is None:
+                return Response({"error": "'ids' must be a list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+            counters = {}
+            # The edges and the counts change together, or not at all
+            with transaction.atomic():
+                removed = remove_edges(user_data, FollowEdge.FOLLOWER, ig_ids, counters)
+                decrease_counts(user_data, {'instagram_follower_count': len(removed)}, counters)
+            if removed:
+                invalidate_account(user_data.pk)
+            return Response(batch_removal_result(ig_ids, removed), status=status.HTTP_200_OK)
 
         # Extract id from request body
-        id = request.data.get("id")
+        id = request.data.get("id") or request.data.get("user_id")
         if not id:
             return Response({"error": "Missing 'id' in request body"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Ensure id is in the follower list
-        user_in_followers = next((user for user in user_data.new_followers_list if user["id"] == id), None)
-        if not user_in_followers:
-            return Response({"error": "User not found in follower list"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Remove the user from the new follower list
-        user_data.new_followers_list = [f for f in user_data.new_followers_list if f["id"] != id]
-
-        # Decrease the follower count if it's greater than zero
-        if user_data.instagram_follower_count > 0:
-            user_data.instagram_follower_count -= 1
+        # Remove the user from the follower list (who_i_dont_follow_he_followback follows from it)
+        counters = {}
+        with transaction.atomic():
+            if not remove_edge(user_data, FollowEdge.FOLLOWER, parse_ig_id(id), counters):
+                return Response({"error": "User not found in follower list"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update who I follow but they don't follow back with full user data (not just id)
-        follower_ids = {user["id"] for user in user_data.new_followers_list}
-        user_data.who_i_dont_follow_he_followback = [user for user in user_data.who_i_dont_follow_he_followback if user["id"] in follower_ids]
-
-        # Save changes
-        user_data.save()
+            # Decrease the follower count if it's greater than zero
+            decrease_counts(user_data, {'instagram_follower_count': 1}, counters)
+        invalidate_account(user_data.pk)
 
         return Response({"message": "User removed from follower list successfully"}, status=status.HTTP_200_OK)
 
@@ -416,32 +504,36 @@ def remove_follower(request):
 
 
 
-#bech traja3 chkoun ne7eli follow
-@api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
-def get_unfollowed_you(request):
+def apply_list_actions(request):
+    """Apply many unfollow/remove/dismiss actions at once, all or nothing."""
+    actions = request.data.get('actions')
+    if not isinstance(actions, list) or not actions:
+        return Response({"error": "'actions' must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(actions) > MAX_ACTIONS:
+        return Response({"error": f"At most {MAX_ACTIONS} actions per request"}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+        user_data = InstagramUser_data.objects.only('pk').get(user=request.user)
+    except InstagramUser_data.DoesNotExist:
+        return Response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Retrieve the full user data from who_removed_follower
-        unfollowed_back_users = instagram_user_data.who_removed_follower
+    return Response({"results": apply_actions(user_data, actions)}, status=status.HTTP_200_OK)
 
-        # Ensure it is a list of dictionaries
-        if not isinstance(unfollowed_back_users, list):
-            unfollowed_back_users = []
 
-        total_count = len(unfollowed_back_users)
 
-        # Set up pagination
-        paginator = CustomPagination()
-        paginated_data = paginator.paginate_queryset(unfollowed_back_users, request)
 
+#bech traja3 chkoun ne7eli follow
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@conditional_on_data_version
+def get_unfollowed_you(request):
+    try:
         # Get the default paginated response and add total count
-        response = paginator.get_paginated_response(paginated_data)
-        response.data['total_count'] = total_count
-
-        return response
+        return paginated_profiles(request, 'who_removed_follower', include_total=True)
 
     except InstagramUser_data.DoesNotExist:
         return Response({"error": "Instagram user data not found"}, status=404)
@@ -451,31 +543,41 @@ def get_unfollowed_you(request):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def remove_unfollowed_you(request):
     user = request.user
+    try:
+        instagram_user_data = InstagramUser_data.objects.only('pk').get(user=user)
+    except InstagramUser_data.DoesNotExist:
+        return Response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # Clearing many users at once: ids under "ids"
+    if 'ids' in request.data:
+        ig_ids = requested_ig_ids(request.data.get('ids'))
+        if ig_ids is None:
+            return Response({"error": "'ids' must be a list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+        # The chunked deletes and the counter update commit together
+        with transaction.atomic():
+            removed = forget_removed_edges(instagram_user_data, FollowEdge.FOLLOWER, ig_ids)
+        if removed:
+            invalidate_account(instagram_user_data.pk)
+        return Response(batch_removal_result(ig_ids, removed), status=status.HTTP_200_OK)
+
     user_id_to_remove = request.data.get('user_id')  # Get user_id from request body
 
     if not user_id_to_remove:
         return Response({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        instagram_user_data = InstagramUser_data.objects.get(user=user)
-
-        # Find the user in who_removed_follower by id
-        user_to_remove = next((user for user in instagram_user_data.who_removed_follower if user["id"] == user_id_to_remove), None)
-
-        if user_to_remove:
-            instagram_user_data.who_removed_follower.remove(user_to_remove)  # Remove the full user data
-            instagram_user_data.save()  # Save changes
-
-            return Response({"message": "User removed successfully"}, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "User_id not found in who_removed_follower"}, status=status.HTTP_404_NOT_FOUND)
+    # Remove the user from who_removed_follower by id
+    with transaction.atomic():
+        forgotten = forget_removed_edges(instagram_user_data, FollowEdge.FOLLOWER, [parse_ig_id(user_id_to_remove)])
+    if forgotten:
+        invalidate_account(instagram_user_data.pk)
+        return Response({"message": "User removed successfully"}, status=status.HTTP_200_OK)
+    else:
+        return Response({"error": "User_id not found in who_removed_follower"}, status=status.HTTP_404_NOT_FOUND)
 
-    except InstagramUser_data.DoesNotExist:
-        return Response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
 
     
 
@@ -485,29 +587,13 @@ def remove_unfollowed_you(request):
 
 #bech traja3 chkoun ne7eni ma3edech ntaba3 fih
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@conditional_on_data_version
 def get_who_removed_you(request):
     try:
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
-
-        # Get the list of users who removed you
-        unfollowed_back_users = instagram_user_data.who_removed_following
-
-        if not isinstance(unfollowed_back_users, list):
-            unfollowed_back_users = []
-
-        total_count = len(unfollowed_back_users)
-
-        # Paginate the list
-        paginator = CustomPagination()
-        paginated_data = paginator.paginate_queryset(unfollowed_back_users, request)
-
-        # Get the default paginated response and add total count
-        response = paginator.get_paginated_response(paginated_data)
-        response.data['total_count'] = total_count  # Add total user count here
-
-        return response
+        # Paginate the list and add the total user count
+        return paginated_profiles(request, 'who_removed_following', include_total=True)
 
     except InstagramUser_data.DoesNotExist:
         return Response({"error": "Instagram user data not found"}, status=404)
@@ -516,31 +602,41 @@ def get_who_removed_you(request):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def remove_removed_you(request):
     user = request.user
+    try:
+        instagram_user_data = InstagramUser_data.objects.only('pk').get(user=user)
+    except InstagramUser_data.DoesNotExist:
+        return Response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # Clearing many users at once: ids under "ids"
+    if 'ids' in request.data:
+        ig_ids = requested_ig_ids(request.data.get('ids'))
+        if ig_ids is None:
+            return Response({"error": "'ids' must be a list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+        # The chunked deletes and the counter update commit together
+        with transaction.atomic():
+            removed = forget_removed_edges(instagram_user_data, FollowEdge.FOLLOWING, ig_ids)
+        if removed:
+            invalidate_account(instagram_user_data.pk)
+        return Response(batch_removal_result(ig_ids, removed), status=status.HTTP_200_OK)
+
     user_id_to_remove = request.data.get('user_id')  # Get user_id from request body
 
     if not user_id_to_remove:
         return Response({"error": "user_id is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        instagram_user_data = InstagramUser_data.objects.get(user=user)
+    # Remove the user from who_removed_following by id
+    with transaction.atomic():
+        forgotten = forget_removed_edges(instagram_user_data, FollowEdge.FOLLOWING, [parse_ig_id(user_id_to_remove)])
+    if forgotten:
+        invalidate_account(instagram_user_data.pk)
+        return Response({"message": "User removed successfully"}, status=status.HTTP_200_OK)
+    else:
+        return Response({"error": "User_id not found in who_removed_following"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Find the user in who_removed_following by id
-        user_to_remove = next((user for user in instagram_user_data.who_removed_following if user["id"] == user_id_to_remove), None)
-
-        if user_to_remove:
-            instagram_user_data.who_removed_following.remove(user_to_remove)  # Remove the full user data
-            instagram_user_data.save()  # Save changes
-
-            return Response({"message": "User removed successfully"}, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "User_id not found in who_removed_following"}, status=status.HTTP_404_NOT_FOUND)
-
-    except InstagramUser_data.DoesNotExist:
-        return Response({"error": "Instagram user data not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
 
@@ -550,7 +646,7 @@ def remove_removed_you(request):
 
 #hedhi bech tokhou el user data mel front end 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def save_instagram_user_profile(request):
     try:
@@ -571,7 +667,7 @@ def save_instagram_user_profile(request):
 
         # Get or create the InstagramUser_data object
         try:
-            instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+            instagram_user_data = InstagramUser_data.objects.projection('profile').get(user=request.user)
             created = False
             previous_follower_count = instagram_user_data.instagram_follower_count  # Get the previous count
             instagram_user_data.old_instagram_follower_count = previous_follower_count
@@ -601,6 +697,11 @@ def save_instagram_user_profile(request):
         instagram_user_data.instagram_biography = instagram_biography
         instagram_user_data.instagram_profile_picture_url = instagram_profile_picture_url
 
+        # The profile and stats changed: their ETags must change too
+        if not created:
+            instagram_user_data.data_version = F('data_version') + 1
+        instagram_user_data.data_modified = now()
+
         instagram_user_data.save()
 
         serializer = InstagramUserDataSerializer(instagram_user_data)
@@ -626,12 +727,13 @@ def save_instagram_user_profile(request):
 #hedhi bech nabathou el user profile data lel front 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
+@conditional_on_data_version
 def get_instagram_user_profile(request):
     try:
         # Try to get the InstagramUser_data object related to the authenticated user
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+        instagram_user_data = InstagramUser_data.objects.projection('profile').get(user=request.user)
 
         # Serialize the InstagramUser_data
         serializer = InstagramUserDataSerializer(instagram_user_data)
@@ -668,12 +770,12 @@ def get_instagram_user_profile(request):
 #traj3elna unfollow status check fi home page
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_unfollowed_status(request):
     try:
         # Fetch the InstagramUser_data object for the authenticated user
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+        instagram_user_data = InstagramUser_data.objects.projection('unfollowed').get(user=request.user)
         return Response({
             "unfollowed": instagram_user_data.unfollowed
         }, status=status.HTTP_200_OK)
@@ -692,7 +794,7 @@ def get_unfollowed_status(request):
     
     
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def change_unfollow_status(request):
     try:
@@ -701,9 +803,9 @@ def change_unfollow_status(request):
         
 
         if unfollow_status is not None:
-            instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+            instagram_user_data = InstagramUser_data.objects.projection('unfollowed').get(user=request.user)
             instagram_user_data.unfollowed = unfollow_status
-            instagram_user_data.save()
+            instagram_user_data.save(update_fields=['unfollowed'])
 
             # Returning a success response
             return Response({
@@ -731,21 +833,22 @@ def change_unfollow_status(request):
 
 
 #bech tchouf el followers w folloing a9al mel 20k
-
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def check_instagram_counts(request):
     try:
         # Fetch the InstagramUser_data object for the authenticated user
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+        instagram_user_data = InstagramUser_data.objects.projection('counts').get(user=request.user)
 
         # Calculate the total of followers and following
-        total_count = instagram_user_data.instagram_follower_count + instagram_user_data.instagram_following_count
+        total_count = (instagram_user_data.instagram_follower_count or 0) + (instagram_user_data.instagram_following_count or 0)
 
-        # Check if the total count is <= 20,000
+        # Every size is supported; large accounts are diffed in large-account mode
+        # and should send their lists through the chunked upload
         return Response({
-            "status": total_count <= 20000  # Returns True if total <= 20,000, else False
+            "status": True,
+            "large_account": total_count >= LARGE_LIST_SIZE,
         }, status=status.HTTP_200_OK)
 
     except InstagramUser_data.DoesNotExist:
@@ -767,7 +870,7 @@ def check_instagram_counts(request):
 
 #bech traj3elna yekhi awl marra wala le
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_first_time_flag(request):
     try:
@@ -797,7 +900,7 @@ def get_first_time_flag(request):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def update_first_time_flag(request):
     try:
@@ -837,12 +940,12 @@ def update_first_time_flag(request):
 
 # return if 12 hours passed from last fech true or false
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def check_12_hours_passed(request):
     try:
         # Fetch the InstagramUser_data object for the authenticated user
-        user_data = InstagramUser_data.objects.filter(user=request.user).first()
+        user_data = InstagramUser_data.objects.projection('last_fetch').filter(user=request.user).first()
 
         if not user_data:
             return Response({
@@ -865,19 +968,19 @@ from datetime import timedelta
 from django.utils.timezone import now
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def update_last_time_fetched(request):
     try:
         # Get the InstagramUser_data instance for the logged-in user
-        instagram_user_data = InstagramUser_data.objects.get(user=request.user)
+        instagram_user_data = InstagramUser_data.objects.projection('last_fetch').get(user=request.user)
         
         # Calculate the time 24 hours ago from now
         new_time = now() - timedelta(hours=0.5)
         
         # Update the 'last_time_fetched' field
         instagram_user_data.last_time_fetched = new_time
-        instagram_user_data.save()
+        instagram_user_data.save(update_fields=['last_time_fetched'])
 
         # Return a success response
         return Response({
@@ -902,75 +1005,113 @@ def update_last_time_fetched(request):
 
 
 
-@api_view(['GET'])
-@authentication_classes([JWTAuthentication])
-@permission_classes([IsAuthenticated])
-def instagram_stats_difference(request):
-    try:
-        instagram_user_data = InstagramUser_data.objects.filter(user=request.user).last()
-
-        if not instagram_user_data:
-            return Response({'error': 'Instagram data not found for this user.'}, status=404)
-
-        # Follower/following difference
-        follower_diff = None
-        following_diff = None
+def stats_difference(stats):
+    """The body of instagram_stats_difference, from the 'stats' projection values."""
+    # Follower/following difference
+    follower_diff = None
+    following_diff = None
 
-        if instagram_user_data.instagram_follower_count is not None and instagram_user_data.old_instagram_follower_count is not None:
-            follower_diff = instagram_user_data.instagram_follower_count - instagram_user_data.old_instagram_follower_count
+    if stats['instagram_follower_count'] is not None and stats['old_instagram_follower_count'] is not None:
+        follower_diff = stats['instagram_follower_count'] - stats['old_instagram_follower_count']
 
-        if instagram_user_data.instagram_following_count is not None and instagram_user_data.old_instagram_following_count is not None:
-            following_diff = instagram_user_data.instagram_following_count - instagram_user_data.old_instagram_following_count
+    if stats['instagram_following_count'] is not None and stats['old_instagram_following_count'] is not None:
+        following_diff = stats['instagram_following_count'] - stats['old_instagram_following_count']
 
-        # Who unfollowed you
-        who_unfollowed_you = instagram_user_data.who_removed_follower
-        if not isinstance(who_unfollowed_you, list):
-            who_unfollowed_you = []
-        unfollowed_you_count = len(who_unfollowed_you)
+    return {
+        'follower_difference': follower_diff,
+        'following_difference': following_diff,
+        'unfollowed_you_count': stats['unfollowed_you_count'],
+        'removed_following_count': stats['removed_following_count'],
+        'dont_follow_back_count': stats['dont_follow_back_count'],
+        'you_dont_follow_back_count': stats['you_dont_follow_back_count'],
+    }
 
-        # Who you unfollowed
-        removed_following = instagram_user_data.who_removed_following
-        if not isinstance(removed_following , list):
-            removed_following = []
-        removed_following_count = len(removed_following )
 
-        # Who doesn’t follow you back
-        dont_follow_back_users = instagram_user_data.who_i_dont_follow_he_followback
-        if not isinstance(dont_follow_back_users, list):
-            dont_follow_back_users = []
-        dont_follow_back_count = len(dont_follow_back_users)
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@conditional_on_data_version
+def instagram_stats_difference(request):
+    try:
+        # One narrow read of the account row: the list sizes are counter columns kept by the diff.
+        # The newest row, if receive_instagram_data left the user several
+        stats = InstagramUser_data.objects.filter(user=request.user).projection_values('stats').order_by('-pk').first()
 
-        # Who you don’t follow back
-        you_dont_follow_back = instagram_user_data.who_i_follow_he_dont_followback
-        if not isinstance(you_dont_follow_back, list):
-            you_dont_follow_back = []
-        you_dont_follow_back_count = len(you_dont_follow_back)
+        if not stats:
+            return Response({'error': 'Instagram data not found for this user.'}, status=404)
 
-        return Response({
-            'follower_difference': follower_diff,
-            'following_difference': following_diff,
-            'unfollowed_you_count': unfollowed_you_count,
-            'removed_following_count': removed_following_count,
-            'dont_follow_back_count': you_dont_follow_back_count,
-            'you_dont_follow_back_count': dont_follow_back_count
-        })
+        return Response(stats_difference(stats))
 
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
 
 
+def active_subscription(subscription):
+    """The body of get_active_subscription, from the subscription's values (or None)."""
+    if not subscription:
+        return None
+    return {**subscription, "status": "Active"}
 
 
-
-
-
-
-
-
-
-
-
-
-
-
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def home(request):
+    """Everything the app reads on launch, in one request and at most 3 queries.
+
+    Each key holds the body of the endpoint it replaces: check_instagram_status,
+    get_unfollowed_status, get_first_time_flag, check_12_hours_passed,
+    check_instagram_counts, get_instagram_user_profile, get_active_subscription,
+    get_user_credit and instagram_stats_difference. Sent with an ETag of the
+    body, so an app that already has this state gets a 304.
+    """
+    user = request.user
+    # 1. The account row, with every column these endpoints read
+    account = InstagramUser_data.objects.projection('home').filter(user=user).first()
+    # 2. The flag and the credit balance, as subqueries of the user row
+    extras = User.objects.filter(pk=user.pk).values(
+        first_time=Subquery(FrontFlags.objects.filter(user=OuterRef('pk')).values('is_first_time_connected_flag')[:1]),
+        credit_balance=Subquery(UserCredit.objects.filter(user=OuterRef('pk')).values('balance')[:1]),
+    ).get()
+    # 3. The active subscription
+    subscription = Subscription.objects.filter(user=user, end_date__gt=now()).values('plan', 'start_date', 'end_date').first()
+
+    not_found = {"error": "Instagram user data not found"}
+    body = {
+        "instagram_status": connection_status(account),
+        "unfollowed_status": {"unfollowed": account.unfollowed} if account else not_found,
+        "first_time_flag": (
+            {"is_first_time_connected_flag": extras['first_time']} if extras['first_time'] is not None
+            else {"error": "Front flag data not found"}
+        ),
+        "has_12_hours_passed": (
+            {"has_12_hours_passed": account.has_12_hours_passed_since_last_fetch()} if account
+            else {"error": "No Instagram data found for this user"}
+        ),
+        "instagram_counts": {
+            "status": True,
+            "large_account": (account.instagram_follower_count or 0) + (account.instagram_following_count or 0) >= LARGE_LIST_SIZE,
+        } if account else not_found,
+        "profile": {
+            "success": "User data fetched successfully",
+            "user_data": InstagramUserDataSerializer(account).data,
+        } if account else not_found,
+        "subscription": active_subscription(subscription),
+        "credit": {
+            "user": user.username,
+            # get_user_credit creates a zero balance for users without one. The
+            # balance has 2 decimal places, which a subquery doesn't keep on SQLite
+            "credit_balance": str(Decimal(extras['credit_balance'] or 0).quantize(Decimal('0.01'))),
+        },
+        "stats": (
+            stats_difference({name: getattr(account, name) for name in InstagramUserDataQuerySet.PROJECTIONS['stats']})
+            if account else {'error': 'Instagram data not found for this user.'}
+        ),
+    }
+
+    response = Response(body)
+    response['ETag'] = quote_etag(hashlib.md5(JSONRenderer().render(body)).hexdigest())
+    # The app may keep the body, but must revalidate it on every launch
+    response['Cache-Control'] = 'private, no-cache'
+    return get_conditional_response(request, etag=response['ETag'], response=response)
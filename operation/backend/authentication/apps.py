@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
 
 
 class AuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        # Drop the cached user of a token as soon as the user changes
+        from .authentication import forget_saved_user
+        user_model = get_user_model()
+        post_save.connect(forget_saved_user, sender=user_model, dispatch_uid='forget_saved_user')
+        post_delete.connect(forget_saved_user, sender=user_model, dispatch_uid='forget_saved_user')
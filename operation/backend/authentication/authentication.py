@@ -0,0 +1,200 @@
+"""JWT authentication that caches the user of each token.
+
+JWTAuthentication loads the user of the token's user_id claim with one
+query on every request, and the app sends many small requests per screen.
+CachedJWTAuthentication validates every token as it does (signature, expiry,
+token type, and the blacklist for blacklistable token types), and only
+caches that user lookup:
+
+- in the process, for AUTH_USER_CACHE_LOCAL_TTL seconds;
+- in Redis, shared by the workers, for AUTH_USER_CACHE_TTL seconds.
+
+An entry never outlives the token that stored it. The cached users are
+keyed by id, so every token of a user shares one entry. Saving or deleting
+a user drops its entries (forget_saved_user). A deactivated user, or with
+CHECK_REVOKE_TOKEN a changed password, is refused at its next request in
+this process, and within AUTH_USER_CACHE_LOCAL_TTL in the other workers.
+
+Rotating or blacklisting refresh tokens doesn't end the access tokens
+already issued: they stay valid until they expire, cached or not.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from api.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CACHE_SIZE = 10000  # users kept per process, least recently used first out
+
+# The password hash stays out of the caches: it is loaded from the database
+# if something reads it, and save() leaves it alone
+CACHED_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser', 'last_login', 'date_joined')
+
+_local_users = OrderedDict()  # user id -> (expires at, fields, revoke hash)
+_local_lock = threading.Lock()
+
+
+def user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def cached_fields(user):
+    fields = {name: user._meta.get_field(name).value_from_object(user) for name in CACHED_FIELDS}
+    revoke_hash = get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None
+    return fields, revoke_hash
+
+
+def build_user(fields):
+    """A user from its cached fields, as if loaded with .only(*CACHED_FIELDS)."""
+    user_model = get_user_model()
+    # from_db takes the values in the order of the model's fields
+    loaded = [field for field in user_model._meta.concrete_fields if field.attname in CACHED_FIELDS]
+    return user_model.from_db(
+        DEFAULT_DB_ALIAS, [field.attname for field in loaded], [field.to_python(fields[field.attname]) for field in loaded],
+    )
+
+
+def local_get(user_id):
+    with _local_lock:
+        entry = _local_users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _local_users[user_id]
+            return None
+        _local_users.move_to_end(user_id)
+        return entry[1:]
+
+
+def local_set(user_id, ttl, fields, revoke_hash):
+    with _local_lock:
+        _local_users[user_id] = (time.monotonic() + ttl, fields, revoke_hash)
+        _local_users.move_to_end(user_id)
+        while len(_local_users) > LOCAL_CACHE_SIZE:
+            _local_users.popitem(last=False)
+
+
+def forget_user(user_id):
+    """Drop the cached user, in this process and in Redis.
+
+    The Redis entry is dropped once the transaction commits: until then
+    other requests still read the old row, and could cache it again.
+    """
+    with _local_lock:
+        _local_users.pop(user_id, None)
+
+    if not settings.AUTH_USER_CACHE_TTL:
+        return
+
+    def delete():
+        try:
+            get_redis().delete(user_key(user_id))
+        except redis.RedisError as e:
+            logger.warning("Could not drop the cached user %s: %s", user_id, e)
+
+    transaction.on_commit(delete)
+
+
+def forget_saved_user(sender, instance, **kwargs):
+    # Connected to post_save and post_delete of the user model (see apps.py)
+    forget_user(instance.pk)
+
+
+def clear_local_cache():
+    with _local_lock:
+        _local_users.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication with a per-process and a Redis cache of the token's user."""
+
+    def token_ttl(self, validated_token, ttl):
+        """ttl, cut to the seconds left before the token expires."""
+        expires_at = validated_token.get('exp')
+        if expires_at is None:
+            return ttl
+        return max(0, min(ttl, int(expires_at - time.time())))
+
+    def user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    def check_user(self, validated_token, user, revoke_hash):
+        # The checks of JWTAuthentication.get_user, on a cached user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != revoke_hash:
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return user
+
+    def get_local_user(self, validated_token):
+        """The user of the token from the cache of this process, or None.
+
+        Needs no I/O, so async views can call it without a thread hop.
+        """
+        if not settings.AUTH_USER_CACHE_LOCAL_TTL or api_settings.USER_ID_FIELD != 'id':
+            return None
+        entry = local_get(self.user_id(validated_token))
+        if entry is None:
+            return None
+        fields, revoke_hash = entry
+        return self.check_user(validated_token, build_user(fields), revoke_hash)
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_FIELD != 'id':
+            return super().get_user(validated_token)
+
+        user = self.get_local_user(validated_token)
+        if user is not None:
+            return user
+
+        user_id = self.user_id(validated_token)
+        entry = self.get_shared_entry(user_id)
+        if entry is None:
+            user = super().get_user(validated_token)
+            entry = cached_fields(user)
+            self.set_shared_entry(user_id, validated_token, entry)
+        else:
+            user = self.check_user(validated_token, build_user(entry[0]), entry[1])
+
+        local_ttl = self.token_ttl(validated_token, settings.AUTH_USER_CACHE_LOCAL_TTL)
+        if local_ttl:
+            local_set(user_id, local_ttl, *entry)
+        return user
+
+    def get_shared_entry(self, user_id):
+        if not settings.AUTH_USER_CACHE_TTL:
+            return None
+        try:
+            cached = get_redis().get(user_key(user_id))
+        except redis.RedisError as e:
+            logger.warning("User cache unavailable, reading from the database: %s", e)
+            return None
+        if cached is None:
+            return None
+        entry = json.loads(cached)
+        return entry["fields"], entry["revoke_hash"]
+
+    def set_shared_entry(self, user_id, validated_token, entry):
+        ttl = self.token_ttl(validated_token, settings.AUTH_USER_CACHE_TTL)
+        if not ttl:
+            return
+        fields, revoke_hash = entry
+        try:
+            get_redis().set(user_key(user_id), json.dumps({"fields": fields, "revoke_hash": revoke_hash}, cls=DjangoJSONEncoder), ex=ttl)
+        except redis.RedisError as e:
+            logger.warning("Could not cache user %s: %s", user_id, e)
@@ -0,0 +1,68 @@
+import statistics
+import time
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from api.benchmarks import QueryCounter
+from api.cache import get_redis
+from authentication.authentication import CachedJWTAuthentication, clear_local_cache, user_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the time and queries JWT authentication costs per request, "
+        "with JWTAuthentication and with each cache of CachedJWTAuthentication."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=2000, help="Requests authenticated per case.")
+
+    def handle(self, *args, **options):
+        settings.DEBUG = False
+        repeat = options['repeat']
+        with transaction.atomic():
+            user = User.objects.create_user(username=f"benchmark-auth-{time.monotonic_ns()}")
+            request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+            cached = CachedJWTAuthentication()
+
+            def local_hit():
+                pass
+
+            def shared_hit():
+                clear_local_cache()
+
+            def miss():
+                clear_local_cache()
+                try:
+                    get_redis().delete(user_key(user.pk))
+                except redis.RedisError:
+                    pass
+
+            cases = [
+                ('JWTAuthentication', JWTAuthentication(), None),
+                ('cached, miss', cached, miss),
+                ('cached, Redis hit', cached, shared_hit),
+                ('cached, local hit', cached, local_hit),
+            ]
+            self.stdout.write(f"{'case':<20} {'median us':>10} {'mean us':>9} {'queries':>8}")
+            for name, authentication, prepare in cases:
+                authentication.authenticate(Request(request))  # warm up, and fill the caches
+                timings = []
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries):
+                    for _ in range(repeat):
+                        if prepare:
+                            prepare()
+                        start = time.perf_counter()
+                        authentication.authenticate(Request(request))
+                        timings.append((time.perf_counter() - start) * 1e6)
+                self.stdout.write(
+                    f"{name:<20} {statistics.median(timings):>10.1f} {statistics.fmean(timings):>9.1f} {queries.count / repeat:>8.2f}"
+                )
+            transaction.set_rollback(True)
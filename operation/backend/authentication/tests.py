@@ -1,3 +1,115 @@
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
 from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from . import authentication
+from .authentication import CachedJWTAuthentication, clear_local_cache, user_key
 
-# Create your tests here.
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+        self.ttls[key] = ex
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        clear_local_cache()
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(authentication, "get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(clear_local_cache)
+        self.user = User.objects.create_user(username="cached", password="secret", email="c@example.com")
+        self.factory = APIRequestFactory()
+
+    def authenticate(self, token):
+        request = self.factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return CachedJWTAuthentication().authenticate(Request(request))[0]
+
+    def test_user_is_loaded_once(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            self.authenticate(token)
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+        self.assertEqual((user.pk, user.username, user.email), (self.user.pk, "cached", "c@example.com"))
+
+        # Another worker finds it in Redis
+        clear_local_cache()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(token).username, "cached")
+
+        # The password hash isn't cached, but is still there if read
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password("secret"))
+
+    def test_entries_never_outlive_the_token(self):
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=timedelta(seconds=90))
+        self.authenticate(token)
+        self.assertLessEqual(self.redis.ttls[user_key(self.user.pk)], 90)
+
+        # The token is still validated on a cache hit
+        token.set_exp(lifetime=timedelta(seconds=-1))
+        with self.assertRaises(InvalidToken):
+            self.authenticate(token)
+
+    def test_saving_the_user_drops_the_cache(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertNotIn(user_key(self.user.pk), self.redis.data)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_inactive_user_in_redis_is_refused(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        # Deactivated from another process: only the Redis entry was dropped there
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.redis.delete(user_key(self.user.pk))
+        clear_local_cache()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_revoked_tokens_stay_revoked(self):
+        # simplejwt reads its settings once, so they are patched in place
+        with mock.patch.object(api_settings, "CHECK_REVOKE_TOKEN", True):
+            token = AccessToken.for_user(self.user)
+            self.authenticate(token)
+            self.user.set_password("changed")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.save()
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate(token)
+            # A new token for the new password is cached with its hash
+            token = AccessToken.for_user(self.user)
+            self.authenticate(token)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.authenticate(token).pk, self.user.pk)
+
+    def test_works_without_redis(self):
+        with self.settings(AUTH_USER_CACHE_TTL=0):
+            token = AccessToken.for_user(self.user)
+            self.authenticate(token)
+            self.assertEqual(self.redis.data, {})
+            with self.assertNumQueries(0):
+                self.authenticate(token)
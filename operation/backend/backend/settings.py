@@ -54,7 +54,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
     ),
 }
 
@@ -110,6 +110,31 @@ REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = os.environ.get("REDIS_PORT", 6379)
 REDIS_DB = os.environ.get("REDIS_DB", 0)
 
+# Redis cache of the paginated relationship lists (api.cache)
+RELATIONSHIP_CACHE_ENABLED = os.environ.get("RELATIONSHIP_CACHE_ENABLED", "true").lower() == "true"
+RELATIONSHIP_CACHE_TTL = 60 * 60 * 12
+
+# Seconds the user of a JWT stays cached (authentication.authentication), in
+# each process and in Redis; never longer than the token. 0 turns a cache off
+AUTH_USER_CACHE_LOCAL_TTL = int(os.environ.get("AUTH_USER_CACHE_LOCAL_TTL", 30))
+AUTH_USER_CACHE_TTL = int(os.environ.get("AUTH_USER_CACHE_TTL", 300))
+
+# Serve the hot read endpoints with the async views of api.async_views. Turn
+# on when running under the ASGI server: uvicorn backend.asgi:application
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "false").lower() == "true"
+
+# Request budgets of the server-side Instagram fetcher (api.ratelimit), in
+# requests per second and burst size, per Instagram session and overall
+INSTAGRAM_SESSION_RATE = float(os.environ.get("INSTAGRAM_SESSION_RATE", 0.5))
+INSTAGRAM_SESSION_BURST = int(os.environ.get("INSTAGRAM_SESSION_BURST", 5))
+INSTAGRAM_GLOBAL_RATE = float(os.environ.get("INSTAGRAM_GLOBAL_RATE", 10))
+INSTAGRAM_GLOBAL_BURST = int(os.environ.get("INSTAGRAM_GLOBAL_BURST", 20))
+
+# Fields kept from the user dicts of a fetched list (see api.edges.PROFILE_DEFAULTS)
+INSTAGRAM_PROFILE_FIELDS = os.environ.get(
+    "INSTAGRAM_PROFILE_FIELDS", "username,full_name,profile_pic_url,is_private,is_verified"
+).split(",")
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -126,9 +151,6 @@ DATABASES = {
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760
 
-from django.core.asgi import get_asgi_application
-application = get_asgi_application()
-
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
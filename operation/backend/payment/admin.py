@@ -1,6 +1,8 @@
 from django import forms
 from django.contrib import admin
-from .models import Payment, UserCredit, PaymentHistory
+from django.db.models import F
+from .models import Payment, UserCredit, PaymentHistory, CreditEntry
+from .ledger import validate_payments
 from django.utils.html import format_html
 from django.urls import path, reverse
 from django.http import HttpResponseRedirect
@@ -27,18 +29,13 @@ class PaymentAdmin(admin.ModelAdmin):
 
     def validate_payment(self, request, queryset):
       """Mark the selected payments as validated (bulk action)."""
-      for payment in queryset:
-          if payment.status != 'validated':  # Check status before proceeding
-              payment.status = 'validated'
-              payment.validated_at = payment.created_at
-              payment.save()  # Save payment changes
+      # One transaction with bulk inserts, however many payments are selected
+      validated = validate_payments(queryset, validated_at=F('created_at'))
+      skipped = queryset.count() - validated
+      if skipped:
+          self.message_user(request, f"{skipped} of the selected payments were already validated.")
 
-              # Add credits and create history (using get_or_create is redundant here because of signal)
-              # Signal will handle it. No need for manual history or credit update.
-          else:
-              self.message_user(request, f"Payment {payment.id} is already validated.")
-
-      self.message_user(request, "Selected payments have been processed.")
+      self.message_user(request, f"{validated} payments have been validated.")
 
     validate_payment.short_description = "Validate Selected Payments"
 
@@ -57,9 +54,7 @@ class PaymentAdmin(admin.ModelAdmin):
         if payment.status == 'validated':
             self.message_user(request, "Payment has already been validated.")
         else:
-            payment.status = 'validated'
-            payment.validated_at = payment.created_at  # Use current time or creation time
-            payment.save()  # This will trigger the post_save signal
+            validate_payments(Payment.objects.filter(pk=payment.pk), validated_at=F('created_at'))
 
             self.message_user(request, "Payment has been validated.")
 
@@ -96,6 +91,23 @@ class PaymentHistoryAdmin(admin.ModelAdmin):
 
 
 
+# Admin page for the credit ledger, which is only ever added to
+class CreditEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'amount', 'reason', 'key', 'created_at')
+    list_filter = ('reason', 'created_at')
+    search_fields = ('user__username', 'key')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # Register models with the admin site
 admin.site.register(UserCredit, UserCreditAdmin)
 admin.site.register(PaymentHistory, PaymentHistoryAdmin)
+admin.site.register(CreditEntry, CreditEntryAdmin)
@@ -0,0 +1,114 @@
+"""Credit and debit users' balances through the CreditEntry ledger.
+
+Every change of a balance adds a CreditEntry with a unique key, and moves
+UserCredit.balance with an UPDATE ... SET balance = balance + x in the same
+transaction. Nothing reads a balance to write it back, so concurrent
+validations and upgrades can't lose a change, and a key that was used
+already changes nothing.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils.timezone import now
+from .models import CreditEntry, Payment, PaymentHistory, UserCredit
+
+BATCH_SIZE = 500
+
+
+class InsufficientCredits(Exception):
+    pass
+
+
+def chunks(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def payment_key(payment_id):
+    return f"payment:{payment_id}"
+
+
+def add_to_balances(amounts):
+    """Add {user id: amount} to the users' balances, creating missing balances."""
+    user_ids = sorted(amounts)
+    UserCredit.objects.bulk_create([UserCredit(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+    for batch in chunks(user_ids):
+        # Lock the balances in user order first, so that two transactions
+        # crediting the same users wait for each other instead of deadlocking
+        list(UserCredit.objects.select_for_update().filter(user_id__in=batch).order_by('user_id').values_list('pk', flat=True))
+        UserCredit.objects.filter(user_id__in=batch).update(balance=F('balance') + Case(
+            *[When(user_id=user_id, then=Value(amounts[user_id])) for user_id in batch],
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ))
+
+
+def credit_payments(payment_ids):
+    """Credit the users of validated payments that weren't credited yet.
+
+    Adds the ledger entries, the PaymentHistory records and the balances in
+    bulk. Runs in the caller's transaction, which must be one: the payment
+    rows stay locked until it ends, so a payment is credited once even if
+    two transactions credit it. Returns the number of payments credited.
+    """
+    credited = 0
+    amounts = defaultdict(Decimal)
+    for batch in chunks(sorted(payment_ids)):
+        payments = list(
+            Payment.objects.select_for_update()
+            .filter(pk__in=batch, status='validated')
+            .order_by('pk')
+            .values('id', 'user_id', 'credit_amount')
+        )
+        done = set(CreditEntry.objects.filter(key__in=[payment_key(p['id']) for p in payments]).values_list('key', flat=True))
+        payments = [p for p in payments if payment_key(p['id']) not in done]
+
+        CreditEntry.objects.bulk_create([
+            CreditEntry(user_id=p['user_id'], amount=p['credit_amount'] or 0, reason='payment', key=payment_key(p['id']))
+            for p in payments
+        ])
+        PaymentHistory.objects.bulk_create([
+            PaymentHistory(user_id=p['user_id'], payment_id=p['id'], credits_added=p['credit_amount'])
+            for p in payments
+        ])
+        for p in payments:
+            amounts[p['user_id']] += p['credit_amount'] or 0
+        credited += len(payments)
+
+    if amounts:
+        add_to_balances(amounts)
+    return credited
+
+
+def validate_payments(queryset, validated_at=None):
+    """Validate the payments of queryset that aren't yet, and credit their users.
+
+    One transaction, whatever the number of payments. Returns the number
+    of payments validated.
+    """
+    with transaction.atomic():
+        payment_ids = list(queryset.select_for_update().exclude(status='validated').order_by('pk').values_list('pk', flat=True))
+        for batch in chunks(payment_ids):
+            # An UPDATE doesn't send post_save: credit_payments does the crediting
+            Payment.objects.filter(pk__in=batch).update(status='validated', validated_at=validated_at or now())
+        credit_payments(payment_ids)
+    return len(payment_ids)
+
+
+def spend_credits(user, amount, reason, key):
+    """Take amount from the user's balance and record it under key.
+
+    Returns False, and takes nothing, if key was spent already. Raises
+    InsufficientCredits if the balance is below amount.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                CreditEntry.objects.create(user=user, amount=-amount, reason=reason, key=key)
+        except IntegrityError:
+            return False
+
+        # The balance is checked and taken in one statement
+        if not UserCredit.objects.filter(user=user, balance__gte=amount).update(balance=F('balance') - amount):
+            raise InsufficientCredits()
+    return True
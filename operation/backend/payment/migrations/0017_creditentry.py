@@ -0,0 +1,50 @@
+# Generated by Django 5.1.5 on 2025-05-07 09:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_ledger(apps, schema_editor):
+    """Record the payments credited so far, and what the balances hold besides them."""
+    CreditEntry = apps.get_model('payment', 'CreditEntry')
+    PaymentHistory = apps.get_model('payment', 'PaymentHistory')
+    UserCredit = apps.get_model('payment', 'UserCredit')
+
+    CreditEntry.objects.bulk_create([
+        CreditEntry(user_id=user_id, amount=credits or 0, reason='payment', key=f"payment:{payment_id}")
+        for user_id, payment_id, credits in PaymentHistory.objects.values_list('user_id', 'payment_id', 'credits_added').iterator()
+    ], batch_size=1000)
+
+    # The subscriptions paid so far left no record: an opening entry makes
+    # every user's entries add up to their balance
+    credited = dict(PaymentHistory.objects.order_by().values('user_id').annotate(total=Sum('credits_added')).values_list('user_id', 'total'))
+    CreditEntry.objects.bulk_create([
+        CreditEntry(user_id=user_id, amount=balance - (credited.get(user_id) or 0), reason='opening', key=f"opening:{user_id}")
+        for user_id, balance in UserCredit.objects.values_list('user_id', 'balance').iterator()
+        if balance != (credited.get(user_id) or 0)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0016_alter_payment_credit_amount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reason', models.CharField(choices=[('opening', 'Opening balance'), ('payment', 'Payment'), ('premium', 'Premium subscription'), ('vip', 'VIP subscription')], max_length=10)),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
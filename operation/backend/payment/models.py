@@ -1,6 +1,6 @@
 
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -57,41 +57,48 @@ class PaymentHistory(models.Model):
         return f"{self.user.username} - {self.credits_added} credits on {self.timestamp}"
 
 
+class CreditEntry(models.Model):
+    """One change of a user's credit balance.
+
+    Entries are only ever added. UserCredit.balance is the sum of a user's
+    entries, kept by the functions of payment.ledger in the transaction
+    that adds them. The key makes each credit or debit happen once: a
+    payment is credited under "payment:<id>", however often it is saved
+    or validated.
+    """
+    REASON_CHOICES = [
+        ('opening', 'Opening balance'),
+        ('payment', 'Payment'),
+        ('premium', 'Premium subscription'),
+        ('vip', 'VIP subscription'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reason = models.CharField(max_length=10, choices=REASON_CHOICES)
+    key = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.amount:+} credits ({self.reason})"
+
+
 # Signal to update user credits when a payment is validated
 @receiver(post_save, sender=Payment)
 def update_user_credit(sender, instance, created, **kwargs):
     """
     Automatically update user credits and payment history when a payment is validated.
+
+    Crediting is idempotent (see payment.ledger), so saving a validated
+    payment again adds nothing.
     """
     if instance.status == 'validated':
-        # Ensure that the user exists in the UserCredit model
-        user_credit, _ = UserCredit.objects.get_or_create(user=instance.user)
-
-        # Update user balance based on payment's credit amount
-        user_credit.balance += instance.credit_amount
-        user_credit.save()
-
-        # Update validation timestamp
-        if not instance.validated_at:
-            instance.validated_at = now()
-            instance.save()
-
-        # Create a payment history record
-        PaymentHistory.objects.create(
-            user=instance.user,
-            payment=instance,
-            credits_added=instance.credit_amount
-        )
-
-
-
-
-
-
-
-
-
-
-
+        from .ledger import credit_payments
 
+        with transaction.atomic():
+            # Update validation timestamp, without saving (and signalling) again
+            if not instance.validated_at:
+                instance.validated_at = now()
+                Payment.objects.filter(pk=instance.pk, validated_at=None).update(validated_at=instance.validated_at)
 
+            credit_payments([instance.pk])
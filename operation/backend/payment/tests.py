@@ -1,3 +1,119 @@
+from decimal import Decimal
+from unittest import mock
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from subscription.models import Subscription
+from subscription.views import change_subscription_to_premium, change_subscription_to_vip
+from .admin import PaymentAdmin
+from .ledger import InsufficientCredits, spend_credits, validate_payments
+from .models import CreditEntry, Payment, PaymentHistory, UserCredit
 
-# Create your tests here.
+
+class CreditLedgerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="payer", password="testpassword")
+
+    def pay(self, user=None, credit_amount=5, status='pending'):
+        return Payment.objects.create(user=user or self.user, card_number="1234", credit_amount=credit_amount, status=status)
+
+    def balance(self, user=None):
+        return UserCredit.objects.get(user=user or self.user).balance
+
+    def assertLedgerMatchesBalances(self):
+        for credit in UserCredit.objects.all():
+            entries = CreditEntry.objects.filter(user=credit.user_id).aggregate(total=Sum('amount'))['total'] or 0
+            self.assertEqual(entries, credit.balance)
+
+    def test_saving_a_validated_payment_credits_it_once(self):
+        payment = self.pay()
+        self.assertFalse(UserCredit.objects.exists())
+
+        payment.status = 'validated'
+        payment.save()
+        payment.save()
+        self.pay(credit_amount=1, status='validated')
+
+        self.assertEqual(self.balance(), 6)
+        self.assertEqual(PaymentHistory.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(CreditEntry.objects.get(key=f"payment:{payment.pk}").amount, 5)
+        payment.refresh_from_db()
+        self.assertIsNotNone(payment.validated_at)
+        self.assertLedgerMatchesBalances()
+
+    def test_bulk_validation_is_a_fixed_number_of_queries(self):
+        others = [User.objects.create_user(username=f"payer{i}") for i in range(3)]
+        self.pay(user=others[0], credit_amount=1, status='validated')
+        already = self.pay(status='validated')
+
+        def validate(count):
+            for i in range(count):
+                self.pay(user=others[i % 3], credit_amount=(5, 1)[i % 2])
+            with CaptureQueriesContext(connection) as queries:
+                validated = validate_payments(Payment.objects.all())
+            self.assertEqual(validated, count)
+            return len(queries)
+
+        self.assertEqual(validate(3), validate(60))
+        for user in others:
+            paid = Payment.objects.filter(user=user).aggregate(total=Sum('credit_amount'))['total']
+            self.assertEqual(self.balance(user), paid)
+        self.assertEqual(self.balance(), 5)
+        self.assertLedgerMatchesBalances()
+        self.assertEqual(PaymentHistory.objects.count(), 65)
+        self.assertFalse(Payment.objects.exclude(status='validated').exists())
+        self.assertEqual(CreditEntry.objects.filter(key=f"payment:{already.pk}").count(), 1)
+
+        # Validating again credits nothing
+        self.assertEqual(validate_payments(Payment.objects.all()), 0)
+        self.assertEqual(self.balance(), 5)
+
+    def test_admin_action_validates_the_selection(self):
+        pending = [self.pay() for _ in range(3)]
+        admin = PaymentAdmin(Payment, AdminSite())
+        with mock.patch.object(PaymentAdmin, "message_user") as message_user:
+            admin.validate_payment(None, Payment.objects.filter(pk__in=[p.pk for p in pending[:2]]))
+        message_user.assert_called_with(None, "2 payments have been validated.")
+        self.assertEqual(self.balance(), 10)
+        validated = Payment.objects.get(pk=pending[0].pk)
+        self.assertEqual(validated.validated_at, validated.created_at)
+        self.assertEqual(Payment.objects.get(pk=pending[2].pk).status, 'pending')
+
+    def test_spending_is_checked_and_keyed(self):
+        UserCredit.objects.create(user=self.user, balance=12)
+        self.assertTrue(spend_credits(self.user, 10, 'premium', "subscription:1"))
+        self.assertFalse(spend_credits(self.user, 10, 'premium', "subscription:1"))
+        with self.assertRaises(InsufficientCredits):
+            spend_credits(self.user, 10, 'premium', "subscription:2")
+        self.assertEqual(self.balance(), 2)
+        self.assertFalse(CreditEntry.objects.filter(key="subscription:2").exists())
+
+    def test_subscription_upgrades_are_idempotent(self):
+        for _ in range(4):
+            self.pay(credit_amount=5, status='validated')
+        factory = APIRequestFactory()
+
+        def post(view, key):
+            request = factory.post("/api/subscription/", HTTP_IDEMPOTENCY_KEY=key)
+            force_authenticate(request, user=self.user)
+            return view(request)
+
+        self.assertEqual(post(change_subscription_to_premium, "a").status_code, 200)
+        self.assertEqual(post(change_subscription_to_premium, "a").data["message"], "Subscription already changed to Premium by this request.")
+        self.assertEqual(self.balance(), 10)
+        self.assertEqual(Subscription.objects.get(user=self.user).plan, 'premium')
+
+        response = post(change_subscription_to_vip, "b")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balance(), 10)
+        self.assertEqual(Subscription.objects.get(user=self.user).plan, 'premium')
+        self.assertEqual(CreditEntry.objects.filter(user=self.user, amount__lt=0).aggregate(total=Sum('amount'))['total'], Decimal(-10))
+        self.assertLedgerMatchesBalances()
+
+        response = post(change_subscription_to_premium, "k" * 65)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balance(), 10)
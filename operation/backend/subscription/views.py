@@ -1,13 +1,19 @@
+import uuid
+from django.db import transaction
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from authentication.authentication import CachedJWTAuthentication
 from .models import Subscription
 from django.utils.timezone import timedelta , now
-from payment.models import UserCredit
+from payment.ledger import InsufficientCredits, spend_credits
+
+# With the "subscription:<user id>:" prefix, fits CreditEntry.key
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_active_subscription(request):
     subscription = Subscription.objects.filter(user=request.user, end_date__gt=now()).first()
@@ -26,7 +32,7 @@ def get_active_subscription(request):
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_all_subscriptions(request):
     subscriptions = Subscription.objects.filter(user=request.user)
@@ -47,102 +53,58 @@ def get_all_subscriptions(request):
 
 
 
-@api_view(['POST'])
-@authentication_classes([JWTAuthentication])
-@permission_classes([IsAuthenticated])
-def change_subscription_to_premium(request):
-    try:
-        # Check if the user already has an active subscription (either trial, premium, or vip)
-        subscription = Subscription.objects.filter(user=request.user, end_date__gt=now()).first()
-        
-        # Check if the user has enough credits to upgrade
-        user_credit = UserCredit.objects.filter(user=request.user).first()
-        if user_credit and user_credit.balance >= 10:
-            # If the user has an active trial subscription, upgrade it to premium
-            if subscription:
-                # Update the subscription to premium
-                subscription.plan = 'premium'
-                subscription.end_date = now() + timedelta(days=30)  # 1 month from now
-                subscription.credits_reduced = 10  # Deduct 10 credits for the premium upgrade
-                subscription.save()
-                # Deduct 10 credits from the user's balance
-                user_credit.balance -= 10
-                user_credit.save()
-
-                return Response({"message": "Subscription upgraded to Premium and 10 credits deducted."})
-
-            # If the user does not have any active subscription, create a new premium subscription
-            else:
-                # Deduct 10 credits from the user's balance
-                user_credit.balance -= 10
-                user_credit.save()
-
-                # Create a new premium subscription with 1 month duration
-                Subscription.objects.create(
-                    user=request.user,
-                    plan='premium',
-                    end_date=now() + timedelta(days=30),
-                    credits_reduced=10  # Deduct 10 credits for creating a new premium subscription
-                )
+def change_subscription(request, plan, cost, name):
+    """
+    Helper function to upgrade the active subscription to plan, or create one, for cost credits.
 
-                return Response({"message": "No active subscription found. New Premium subscription created and 10 credits deducted."})
+    The credits are taken from the ledger under the request's Idempotency-Key
+    header, if it sends one: a retried request changes nothing the second time.
+    """
+    idempotency_key = request.headers.get('Idempotency-Key') or str(uuid.uuid4())
+    if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return Response({"error": f"Idempotency-Key must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters."}, status=400)
 
-        else:
-            return Response({"message": "Insufficient credits to upgrade or create Premium subscription."}, status=400)
+    try:
+        with transaction.atomic():
+            # Deduct the credits from the user's balance
+            if not spend_credits(request.user, cost, plan, f"subscription:{request.user.pk}:{idempotency_key}"):
+                return Response({"message": f"Subscription already changed to {name} by this request."})
 
-    except Subscription.DoesNotExist:
-        return Response({"message": "Subscription not found."}, status=404)
+            # Check if the user already has an active subscription (either trial, premium, or vip)
+            subscription = Subscription.objects.select_for_update().filter(user=request.user, end_date__gt=now()).first()
 
+            # If the user has an active subscription, upgrade it
+            if subscription:
+                subscription.plan = plan
+                subscription.end_date = now() + timedelta(days=30)  # 1 month from now
+                subscription.credits_reduced = cost
+                subscription.save()
 
+                return Response({"message": f"Subscription upgraded to {name} and {cost} credits deducted."})
 
+            # If the user does not have any active subscription, create a new one with 1 month duration
+            Subscription.objects.create(
+                user=request.user,
+                plan=plan,
+                end_date=now() + timedelta(days=30),
+                credits_reduced=cost
+            )
 
+            return Response({"message": f"No active subscription found. New {name} subscription created and {cost} credits deducted."})
 
+    except InsufficientCredits:
+        return Response({"message": f"Insufficient credits to upgrade or create {name} subscription."}, status=400)
 
 
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def change_subscription_to_premium(request):
+    return change_subscription(request, 'premium', 10, 'Premium')
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def change_subscription_to_vip(request):
-    try:
-        # Check if the user already has an active subscription (either trial, premium, or vip)
-        subscription = Subscription.objects.filter(user=request.user, end_date__gt=now()).first()
-        
-        # Check if the user has enough credits to upgrade
-        user_credit = UserCredit.objects.filter(user=request.user).first()
-        if user_credit and user_credit.balance >= 15:
-            # If the user has an active trial subscription, upgrade it to vip
-            if subscription:
-                # Update the subscription to vip
-                subscription.plan = 'vip'
-                subscription.end_date = now() + timedelta(days=30)  # 1 month from now
-                subscription.credits_reduced = 15  # Deduct 15 credits for the vip upgrade
-                subscription.save()
-                # Deduct 15 credits from the user's balance
-                user_credit.balance -= 15
-                user_credit.save()
-
-                return Response({"message": "Subscription upgraded to VIP and 15 credits deducted."})
-
-            # If the user does not have any active subscription, create a new vip subscription
-            else:
-                # Deduct 15 credits from the user's balance
-                user_credit.balance -= 15
-                user_credit.save()
-
-                # Create a new vip subscription with 1 month duration
-                Subscription.objects.create(
-                    user=request.user,
-                    plan='vip',
-                    end_date=now() + timedelta(days=30),
-                    credits_reduced=15  # Deduct 15 credits for creating a new vip subscription
-                )
-
-                return Response({"message": "No active subscription found. New VIP subscription created and 15 credits deducted."})
-
-        else:
-            return Response({"message": "Insufficient credits to upgrade or create VIP subscription."}, status=400)
-
-    except Subscription.DoesNotExist:
-        return Response({"message": "Subscription not found."}, status=404)
\ No newline at end of file
+    return change_subscription(request, 'vip', 15, 'VIP')